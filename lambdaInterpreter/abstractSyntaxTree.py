@@ -1,9 +1,19 @@
 from environment import Env
+from lexer import Span
+from deBruijn import DBExpr, BoundVar, FreeVar, DBBinder, DBAbstraction, DBProduct, DBApplication, DBStar, DBSquare
+from normalization import normalize
+from erasure import normalize_erased
+from machine import Machine, reduce, reduce_within, Strategy
+from compilation import normalize as normalize_compiled
+from native import accelerate
+from conversion import whnf, convertible
+from normalForms import NORMAL_FORMS, TYPE_CACHE, normal_form_key, normalize_cached
+from instrumentation import TRACE
 from abc import ABC
 from dataclasses import dataclass
-from typing import List, Tuple, Set, Dict, Self, Type
+from typing import List, Tuple, Set, FrozenSet, Dict, Self, Type, ClassVar, Optional
 from enum import Enum, auto
-from copy import copy, deepcopy
+from copy import deepcopy
 4
 
 class ASTError(Exception):
@@ -24,17 +34,66 @@ class BetaReductionError(Exception):
 class TypeInferenceError(Exception):
     pass
 
+class Engine(Enum):
+    SUBSTITUTION = auto() # stepwise Substitution rewriting with per step type checks
+    NBE = auto() # normalization by evaluation on de Bruijn terms
+    ERASURE = auto() # type check once, then normalize by evaluation without annotations
+    MACHINE = auto() # iterative normal order abstract machine, for deeply nested terms
+    LAZY = auto() # the same machine with call by need, arguments are shared between their uses
+    COMPILED = auto() # terms compiled to Python closures, see compilation.py
+
+# What a node is. The walkers that only read nodes (expr_to_de_bruijn, the printer)
+# dispatch on it and not on the class, so they also read any view with the same kinds
+# and fields, see arena.Node, which has none of the rewriting methods.
+class Kind(Enum):
+    PROGRAM = auto()
+    VARIABLE = auto()
+    APPLICATION = auto()
+    ABSTRACTION = auto()
+    PRODUCT = auto()
+    SUBSTITUTION = auto()
+    STAR = auto()
+    SQUARE = auto()
+
 def find_fresh_name(name: str, conflicting: Set[str]) -> str:
     i = 1
     while True:
         if name + str(i) not in conflicting: return name + str(i)
         i += 1
 
+# Per node caches (free variables, de Bruijn form). The rewrites mutate nodes in place,
+# a rewritten node drops its caches and so does every ancestor on the way back up the
+# rewrite. The only nodes shared between parents are substituted terms held by pending
+# substitutions, each variable they replace gets its own copy (see do_substitution), and
+# rewrites inside them keep their free variables and de Bruijn form, so no node goes stale.
+class Cached():
+    def __init__(self, value):
+        self.value = value
+    def __deepcopy__(self, memo):
+        return self # immutable, copies share it
+
+CACHES = ("free_vars_cache", "de_bruijn_cache")
+
 @dataclass
 class Expr(ABC):
+    span: ClassVar[Optional[Span]] = None # set per node by the parser, not part of equality
+    def cached(self, key: str):
+        cached = self.__dict__.get(key)
+        return None if cached is None else cached.value
+    def invalidate(self):
+        for key in CACHES: self.__dict__.pop(key, None)
+    # written by the streaming printer, which imports this module and so is imported here
     def to_str(self) -> str:
-        pass
-    def get_free_vars(self) -> Set[str]:
+        from printer import to_text
+        return to_text(self)
+    def get_free_vars(self) -> FrozenSet[str]:
+        free_vars = self.cached("free_vars_cache")
+        if free_vars is None:
+            free_vars = self.collect_free_vars()
+            self.__dict__["free_vars_cache"] = Cached(free_vars)
+        elif TRACE.enabled: TRACE.event("free_vars_cache_hits")
+        return free_vars
+    def collect_free_vars(self) -> FrozenSet[str]:
         pass
     def naive_alpha_renaming(self, old: str, new: str):
         pass
@@ -42,68 +101,148 @@ class Expr(ABC):
         pass
     def alpha_equals(self, other: Self, var_renaming: Dict[str, str]) -> bool:
         pass
+    # Gamma: types of the free variables of self, the inference runs on the de Bruijn form
     def infer_type(self, Gamma: Dict[str, Self]) -> Self:
-        pass
+        return expr_from_de_bruijn(infer_de_bruijn(self.to_de_bruijn(), gamma_to_de_bruijn(Gamma)))
     def one_beta_normal_reduction(self, Gamma: Dict[str, Self]) -> bool | Self:
         pass
+    # bound: de Bruijn levels of the names bound around self, depth: number of those binders.
+    # Without binders around it the term is cached. Hash consing makes it an alpha invariant
+    # key: alpha equal expressions convert to the identical DBExpr, compared by identity.
+    def to_de_bruijn(self, bound: Dict[str, int] = {}, depth: int = 0) -> DBExpr:
+        if bound or depth: return expr_to_de_bruijn(self, bound, depth)
+        term = self.cached("de_bruijn_cache")
+        if term is None:
+            term = expr_to_de_bruijn(self, bound, depth)
+            self.__dict__["de_bruijn_cache"] = Cached(term)
+        return term
+    # Inside an inference only closed subterms are looked up, see infer_de_bruijn.
+    # At the top self is looked up with the typing of its free variables as well.
+    def infer_type_cached(self, Gamma: Dict[str, Self], top: bool = False) -> Self:
+        if self.kind == Kind.SUBSTITUTION: return self.infer_type(Gamma)
+        key = type_cache_key(self, Gamma) if top else None
+        return expr_from_de_bruijn(infer_de_bruijn(self.to_de_bruijn(), gamma_to_de_bruijn(Gamma), key))
+
+# what normalForms.save and load persist
+TERM_CACHES = {"normal_forms": NORMAL_FORMS, "types": TYPE_CACHE}
+
+def type_cache_key(expr: Expr, Gamma: Dict[str, Expr]) -> Tuple | None:
+    term = expr.to_de_bruijn({}, 0)
+    context: Dict[str, DBExpr] = {}
+    todo = list(term.get_free_names())
+    while todo:
+        name = todo.pop()
+        if name in context: continue
+        if name not in Gamma: return None
+        context[name] = Gamma[name].to_de_bruijn({}, 0)
+        todo += context[name].get_free_names()
+    return (term, tuple(sorted(context.items(), key=lambda item: item[0])))
 
 @dataclass
 class Program(Expr):
     program: Expr
-    def to_str(self) -> str:
-        return self.program.to_str()
-    def get_free_vars(self) -> Set[str]:
+    kind: ClassVar[Kind] = Kind.PROGRAM
+    # the rewrites change the program in place, read only views are converted first
+    def __post_init__(self):
+        if not isinstance(self.program, Expr):
+            raise TypeError(f"Programs hold Expr nodes, not {type(self.program).__name__}")
+    def collect_free_vars(self) -> FrozenSet[str]:
         return self.program.get_free_vars()
     def naive_alpha_renaming(self, old: str, new: str):
         self.program.naive_alpha_renaming(old, new)
     def find_unconflicting_subs(self) -> bool:
-        program_last = self.program.find_unconflicting_subs()
-        if program_last and isinstance(self.program, Substitution):
-            self.program = deepcopy(self.program.do_substitution())
-            return False
+        self.program, program_last = settle(self.program)
+        if not program_last: self.invalidate()
         return program_last
     def alpha_equals(self, other: Self, var_renaming: Dict[str, str] = {}) -> bool:
-        print("al eq")
+        if TRACE.enabled: TRACE.event("alpha_checks")
         if not isinstance(other, Program): return False
-        self_free_vars = self.get_free_vars()
-        other_free_vars = other.get_free_vars()
-        if self_free_vars != other_free_vars: return False
-        var_renaming = dict(zip(self_free_vars, self_free_vars))
-        return self.program.alpha_equals(other.program, var_renaming)
+        if self.program is other.program: return True
+        return self.to_de_bruijn() is other.to_de_bruijn()
+    # inference only weak head normalizes, the type handed out is normalized once here
     def infer_type(self, Gamma: Dict[str, Expr] = {}) -> Expr:
-        print("infer type")
-        return self.program.infer_type(Gamma)
+        with TRACE.phase("infer_type"):
+            return expr_from_de_bruijn(normalize_cached(self.program.infer_type_cached(Gamma, top=True).to_de_bruijn(), Engine.NBE.name, None, normalize))
     def one_beta_normal_reduction(self, Gamma: Dict[str, Expr] = {}) -> bool | Expr:
-        print("begin one red step")
         return_value =  self.program.one_beta_normal_reduction(Gamma)
-        if isinstance(return_value, bool): return return_value
-        self.program = deepcopy(return_value) ## deepcopy
-        print("end one red step")
+        if isinstance(return_value, bool):
+            if return_value: self.invalidate()
+            return return_value
+        self.program = return_value
+        self.invalidate()
         return True
-    def to_beta_normal_form(self, Gamma: Dict[str, Expr] = {}):
-        while not self.find_unconflicting_subs(): pass
-        while self.one_beta_normal_reduction(Gamma): 
+    # names defined in defs are unfolded lazily by the NBE, MACHINE, LAZY and COMPILED engines and linked in up front otherwise,
+    # native computes arithmetic and logic on Church literals with Python ints and bools first.
+    # A budget of machine transitions (steps) or seconds needs the MACHINE or LAZY engine: once it runs
+    # out the program is left as it is and the paused machine is returned, see Machine.run and Machine.dump
+    def to_beta_normal_form(self, Gamma: Dict[str, Expr] = {}, engine: Engine = Engine.NBE, defs: Env | None = None, native: bool = False, steps: int | None = None, seconds: float | None = None) -> Machine | None:
+        with TRACE.phase("normalize"):
+            if native:
+                self.program = expr_from_de_bruijn(accelerate(self.to_de_bruijn(), defs))
+                self.invalidate()
+            if steps is not None or seconds is not None:
+                if engine not in (Engine.MACHINE, Engine.LAZY):
+                    raise BetaReductionError(f"Budgets need the MACHINE or LAZY engine, not {engine.name}")
+                key = normal_form_key(self.to_de_bruijn(), engine.name, defs)
+                reduced = NORMAL_FORMS.lookup(key)
+                if reduced is None:
+                    reduced = reduce_within(self.to_de_bruijn(), defs, Strategy.NAME if engine == Engine.MACHINE else Strategy.NEED, steps, seconds)
+                    if isinstance(reduced, Machine): return reduced
+                    NORMAL_FORMS.store(key, reduced)
+                self.program = expr_from_de_bruijn(reduced)
+                self.invalidate()
+                return
+            if engine == Engine.NBE:
+                term = normalize_cached(self.to_de_bruijn(), engine.name, defs, normalize)
+                self.program = expr_from_de_bruijn(term)
+                self.invalidate()
+                return
+            if engine == Engine.COMPILED:
+                term = normalize_cached(self.to_de_bruijn(), engine.name, defs, normalize_compiled)
+                self.program = expr_from_de_bruijn(term)
+                self.invalidate()
+                return
+            if engine in (Engine.MACHINE, Engine.LAZY):
+                strategy = Strategy.NAME if engine == Engine.MACHINE else Strategy.NEED
+                term = normalize_cached(self.to_de_bruijn(), engine.name, defs, lambda term, defs: reduce(term, defs, strategy))
+                self.program = expr_from_de_bruijn(term)
+                self.invalidate()
+                return
+            if defs is not None:
+                term = self.to_de_bruijn().replace_free(defs.linked())
+                self.program = expr_from_de_bruijn(term)
+                self.invalidate()
+            if engine == Engine.ERASURE:
+                term = self.to_de_bruijn()
+                self_type = Program.from_de_bruijn(term).infer_type(Gamma).to_de_bruijn({}, 0)
+                gamma = {name : var_type.to_de_bruijn({}, 0) for name, var_type in Gamma.items()}
+                term = normalize_erased(term, self_type, gamma)
+                self.program = expr_from_de_bruijn(term)
+                self.invalidate()
+                return
             while not self.find_unconflicting_subs(): pass
+            while self.one_beta_normal_reduction(Gamma): 
+                while not self.find_unconflicting_subs(): pass
+    @classmethod
+    def from_de_bruijn(cls, term: DBExpr) -> Self:
+        return cls(program=expr_from_de_bruijn(term))
 
 # id
 @dataclass
 class Variable(Expr):
     id: str
-    def to_str(self) -> str:
-        return self.id
-    def get_free_vars(self) -> Set[str]:
-        return {self.id}
+    kind: ClassVar[Kind] = Kind.VARIABLE
+    def collect_free_vars(self) -> FrozenSet[str]:
+        return frozenset((self.id,))
     def naive_alpha_renaming(self, old: str, new: str):
-        if self.id == old: self.id = new
+        if self.id == old:
+            self.id = new
+            self.invalidate()
     def find_unconflicting_subs(self) -> bool:
         return True
     def alpha_equals(self, other: Self, var_renaming: Dict[str, str]) -> bool:
         if not isinstance(other, Variable): return False
         return self.id == var_renaming[other.id]
-    def infer_type(self, Gamma: Dict[str, Expr]) -> Expr:
-        if self.id not in set(Gamma.keys()):
-            raise TypeInferenceError("Free Variable in infered typing expr")
-        return Gamma[self.id]
     def one_beta_normal_reduction(self, Gamma: Dict[str, Expr]) -> bool | Expr:
         return False
     
@@ -112,38 +251,38 @@ class BetaReduceable(Expr, ABC):
     param: str
     param_type: Expr
     body: Expr
-    def to_str(self) -> str:
-        pass
-    def get_free_vars(self) -> Set[str]:
+    def collect_free_vars(self) -> FrozenSet[str]:
         return (self.body.get_free_vars().union(self.param_type.get_free_vars())) - {self.param}
     def naive_alpha_renaming(self, old: str, new: str):
         self.param_type.naive_alpha_renaming(old, new)
         if self.param != old:
             # self.param_type.naive_alpha_renaming(old, new)
             self.body.naive_alpha_renaming(old, new)
+        self.invalidate()
     def find_unconflicting_subs(self) -> bool:
-        type_last = self.param_type.find_unconflicting_subs()
-        body_last = self.body.find_unconflicting_subs()
-        if type_last and isinstance(self.param_type, Substitution):
-            self.param_type = deepcopy(self.param_type.do_substitution()) ## deepcopy
-            return False
-        if body_last and isinstance(self.body, Substitution):
-            self.body = deepcopy(self.body.do_substitution()) ## deepcopy
-            return False
+        self.param_type, type_last = settle(self.param_type)
+        self.body, body_last = settle(self.body)
+        if not (type_last and body_last): self.invalidate()
         return type_last and body_last
     def alpha_equals(self, other: Self, var_renaming: Dict[str, str]) -> bool:
         pass
     def one_beta_normal_reduction(self, Gamma: Dict[str, Expr]) -> bool | Expr:
         param_type_rv = self.param_type.one_beta_normal_reduction(Gamma)
         if isinstance(param_type_rv, Expr): 
-            self.param_type = deepcopy(param_type_rv) ## deepcopy
+            self.param_type = param_type_rv
+            self.invalidate()
+            return True
+        elif param_type_rv:
+            self.invalidate()
             return True
-        elif param_type_rv: return True
         body_rv = self.body.one_beta_normal_reduction({**Gamma, self.param : self.param_type})
         if isinstance(body_rv, Expr): 
-            self.body = deepcopy(body_rv) ## deepcopy
+            self.body = body_rv
+            self.invalidate()
+            return True
+        elif body_rv:
+            self.invalidate()
             return True
-        elif body_rv: return True
         return False
         
 
@@ -153,21 +292,13 @@ class Abstraction(BetaReduceable):
     param: str
     param_type: Expr
     body: Expr
-    def to_str(self) -> str:
-        return f"\\ {self.param}: {self.param_type.to_str()}. {self.body.to_str()}"
+    kind: ClassVar[Kind] = Kind.ABSTRACTION
     def alpha_equals(self, other: Self, var_renaming: Dict[str, str]) -> bool:
         if not isinstance(other, Abstraction): return False
         type_equals = self.param_type.alpha_equals(other.param_type, var_renaming)
         body_equals = self.body.alpha_equals(other.body, {**var_renaming, other.param : self.param})
         return type_equals and body_equals
-    def infer_type(self, Gamma: Dict[str, Expr]) -> Expr:
-        body_type = self.body.infer_type({**Gamma, self.param : self.param_type})
-        self_type = Program(Product(param=deepcopy(self.param), param_type=deepcopy(self.param_type), body=deepcopy(body_type)))
-        self_type.to_beta_normal_form(Gamma) # reduction TODO fishy !!!
-        if not isinstance(self_type.infer_type(Gamma), tuple(SORTS)):
-            raise TypeInferenceError("Abstraction type is not of type sort")
-        return self_type.program
-        
+
 
 # #A:B.C
 @dataclass
@@ -175,98 +306,61 @@ class Product(BetaReduceable):
     param: str
     param_type: Expr
     body: Expr
-    def to_str(self) -> str:
-        return f"& {self.param}: {self.param_type.to_str()}. {self.body.to_str()}"
+    kind: ClassVar[Kind] = Kind.PRODUCT
     def alpha_equals(self, other: Self, var_renaming: Dict[str, str]) -> bool:
         if not isinstance(other, Product): return False
         type_equals = self.param_type.alpha_equals(other.param_type, var_renaming)
         body_equals = self.body.alpha_equals(other.body, {**var_renaming, other.param : self.param})
         return type_equals and body_equals
-    def infer_type(self, Gamma: Dict[str, Expr]) -> Expr:
-        param_type_type = self.param_type.infer_type(Gamma)
-        param_type_type_program = deepcopy(Program(param_type_type)) # reduction
-        param_type_type_program.to_beta_normal_form(Gamma)
-        param_type_type = param_type_type_program.program
-        if not isinstance(param_type_type, tuple(SORTS)):
-            raise TypeInferenceError("Product param type is not of type sort")
-        body_type = self.body.infer_type({**Gamma, self.param : self.param_type})
-        body_type_program = deepcopy(Program(body_type)) # reduction
-        body_type_program.to_beta_normal_form({**Gamma, self.param : self.param_type})
-        body_type = body_type_program.program
-        if (type(param_type_type), type(body_type), type(body_type)) not in RULES:
-            raise TypeInferenceError("Product type dose not follow rules")
-        return body_type
 
 # f x
 @dataclass 
 class Application(Expr):
     func: Expr
     arg: Expr
-    def to_str(self) -> str:
-        left = f"({self.func.to_str()})" if isinstance(self.func, (Abstraction, Product)) else self.func.to_str()
-        right = f"({self.arg.to_str()})" if isinstance(self.arg, (Application, Abstraction, Product)) else self.arg.to_str()
-        return f"{left} {right}"
-    def get_free_vars(self) -> Set[str]:
+    kind: ClassVar[Kind] = Kind.APPLICATION
+    def collect_free_vars(self) -> FrozenSet[str]:
         return self.func.get_free_vars().union(self.arg.get_free_vars())
     def naive_alpha_renaming(self, old: str, new: str):
         self.func.naive_alpha_renaming(old, new)
         self.arg.naive_alpha_renaming(old, new)
+        self.invalidate()
     def find_unconflicting_subs(self) -> bool:
-        func_last = self.func.find_unconflicting_subs()
-        arg_last = self.arg.find_unconflicting_subs()
-        if func_last and isinstance(self.func, Substitution):
-            self.func = deepcopy(self.func.do_substitution()) ## deepcopy
-            return False
-        if arg_last and isinstance(self.arg, Substitution):
-            self.arg = deepcopy(self.arg.do_substitution()) ## deepcopy
-            return False
+        self.func, func_last = settle(self.func)
+        self.arg, arg_last = settle(self.arg)
+        if not (func_last and arg_last): self.invalidate()
         return func_last and arg_last
     def alpha_equals(self, other: Self, var_renaming: Dict[str, str]) -> bool:
         if not isinstance(other, Application): return False
         return self.func.alpha_equals(other.func, var_renaming) and self.arg.alpha_equals(other.arg, var_renaming)
-    def infer_type(self, Gamma: Dict[str, Expr]) -> Expr:
-        func_type = self.func.infer_type(Gamma)
-        func_type_program = deepcopy(Program(func_type)) # reduction
-        func_type_program.to_beta_normal_form(Gamma)
-        func_type = func_type_program.program
-        if not isinstance(func_type, Product):
-            raise TypeInferenceError("func type is not a product")
-        func_body_type = func_type.body
-        func_param_type = func_type.param_type
-        arg_type = self.arg.infer_type(Gamma)
-        arg_type_program = deepcopy(Program(arg_type)) # reduction
-        arg_type_program.to_beta_normal_form(Gamma)
-        arg_type = arg_type_program.program
-        if not Program(program=deepcopy(func_param_type)).alpha_equals(Program(program=deepcopy(arg_type))):
-            raise TypeInferenceError("param and arg type do not match")
-        self_type_prog = Program(program=Substitution(org_expr=deepcopy(func_body_type), free_var=deepcopy(func_type.param), sub_expr=deepcopy(self.arg))) # TODO ß reduction
-        while not self_type_prog.find_unconflicting_subs(): pass
-        return self_type_prog.program
     def one_beta_normal_reduction(self, Gamma: Dict[str, Expr]) -> bool | Expr:
         # if func is abstr or prod => reduce it
         if isinstance(self.func, BetaReduceable):
             # compare types
-            param_type = Program(program=deepcopy(self.func.param_type))
-            param_type.to_beta_normal_form(Gamma)
-            arg_type = Program(program=deepcopy(self.arg).infer_type(Gamma))
-            arg_type.to_beta_normal_form(Gamma)
-            if not param_type.alpha_equals(arg_type):
-                print("-----------------") #####
-                print(param_type.to_str()) #####
-                print(arg_type.to_str()) #####
-                raise BetaReductionError("Param and Arg type are not equal")
+            param_type = self.func.param_type
+            arg_type = self.arg.infer_type_cached(Gamma)
+            if not convertible(param_type.to_de_bruijn(), arg_type.to_de_bruijn()):
+                if TRACE.enabled: TRACE.event("type_mismatches", param_type=param_type, arg_type=arg_type)
+                raise BetaReductionError(f"Param and Arg type are not equal: {param_type.to_str()} and {arg_type.to_str()}")
+            if TRACE.enabled: TRACE.event("beta_steps")
             return Substitution(org_expr=self.func.body, free_var=self.func.param, sub_expr=self.arg)
         # if func is not abstr => find an other
         func_rv = self.func.one_beta_normal_reduction(Gamma)
         if isinstance(func_rv, Expr):
-            self.func = deepcopy(func_rv) ## deepcopy
+            self.func = func_rv
+            self.invalidate()
+            return True
+        elif func_rv:
+            self.invalidate()
             return True
-        elif func_rv: return True
         arg_rv = self.arg.one_beta_normal_reduction(Gamma)
         if isinstance(arg_rv, Expr):
-            self.arg = deepcopy(arg_rv) ## deepcopy
+            self.arg = arg_rv
+            self.invalidate()
+            return True
+        elif arg_rv:
+            self.invalidate()
             return True
-        elif arg_rv: return True
         return False
 
 
@@ -277,15 +371,16 @@ class Substitution(Expr):
     org_expr: Expr
     free_var: str
     sub_expr: Expr
-    def to_str(self) -> str:
-        return f"({self.org_expr.to_str()})[{self.free_var} := {self.sub_expr.to_str()}]"
-    def get_free_vars(self) -> Set[str]:
+    kind: ClassVar[Kind] = Kind.SUBSTITUTION
+    def collect_free_vars(self) -> FrozenSet[str]:
         return (self.org_expr.get_free_vars() - {self.free_var}).union(self.sub_expr.get_free_vars())
     def naive_alpha_renaming(self, old: str, new: str):
         raise AlphaRenamingError("No Substitutions may be alpha renamed")
     def do_substitution(self) -> Expr:
+        if TRACE.enabled: TRACE.event("substitutions")
+        # every occurrence gets its own copy, rewrites change nodes in place
         if isinstance(self.org_expr, Variable): 
-            return self.sub_expr if self.org_expr.id == self.free_var else self.org_expr
+            return deepcopy(self.sub_expr) if self.org_expr.id == self.free_var else self.org_expr
         elif isinstance(self.org_expr, Application):
             org_app = self.org_expr
             return Application(func=Substitution(org_expr=org_app.func, free_var=self.free_var, sub_expr=self.sub_expr),
@@ -295,10 +390,13 @@ class Substitution(Expr):
             org_abstr = self.org_expr
             return Abstraction(param=org_abstr.param, param_type=Substitution(org_expr=org_abstr.param_type, free_var=self.free_var, sub_expr=self.sub_expr,), body=org_abstr.body)
         elif isinstance(self.org_expr, Abstraction) and self.org_expr.param in self.sub_expr.get_free_vars():
+            if TRACE.enabled: TRACE.event("renames")
             rename_to = find_fresh_name(self.org_expr.param, self.org_expr.body.get_free_vars().union(self.sub_expr.get_free_vars()).union(self.org_expr.param_type.get_free_vars()))
             self.org_expr.body.naive_alpha_renaming(self.org_expr.param, rename_to)
             #self.org_expr.param_type.naive_alpha_renaming(self.org_expr.param, rename_to)
             self.org_expr.param = rename_to
+            self.org_expr.invalidate()
+            self.invalidate()
             return self
         elif isinstance(self.org_expr, Abstraction):
             org_abstr = self.org_expr
@@ -308,10 +406,13 @@ class Substitution(Expr):
         elif isinstance(self.org_expr, Product) and self.org_expr.param == self.free_var:
             return self.org_expr
         elif isinstance(self.org_expr, Product) and self.org_expr.param in self.sub_expr.get_free_vars():
+            if TRACE.enabled: TRACE.event("renames")
             rename_to = find_fresh_name(self.org_expr.param, self.org_expr.body.get_free_vars().union(self.sub_expr.get_free_vars()).union(self.org_expr.param_type.get_free_vars()))
             self.org_expr.body.naive_alpha_renaming(self.org_expr.param, rename_to)
             #self.org_expr.param_type.naive_alpha_renaming(self.org_expr.param, rename_to)
             self.org_expr.param = rename_to
+            self.org_expr.invalidate()
+            self.invalidate()
             return self
         elif isinstance(self.org_expr, Product):
             org_abstr = self.org_expr
@@ -324,15 +425,20 @@ class Substitution(Expr):
             return self.org_expr
         else:
             raise SubstitutionError(f"No expected instance found, instead {self.org_expr}")
+    # org_expr and sub_expr hold no substitutions: self is pushed down to the variables in
+    # one go, the substitutions do_substitution leaves are the direct parts of its result
+    def substituted(self) -> Expr:
+        result = self.do_substitution()
+        while result is self: result = self.do_substitution() # a binder was renamed first
+        if isinstance(result, Application):
+            result.func, result.arg = pushed(result.func), pushed(result.arg)
+        elif isinstance(result, BetaReduceable):
+            result.param_type, result.body = pushed(result.param_type), pushed(result.body)
+        return result
     def find_unconflicting_subs(self) -> bool:
-        org_last = self.org_expr.find_unconflicting_subs()
-        sub_last = self.sub_expr.find_unconflicting_subs()
-        if org_last and isinstance(self.org_expr, Substitution):
-            self.org_expr = deepcopy(self.org_expr.do_substitution()) ## deepcopy
-            return False
-        if sub_last and isinstance(self.sub_expr, Substitution):
-            self.sub_expr = deepcopy(self.sub_expr.do_substitution()) ## deepcopy
-            return False
+        self.org_expr, org_last = settle(self.org_expr)
+        self.sub_expr, sub_last = settle(self.sub_expr)
+        if not (org_last and sub_last): self.invalidate()
         return org_last and sub_last
     def alpha_equals(self, other: Self, var_renaming: Dict[str, str]) -> bool:
         raise AlphaEqError("Substitutions may not be compared")
@@ -344,38 +450,272 @@ class Substitution(Expr):
 
 @dataclass
 class Universe(Expr, ABC):
-    def to_str(self) -> str:
-        pass
-    def get_free_vars(self) -> Set[str]:
-        return set()
+    def collect_free_vars(self) -> FrozenSet[str]:
+        return frozenset()
     def naive_alpha_renaming(self, old: str, new: str):
         return
     def find_unconflicting_subs(self) -> bool:
         return True
     def alpha_equals(self, other: Self, var_renaming: Dict[str, str]) -> bool:
         pass
-    def infer_type(self, Gamma: Dict[str, Expr]) -> Expr:
-        for ax in AXIOMS:
-            if isinstance(self, ax[0]): return ax[1]()
-        raise TypeInferenceError("Universe has no type")
     def one_beta_normal_reduction(self, Gamma: Dict[str, Expr]) -> bool | Expr:
         return False
 
 @dataclass
 class Star(Universe):
-    def to_str(self) -> str:
-        return "*"
+    kind: ClassVar[Kind] = Kind.STAR
     def alpha_equals(self, other: Self, var_renaming: Dict[str, str]) -> bool:
         return isinstance(other, Star)
 
 @dataclass
 class Square(Universe):
-    def to_str(self) -> str:
-        return "#"
+    kind: ClassVar[Kind] = Kind.SQUARE
     def alpha_equals(self, other: Self, var_renaming: Dict[str, str]) -> bool:
         return isinstance(other, Square)
 
 
+# Every substitution below expr is applied by find_unconflicting_subs, innermost first, and
+# so is expr itself if it is one. Returns the result and whether expr was left as it was.
+def settle(expr: Expr) -> Tuple[Expr, bool]:
+    last = expr.find_unconflicting_subs()
+    if isinstance(expr, Substitution): return expr.substituted(), False
+    return expr, last
+
+def pushed(expr: Expr) -> Expr:
+    return expr.substituted() if isinstance(expr, Substitution) else expr
+
 SORTS: Set[Type[Universe]] = {Star, Square}
 AXIOMS: Set[Tuple[Type[Universe], Type[Universe]]] = {(Star, Square)}
 RULES: Set[Tuple[Type[Universe], Type[Universe], Type[Universe]]] = {(Star, Star, Star), (Star, Square, Square), (Square, Star, Star), (Square, Square, Square)}
+
+DB_SORTS: Dict[Type[Universe], Type[DBExpr]] = {Star: DBStar, Square: DBSquare}
+
+# the sort a type reduces to, only its weak head normal form is needed for that
+def sort_of(term: DBExpr) -> Type[Universe] | None:
+    head = whnf(term)
+    if isinstance(head, DBStar): return Star
+    if isinstance(head, DBSquare): return Square
+    return None
+
+def gamma_to_de_bruijn(Gamma: Dict[str, Expr]) -> Dict[str, DBExpr]:
+    return {name : var_type.to_de_bruijn({}, 0) for name, var_type in Gamma.items()}
+
+# whether term mentions a free name, memo keeps the walk linear over one inference
+def mentions_free(term: DBExpr, memo: Dict[DBExpr, bool]) -> bool:
+    todo: List[DBExpr] = [term]
+    while todo:
+        current = todo[-1]
+        if current in memo:
+            todo.pop()
+            continue
+        pending = [child for child, _ in current.children() if child not in memo]
+        if pending:
+            todo += pending
+            continue
+        todo.pop()
+        memo[current] = isinstance(current, FreeVar) or any(memo[child] for child, _ in current.children())
+    return memo[term]
+
+# Type inference on de Bruijn terms with an explicit task stack, so deep terms do not hit
+# the recursion limit. gamma: types of the free names, context: types of the bound
+# variables, innermost first. Closed subterms are looked up in TYPE_CACHE and stored once
+# inferred, key: the cache key of the whole term, for its context of free names.
+def infer_de_bruijn(term: DBExpr, gamma: Dict[str, DBExpr], key: Tuple | None = None) -> DBExpr:
+    free: Dict[DBExpr, bool] = {}
+    results: List[DBExpr] = []
+    todo: List[Tuple] = [("infer", term, None, key)]
+    while todo:
+        task = todo.pop()
+        if task[0] == "infer":
+            _, term, context, key = task
+            if key is None and term.loose_range() == 0 and not mentions_free(term, free): key = (term, ())
+            if key is not None:
+                cached = TYPE_CACHE.lookup(key)
+                if cached is not None:
+                    if TRACE.enabled: TRACE.event("type_cache_hits")
+                    results.append(cached)
+                    continue
+                if TRACE.enabled: TRACE.event("type_inferences")
+                todo.append(("store", key))
+            if isinstance(term, BoundVar):
+                var_context = context
+                for _ in range(term.index):
+                    if var_context is None: break
+                    var_context = var_context[1]
+                if var_context is None:
+                    raise TypeInferenceError(f"Unbound index #{term.index}")
+                results.append(var_context[0].shift(term.index + 1))
+            elif isinstance(term, FreeVar):
+                if term.name not in gamma:
+                    raise TypeInferenceError("Free Variable in infered typing expr")
+                results.append(gamma[term.name])
+            elif isinstance(term, DBApplication):
+                todo += [("app_arg", term, context), ("infer", term.func, context, None)]
+            elif isinstance(term, DBAbstraction):
+                todo += [("abstraction", term, context), ("infer", term.body, (term.param_type, context), None)]
+            elif isinstance(term, DBProduct):
+                todo += [("product_body", term, context), ("infer", term.param_type, context, None)]
+            elif isinstance(term, (DBStar, DBSquare)):
+                sort = Star if isinstance(term, DBStar) else Square
+                axiom = next((ax[1] for ax in AXIOMS if ax[0] is sort), None)
+                if axiom is None:
+                    raise TypeInferenceError("Universe has no type")
+                results.append(DB_SORTS[axiom]())
+            else:
+                raise TypeInferenceError(f"No expected instance found, instead {term}")
+        elif task[0] == "store":
+            TYPE_CACHE.store(task[1], results[-1])
+        elif task[0] == "app_arg":
+            # only the head of the function type matters here
+            func_type = whnf(results.pop())
+            if not isinstance(func_type, DBProduct):
+                raise TypeInferenceError("func type is not a product")
+            results.append(func_type)
+            todo += [("app", task[1]), ("infer", task[1].arg, task[2], None)]
+        elif task[0] == "app":
+            arg_type = results.pop()
+            func_type = results.pop()
+            if not convertible(func_type.param_type, arg_type):
+                raise TypeInferenceError("param and arg type do not match")
+            results.append(func_type.body.instantiate(task[1].arg))
+        elif task[0] == "abstraction":
+            _, term, context = task
+            self_type = DBProduct(param_type=term.param_type, body=results.pop())
+            todo += [("sorted", self_type), ("infer", self_type, context, None)]
+        elif task[0] == "sorted":
+            if sort_of(results.pop()) is None:
+                raise TypeInferenceError("Abstraction type is not of type sort")
+            results.append(task[1])
+        elif task[0] == "product_body":
+            _, term, context = task
+            param_sort = sort_of(results.pop())
+            if param_sort is None:
+                raise TypeInferenceError("Product param type is not of type sort")
+            todo += [("product", param_sort), ("infer", term.body, (term.param_type, context), None)]
+        elif task[0] == "product":
+            body_sort = sort_of(results.pop())
+            if (task[1], body_sort, body_sort) not in RULES:
+                raise TypeInferenceError("Product type dose not follow rules")
+            results.append(DB_SORTS[body_sort]())
+    return results.pop()
+
+# Both conversions walk with an explicit task stack, so deeply nested terms do not
+# hit the recursion limit. Tasks are tuples tagged with what to do next.
+
+# a subterm converts the same as on its own if none of its free names is bound or
+# substituted around it. Only free variables already cached are read, the conversion
+# stores the form of such subterms so later conversions and type lookups reuse it.
+def standalone(expr: Expr, scope: Dict[str, List[Tuple]]) -> bool:
+    free_vars = expr.cached("free_vars_cache")
+    return free_vars is not None and not any(scope.get(name) for name in free_vars)
+
+def expr_to_de_bruijn(expr: Expr, bound: Dict[str, int] = {}, depth: int = 0) -> DBExpr:
+    # innermost meaning of every name in scope: ("bound", level) or ("sub", term, depth at the substitution)
+    scope: Dict[str, List[Tuple]] = {name : [("bound", level)] for name, level in bound.items()}
+    results: List[DBExpr] = []
+    todo: List[Tuple] = [("visit", expr)]
+    while todo:
+        task = todo.pop()
+        if task[0] in ("visit", "visit_parts"):
+            expr = task[1]
+            kind = getattr(expr, "kind", None)
+            if kind == Kind.PROGRAM:
+                todo.append(("visit", expr.program))
+            elif kind is not None and expr.cached("de_bruijn_cache") is not None and standalone(expr, scope):
+                results.append(expr.cached("de_bruijn_cache"))
+            elif kind == Kind.VARIABLE:
+                meaning = scope[expr.id][-1] if scope.get(expr.id) else None
+                if meaning is None: results.append(FreeVar(expr.id))
+                elif meaning[0] == "bound": results.append(BoundVar(depth - 1 - meaning[1]))
+                else: results.append(meaning[1].shift(depth - meaning[2]))
+            elif kind in (Kind.APPLICATION, Kind.ABSTRACTION, Kind.PRODUCT, Kind.SUBSTITUTION) and standalone(expr, scope) and task[0] == "visit":
+                todo += [("store", expr), ("visit_parts", expr)]
+            elif kind == Kind.APPLICATION:
+                todo += [("app",), ("visit", expr.arg), ("visit", expr.func)]
+            elif kind in (Kind.ABSTRACTION, Kind.PRODUCT):
+                todo += [("binder", DBAbstraction if kind == Kind.ABSTRACTION else DBProduct), ("unbind", expr.param), ("visit", expr.body), ("bind", expr.param), ("visit", expr.param_type)]
+            elif kind == Kind.SUBSTITUTION:
+                # the substituted term is converted once and shifted into place at each use
+                todo += [("unbind", expr.free_var), ("visit", expr.org_expr), ("bind_sub", expr.free_var), ("visit", expr.sub_expr)]
+            elif kind == Kind.STAR:
+                results.append(DBStar())
+            elif kind == Kind.SQUARE:
+                results.append(DBSquare())
+            else:
+                raise ASTError(f"No expected instance found, instead {expr}")
+        elif task[0] == "store":
+            task[1].__dict__["de_bruijn_cache"] = Cached(results[-1])
+        elif task[0] == "app":
+            arg = results.pop()
+            results.append(DBApplication(func=results.pop(), arg=arg))
+        elif task[0] == "bind":
+            scope.setdefault(task[1], []).append(("bound", depth))
+            depth += 1
+        elif task[0] == "bind_sub":
+            scope.setdefault(task[1], []).append(("sub", results.pop(), depth))
+        elif task[0] == "unbind":
+            if scope[task[1]].pop()[0] == "bound": depth -= 1
+        elif task[0] == "binder":
+            body = results.pop()
+            results.append(task[1](param_type=results.pop(), body=body))
+    return results.pop()
+
+# names: binder names around term from outermost to innermost, free: free names of the whole term
+def expr_from_de_bruijn(term: DBExpr, names: List[str] = [], free: Set[str] | None = None) -> Expr:
+    root = term
+    names = list(names)
+    free = term.get_free_names() if free is None else free
+    results: List[Expr] = []
+    todo: List[Tuple] = [("visit", term)]
+    while todo:
+        task = todo.pop()
+        if task[0] == "visit":
+            term = task[1]
+            if isinstance(term, BoundVar):
+                results.append(Variable(id=names[-1 - term.index]))
+            elif isinstance(term, FreeVar):
+                results.append(Variable(id=term.name))
+            elif isinstance(term, DBApplication):
+                todo += [("app",), ("visit", term.arg), ("visit", term.func)]
+            elif isinstance(term, DBBinder):
+                binder = Abstraction if isinstance(term, DBAbstraction) else Product
+                param = binder_name(term, names, free)
+                todo += [("binder", binder, param), ("unbind",), ("visit", term.body), ("bind", param), ("visit", term.param_type)]
+            elif isinstance(term, DBStar):
+                results.append(Star())
+            elif isinstance(term, DBSquare):
+                results.append(Square())
+            else:
+                raise ASTError(f"No expected de Bruijn instance found, instead {term}")
+        elif task[0] == "app":
+            arg = results.pop()
+            results.append(Application(func=results.pop(), arg=arg))
+        elif task[0] == "bind":
+            names.append(task[1])
+        elif task[0] == "unbind":
+            names.pop()
+        elif task[0] == "binder":
+            body = results.pop()
+            results.append(task[1](param=task[2], param_type=results.pop(), body=body))
+    expr = results.pop()
+    # a root converted back gives the term it came from, no need to convert it again
+    if not names: expr.__dict__["de_bruijn_cache"] = Cached(root)
+    return expr
+
+# Binder names are chosen from what a binder binds: types and type constructors are named
+# A, B, ..., functions f, g, ... and other values x, y, ..., and a product whose body does
+# not use its parameter is written _. A name never repeats an enclosing binder or a free
+# name, so a term prints the same wherever and whenever it was built.
+NAME_SERIES = (("A", "B", "C", "D", "E"), ("f", "g", "h", "k"), ("x", "y", "z", "u", "v", "w"))
+
+def binder_name(term: DBBinder, names: List[str], free: Set[str]) -> str:
+    if isinstance(term, DBProduct) and not term.body.references(0): return "_"
+    result = term.param_type
+    while isinstance(result, DBProduct): result = result.body
+    series = NAME_SERIES[0 if isinstance(result, (DBStar, DBSquare)) else 1 if isinstance(term.param_type, DBProduct) else 2]
+    suffix = 0
+    while True:
+        for name in series:
+            candidate = name + str(suffix) if suffix else name
+            if candidate not in free and candidate not in names: return candidate
+        suffix += 1
@@ -0,0 +1,279 @@
+from array import array
+from typing import Dict, FrozenSet, List, Tuple, Set
+from deBruijn import DBExpr, BoundVar, FreeVar, DBBinder, DBAbstraction, DBProduct, DBApplication, DBStar, DBSquare
+from abstractSyntaxTree import Expr, Kind, Variable, Application, Abstraction, Product, Substitution, Star, Square, ASTError, binder_name, expr_to_de_bruijn
+from printer import to_text
+
+# Compact term store: every node is one row of four parallel arrays, a tag, two child
+# indices and the id of an interned name, about 13 bytes per node where an Expr
+# instance with its __dict__ takes several hundred. Nodes are read through __slots__
+# views with the field names and kinds of the Expr classes and converted to and from
+# those classes, and from de Bruijn terms, in bulk. The conversion to de Bruijn terms and
+# the printer only read the kind and fields of a node, so they read views directly. The
+# views are no Expr instances, the rewrites of the substitution engine need to_expr
+# first. Nodes are never changed once added, so a subterm may be shared by several
+# parents.
+#
+#   tag            a            b         name
+#   VARIABLE       -            -         id
+#   APPLICATION    func         arg       -
+#   ABSTRACTION    param_type   body      param
+#   PRODUCT        param_type   body      param
+#   SUBSTITUTION   org_expr     sub_expr  free_var
+#   STAR, SQUARE   -            -         -
+
+VARIABLE, APPLICATION, ABSTRACTION, PRODUCT, SUBSTITUTION, STAR, SQUARE = range(7)
+NONE = -1
+
+class Arena():
+    def __init__(self):
+        self.tags = array("B")
+        self.a = array("i")
+        self.b = array("i")
+        self.name_ids = array("i")
+        self.names: List[str] = []
+        self.name_index: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.tags)
+
+    def nbytes(self) -> int:
+        return sum(column.itemsize * len(column) for column in (self.tags, self.a, self.b, self.name_ids))
+
+    def intern(self, name: str) -> int:
+        if name not in self.name_index:
+            self.name_index[name] = len(self.names)
+            self.names.append(name)
+        return self.name_index[name]
+
+    def add(self, tag: int, a: int = NONE, b: int = NONE, name: str | None = None) -> int:
+        self.tags.append(tag)
+        self.a.append(a)
+        self.b.append(b)
+        self.name_ids.append(NONE if name is None else self.intern(name))
+        return len(self.tags) - 1
+
+    def name(self, index: int) -> str:
+        return self.names[self.name_ids[index]]
+
+    def view(self, index: int) -> "Node":
+        return VIEWS[self.tags[index]](self, index)
+
+    def children(self, index: int) -> Tuple[int, ...]:
+        tag = self.tags[index]
+        if tag in (VARIABLE, STAR, SQUARE): return ()
+        return (self.a[index], self.b[index])
+
+    # Expr objects reached twice, e.g. after substitutions without copies, are added once
+    def add_expr(self, expr: Expr) -> int:
+        if expr.kind == Kind.PROGRAM: expr = expr.program
+        added: Dict[int, int] = {}
+        todo: List[Expr] = [expr]
+        while todo:
+            node = todo[-1]
+            if id(node) in added:
+                todo.pop()
+                continue
+            parts = expr_parts(node)
+            pending = [part for part in parts if id(part) not in added]
+            if pending:
+                todo += pending
+                continue
+            todo.pop()
+            children = [added[id(part)] for part in parts] + [NONE, NONE]
+            added[id(node)] = self.add(EXPR_TAGS[node.kind], children[0], children[1], expr_name(node))
+        return added[id(expr)]
+
+    # binder names are chosen as by expr_from_de_bruijn, a de Bruijn subterm shared
+    # under the same binders is added once
+    def add_de_bruijn(self, term: DBExpr) -> int:
+        free = term.get_free_names()
+        names: List[str] = []
+        contexts: List[int] = [0] # one id per binder stack, so (term, context) names one node
+        next_context = 1
+        added: Dict[Tuple[DBExpr, int], int] = {}
+        results: List[int] = []
+        todo: List[Tuple] = [("visit", term)]
+        while todo:
+            task = todo.pop()
+            if task[0] == "visit":
+                node = task[1]
+                key = (node, contexts[-1])
+                if key in added:
+                    results.append(added[key])
+                elif isinstance(node, (BoundVar, FreeVar, DBStar, DBSquare)):
+                    if isinstance(node, BoundVar): added[key] = self.add(VARIABLE, name=names[-1 - node.index])
+                    elif isinstance(node, FreeVar): added[key] = self.add(VARIABLE, name=node.name)
+                    else: added[key] = self.add(STAR if isinstance(node, DBStar) else SQUARE)
+                    results.append(added[key])
+                elif isinstance(node, DBApplication):
+                    todo += [("build", key, APPLICATION, None), ("visit", node.arg), ("visit", node.func)]
+                elif isinstance(node, DBBinder):
+                    param = binder_name(node, names, free)
+                    tag = ABSTRACTION if isinstance(node, DBAbstraction) else PRODUCT
+                    todo += [("build", key, tag, param), ("unbind",), ("visit", node.body), ("bind", param), ("visit", node.param_type)]
+                else:
+                    raise ASTError(f"No expected de Bruijn instance found, instead {node}")
+            elif task[0] == "bind":
+                names.append(task[1])
+                contexts.append(next_context)
+                next_context += 1
+            elif task[0] == "unbind":
+                names.pop()
+                contexts.pop()
+            else:
+                _, key, tag, param = task
+                b = results.pop()
+                results.append(self.add(tag, results.pop(), b, param))
+                added[key] = results[-1]
+        return results.pop()
+
+    # a tree of fresh Expr objects, also where nodes are shared in the arena, since the
+    # substitution engine changes Expr objects in place
+    def to_expr(self, index: int) -> Expr:
+        results: List[Expr] = []
+        todo: List[Tuple[int, bool]] = [(index, False)]
+        while todo:
+            node, built = todo.pop()
+            tag = self.tags[node]
+            if tag == VARIABLE:
+                results.append(Variable(id=self.name(node)))
+            elif tag == STAR:
+                results.append(Star())
+            elif tag == SQUARE:
+                results.append(Square())
+            elif not built:
+                todo += [(node, True), (self.b[node], False), (self.a[node], False)]
+            else:
+                b = results.pop()
+                a = results.pop()
+                if tag == APPLICATION: results.append(Application(func=a, arg=b))
+                elif tag == ABSTRACTION: results.append(Abstraction(param=self.name(node), param_type=a, body=b))
+                elif tag == PRODUCT: results.append(Product(param=self.name(node), param_type=a, body=b))
+                else: results.append(Substitution(org_expr=a, free_var=self.name(node), sub_expr=b))
+        return results.pop()
+
+    def free_vars(self, index: int) -> FrozenSet[str]:
+        free: Dict[int, FrozenSet[str]] = {}
+        todo = [index]
+        while todo:
+            node = todo[-1]
+            if node in free:
+                todo.pop()
+                continue
+            pending = [child for child in self.children(node) if child not in free]
+            if pending:
+                todo += pending
+                continue
+            todo.pop()
+            tag = self.tags[node]
+            if tag == VARIABLE: free[node] = frozenset((self.name(node),))
+            elif tag in (STAR, SQUARE): free[node] = frozenset()
+            elif tag == APPLICATION: free[node] = free[self.a[node]] | free[self.b[node]]
+            elif tag == SUBSTITUTION: free[node] = (free[self.a[node]] - {self.name(node)}) | free[self.b[node]]
+            else: free[node] = free[self.a[node]] | (free[self.b[node]] - {self.name(node)})
+        return free[index]
+
+EXPR_TAGS = {Kind.VARIABLE: VARIABLE, Kind.APPLICATION: APPLICATION, Kind.ABSTRACTION: ABSTRACTION, Kind.PRODUCT: PRODUCT, Kind.SUBSTITUTION: SUBSTITUTION, Kind.STAR: STAR, Kind.SQUARE: SQUARE}
+
+def expr_parts(expr: Expr) -> Tuple[Expr, ...]:
+    kind = getattr(expr, "kind", None)
+    if kind == Kind.APPLICATION: return (expr.func, expr.arg)
+    if kind in (Kind.ABSTRACTION, Kind.PRODUCT): return (expr.param_type, expr.body)
+    if kind == Kind.SUBSTITUTION: return (expr.org_expr, expr.sub_expr)
+    if kind in (Kind.VARIABLE, Kind.STAR, Kind.SQUARE): return ()
+    raise ASTError(f"No expected instance found, instead {expr}")
+
+def expr_name(expr: Expr) -> str | None:
+    if expr.kind == Kind.VARIABLE: return expr.id
+    if expr.kind in (Kind.ABSTRACTION, Kind.PRODUCT): return expr.param
+    if expr.kind == Kind.SUBSTITUTION: return expr.free_var
+    return None
+
+# read only views of one node with the kind, fields and queries of the Expr classes
+class Node():
+    __slots__ = ("arena", "index")
+    def __init__(self, arena: Arena, index: int):
+        self.arena = arena
+        self.index = index
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Node) and other.arena is self.arena and other.index == self.index
+    def __hash__(self) -> int:
+        return hash((id(self.arena), self.index))
+    def child(self, column: array) -> "Node":
+        return self.arena.view(column[self.index])
+    # views cache nothing, so the conversions never take a subterm as standalone
+    def cached(self, key: str):
+        return None
+    def to_str(self) -> str:
+        return to_text(self)
+    def get_free_vars(self) -> FrozenSet[str]:
+        return self.arena.free_vars(self.index)
+    def to_de_bruijn(self) -> DBExpr:
+        return expr_to_de_bruijn(self)
+    def to_expr(self) -> Expr:
+        return self.arena.to_expr(self.index)
+    def alpha_equals(self, other: "Node | Expr") -> bool:
+        return self.to_de_bruijn() is other.to_de_bruijn()
+    def infer_type(self, Gamma: Dict[str, Expr] = {}) -> Expr:
+        # substitutions are done by the conversion, as for linked programs
+        return Program.from_de_bruijn(self.to_de_bruijn()).infer_type(Gamma)
+
+class VariableNode(Node):
+    __slots__ = ()
+    kind = Kind.VARIABLE
+    @property
+    def id(self) -> str: return self.arena.name(self.index)
+
+class ApplicationNode(Node):
+    __slots__ = ()
+    kind = Kind.APPLICATION
+    @property
+    def func(self) -> Node: return self.child(self.arena.a)
+    @property
+    def arg(self) -> Node: return self.child(self.arena.b)
+
+class BinderNode(Node):
+    __slots__ = ()
+    @property
+    def param(self) -> str: return self.arena.name(self.index)
+    @property
+    def param_type(self) -> Node: return self.child(self.arena.a)
+    @property
+    def body(self) -> Node: return self.child(self.arena.b)
+
+class AbstractionNode(BinderNode):
+    __slots__ = ()
+    kind = Kind.ABSTRACTION
+
+class ProductNode(BinderNode):
+    __slots__ = ()
+    kind = Kind.PRODUCT
+
+class SubstitutionNode(Node):
+    __slots__ = ()
+    kind = Kind.SUBSTITUTION
+    @property
+    def org_expr(self) -> Node: return self.child(self.arena.a)
+    @property
+    def free_var(self) -> str: return self.arena.name(self.index)
+    @property
+    def sub_expr(self) -> Node: return self.child(self.arena.b)
+
+class StarNode(Node):
+    __slots__ = ()
+    kind = Kind.STAR
+
+class SquareNode(Node):
+    __slots__ = ()
+    kind = Kind.SQUARE
+
+VIEWS = {VARIABLE: VariableNode, APPLICATION: ApplicationNode, ABSTRACTION: AbstractionNode, PRODUCT: ProductNode, SUBSTITUTION: SubstitutionNode, STAR: StarNode, SQUARE: SquareNode}
+
+def from_expr(expr: Expr, arena: Arena | None = None) -> Node:
+    arena = Arena() if arena is None else arena
+    return arena.view(arena.add_expr(expr))
+
+def from_de_bruijn(term: DBExpr, arena: Arena | None = None) -> Node:
+    arena = Arena() if arena is None else arena
+    return arena.view(arena.add_de_bruijn(term))
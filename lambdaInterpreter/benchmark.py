@@ -0,0 +1,208 @@
+from dataclasses import dataclass, asdict
+from typing import Callable, Dict, List, Tuple, Optional
+from deBruijn import DBExpr
+from environment import Env
+from abstractSyntaxTree import Program, Engine
+from normalization import normalize
+from machine import Machine, Strategy
+from native import accelerate
+from compilation import normalize as normalize_compiled
+from library import parse_with_env
+from instrumentation import TRACE
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+# Reduction benchmarks over the Church encodings in inputs/nats.lm and inputs/bools.lm.
+# Every case is normalized by each engine and written as one JSON object per line, so
+# result files of two commits can be compared with --compare.
+
+NAMED = ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine", "ten"]
+
+# the library numeral up to ten, a generated definition beyond
+def numeral(n: int) -> Tuple[str, str]:
+    if n < len(NAMED): return NAMED[n], ""
+    body = "x"
+    for _ in range(n): body = f"f ({body})"
+    return f"n{n}", f" [n{n} := \\ A : *. \\ f : (& _ : A. A). \\ x : A. {body}]"
+
+def case_source(operation: str, left: int, right: int | None) -> str:
+    names, subs = [], ""
+    for n in [left] if right is None else [left, right]:
+        name, sub = numeral(n)
+        names.append(name)
+        if sub not in subs: subs += sub
+    return f"({operation} {' '.join(names)}){subs} {{nats}}"
+
+# operation: argument pairs of increasing size, right None for unary operations
+CASES: Dict[str, List[Tuple[int, int | None]]] = {
+    "plus": [(n, n) for n in (2, 5, 10, 20, 40, 80)],
+    "mult": [(n, n) for n in (2, 5, 10, 20, 30)],
+    "exp": [(2, n) for n in (2, 4, 6, 8, 10)],
+    "pred": [(n, None) for n in (2, 5, 10, 20, 40, 80)],
+    "minus": [(n, n // 2) for n in (2, 5, 10, 20, 40)],
+    "leq": [(n, n) for n in (2, 5, 10, 20, 40)],
+    "eq": [(n, n) for n in (2, 5, 10, 20, 40)],
+}
+
+# runners return the normal form, the beta steps taken and the peak stack size, None where
+# the engine does not count them. Only the machines keep a stack to measure.
+Run = Tuple[DBExpr, Optional[int], Optional[int]]
+
+def run_machine(strategy: Strategy) -> Callable[[DBExpr, Env], Run]:
+    def run(term: DBExpr, defs: Env) -> Run:
+        machine = Machine.start(term, defs, strategy)
+        return machine.run(), machine.beta_steps, machine.peak_stack
+    return run
+
+# the other engines count their beta steps through the tracer, the timing includes that bookkeeping
+def traced(normalize: Callable[[DBExpr, Env], DBExpr]) -> Callable[[DBExpr, Env], Run]:
+    def run(term: DBExpr, defs: Env) -> Run:
+        enabled, before = TRACE.enabled, TRACE.counters.get("beta_steps", 0)
+        TRACE.enable()
+        try:
+            normal = normalize(term, defs)
+        finally:
+            TRACE.enable(enabled)
+        return normal, TRACE.counters.get("beta_steps", 0) - before, None
+    return run
+
+def nbe(term: DBExpr, defs: Env) -> DBExpr:
+    defs.values.clear()
+    return normalize(term, defs)
+
+def substitution(term: DBExpr, defs: Env) -> DBExpr:
+    program = Program.from_de_bruijn(term)
+    program.to_beta_normal_form(engine=Engine.SUBSTITUTION, defs=defs)
+    return program.to_de_bruijn()
+
+run_nbe = traced(nbe)
+run_substitution = traced(substitution)
+# the compiled code is cached by term, so repeated runs time evaluation and read back only
+run_compiled = traced(normalize_compiled)
+
+def run_native(term: DBExpr, defs: Env) -> Run:
+    return run_machine(Strategy.NEED)(accelerate(term, defs), defs)
+
+ENGINES: Dict[str, Callable[[DBExpr, Env], Run]] = {
+    "machine": run_machine(Strategy.NAME),
+    "lazy": run_machine(Strategy.NEED),
+    "nbe": run_nbe,
+    "substitution": run_substitution,
+    "native": run_native,
+    "compiled": run_compiled,
+}
+
+@dataclass
+class Result:
+    engine: str
+    operation: str
+    left: int
+    right: int | None
+    seconds: float | None
+    beta_steps: int | None
+    peak_stack: int | None # most pending arguments and frames of the machine at once
+    peak_bytes: int | None
+    input_size: int | None # nodes of the input term written out as a tree, likewise the normal form
+    normal_form_size: int | None
+    error: str | None = None # engines that cannot normalize a case record why, e.g. a RecursionError
+
+# size of the term as a tree, shared subterms counted at every occurrence
+def tree_size(term: DBExpr) -> int:
+    sizes: Dict[DBExpr, int] = {}
+    stack = [term]
+    while stack:
+        node = stack[-1]
+        if node in sizes:
+            stack.pop()
+            continue
+        pending = [child for child, _ in node.children() if child not in sizes]
+        if pending:
+            stack += pending
+            continue
+        sizes[node] = 1 + sum(sizes[child] for child, _ in node.children())
+        stack.pop()
+    return sizes[term]
+
+def measure(engine: str, operation: str, left: int, right: int | None, repeat: int, memory: bool) -> Result:
+    program, defs = parse_with_env(case_source(operation, left, right))
+    term = program.to_de_bruijn()
+    runner = ENGINES[engine]
+    seconds = float("inf")
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            normal, beta_steps, peak_stack = runner(term, defs)
+            seconds = min(seconds, time.perf_counter() - start)
+    except Exception as error:
+        return Result(engine, operation, left, right, None, None, None, None, None, None, f"{type(error).__name__}: {error}")
+    peak = None
+    if memory:
+        # a separate run, tracing allocations slows the timed ones down
+        tracemalloc.start()
+        runner(term, defs)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return Result(engine, operation, left, right, seconds, beta_steps, peak_stack, peak, tree_size(term), tree_size(normal))
+
+def commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_suite(engines: List[str], operations: List[str], max_size: int, repeat: int, memory: bool, out):
+    header = {"commit": commit(), "python": platform.python_version(), "engines": engines, "repeat": repeat}
+    out.write(json.dumps({"header": header}) + "\n")
+    for operation in operations:
+        for left, right in CASES[operation]:
+            if max(left, right or 0) > max_size: continue
+            for engine in engines:
+                result = measure(engine, operation, left, right, repeat, memory)
+                out.write(json.dumps(asdict(result)) + "\n")
+                out.flush()
+                timing = result.error if result.seconds is None else f"{result.seconds:9.4f}s"
+                print(f"{engine:>12} {operation:>5} {left:>3} {'' if right is None else right:>3} {timing}", file=sys.stderr)
+
+def load_results(path: str) -> Dict[Tuple, dict]:
+    with open(path, "r") as file:
+        rows = [json.loads(line) for line in file if line.strip()]
+    return {(row["engine"], row["operation"], row["left"], row["right"]) : row for row in rows if "header" not in row}
+
+# time, step and stack ratios new / old for the cases both files contain
+def compare(old_path: str, new_path: str):
+    old, new = load_results(old_path), load_results(new_path)
+    for key in sorted(old.keys() & new.keys(), key=str):
+        before, after = old[key], new[key]
+        if before["seconds"] is None or after["seconds"] is None:
+            print(f"{key[0]:>12} {key[1]:>5} {key[2]:>3} {'' if key[3] is None else key[3]:>3} {before['error']} -> {after['error']}")
+            continue
+        steps = ""
+        if before["beta_steps"] and after["beta_steps"] is not None:
+            steps = f" steps x{after['beta_steps'] / before['beta_steps']:.2f}"
+        # files written before the stack was measured have no peak_stack
+        if before.get("peak_stack") and after.get("peak_stack") is not None:
+            steps += f" stack x{after['peak_stack'] / before['peak_stack']:.2f}"
+        print(f"{key[0]:>12} {key[1]:>5} {key[2]:>3} {'' if key[3] is None else key[3]:>3} time x{after['seconds'] / max(before['seconds'], 1e-9):.2f}{steps}")
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Benchmark the reduction engines on Church numerals")
+    arguments.add_argument("--engines", nargs="+", default=["machine", "lazy", "nbe"], choices=list(ENGINES))
+    arguments.add_argument("--operations", nargs="+", default=list(CASES), choices=list(CASES))
+    arguments.add_argument("--max-size", type=int, default=80, help="skip cases with a larger numeral")
+    arguments.add_argument("--repeat", type=int, default=3, help="timed runs per case, the fastest is kept")
+    arguments.add_argument("--no-memory", action="store_true", help="skip the peak memory run")
+    arguments.add_argument("--output", help="JSON lines file, stdout if not given")
+    arguments.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files instead of running")
+    options = arguments.parse_args()
+    if options.compare:
+        compare(*options.compare)
+    elif options.output:
+        with open(options.output, "w") as file:
+            run_suite(options.engines, options.operations, options.max_size, options.repeat, not options.no_memory, file)
+    else:
+        run_suite(options.engines, options.operations, options.max_size, options.repeat, not options.no_memory, sys.stdout)
@@ -0,0 +1,48 @@
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Tuple
+
+class LRUCache:
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stores = 0
+
+    def lookup(self, key: Hashable, default: Any = None) -> Any:
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        return default
+
+    def store(self, key: Hashable, value: Any):
+        self.stores += 1
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    # entries from elsewhere, e.g. a file, kept as the least recently used ones
+    def merge(self, entries: Iterable[Tuple[Hashable, Any]]):
+        for key, value in entries:
+            if len(self.entries) >= self.maxsize: return
+            if key in self.entries: continue
+            self.entries[key] = value
+            self.entries.move_to_end(key, last=False)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = self.misses = self.evictions = self.stores = 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self.entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses, "evictions": self.evictions, "stores": self.stores}
@@ -0,0 +1,218 @@
+from typing import Callable, Dict, List, Tuple, Any
+from deBruijn import DBExpr, BoundVar, FreeVar, DBBinder, DBAbstraction, DBProduct, DBApplication, DBStar, DBSquare
+from environment import Env as Definitions, Definition
+from machine import reduce, Strategy
+from cache import LRUCache
+from instrumentation import TRACE
+
+# Closure compilation: a term is turned into Python source in which every binder is a
+# nested def and every application a call of app, so evaluation runs at Python call
+# speed and Python closures are the environments (higher order abstract syntax).
+# Values are read back into normal forms by calling binders on fresh neutral variables.
+# Like normalization.py, arguments are evaluated first and names in defs are unfolded
+# only once they are applied, so both produce the same normal forms.
+#
+#   \ A: *. \ f: & _: A. A. \ x: A. f (f x)   compiles to
+#
+#   def make(c):
+#       def f2(v0):
+#           t0 = Binder(DBProduct, v0, lambda v1: v0)
+#           def f1(v1):
+#               def f0(v2):
+#                   t1 = app(v1, v2)
+#                   t2 = app(v1, t1)
+#                   return t2
+#               t3 = Binder(DBAbstraction, v0, f0)
+#               return t3
+#           t4 = Binder(DBAbstraction, t0, f1)
+#           return t4
+#       t5 = Binder(DBAbstraction, STAR, f2)
+#       return t5
+
+class CompilationError(Exception):
+    pass
+
+class Binder():
+    __slots__ = ("kind", "param_type", "body")
+    def __init__(self, kind: type, param_type: Any, body: Callable[[Any], Any]):
+        self.kind = kind
+        self.param_type = param_type
+        self.body = body
+
+# a bound variable (de Bruijn level) or an undefined name
+class Neutral():
+    __slots__ = ("head",)
+    def __init__(self, head: int | str):
+        self.head = head
+
+class NeutralApplication():
+    __slots__ = ("func", "arg")
+    def __init__(self, func: Any, arg: Any):
+        self.func = func
+        self.arg = arg
+
+# a name in defs, compiled and evaluated the first time it is applied
+class Global():
+    __slots__ = ("definition", "defs", "value")
+    def __init__(self, definition: Definition, defs: Definitions):
+        self.definition = definition
+        self.defs = defs
+        self.value = None
+
+class Sort():
+    __slots__ = ("term",)
+    def __init__(self, term: DBExpr):
+        self.term = term
+
+STAR, SQUARE = Sort(DBStar()), Sort(DBSquare())
+
+# products are beta reduced like abstractions, as in Application.one_beta_normal_reduction
+def app(func: Any, arg: Any) -> Any:
+    if type(func) is Binder:
+        if TRACE.enabled: TRACE.event("beta_steps")
+        return func.body(arg)
+    if type(func) is Global:
+        if func.value is None:
+            if TRACE.enabled: TRACE.event("delta_steps")
+            func.value = evaluate(func.definition.folded, func.defs)
+        return app(func.value, arg)
+    return NeutralApplication(func, arg)
+
+# a function scope of the generated code
+class Scope():
+    def __init__(self, depth: int, indent: int, known: Dict[DBExpr, str]):
+        self.depth = depth # binders around it, its own parameter is v{depth - 1}
+        self.indent = indent
+        self.lines: List[str] = []
+        self.names = dict(known) # generated expression for every term evaluated in this scope
+
+    def emit(self, line: str):
+        self.lines.append("    " * self.indent + line)
+
+class Compiler():
+    def __init__(self):
+        self.constants: List[str] = [] # free names, resolved when the code is run
+        self.temporaries = 0
+        self.functions = 0
+
+    def constant(self, name: str) -> str:
+        if name not in self.constants: self.constants.append(name)
+        return f"c[{self.constants.index(name)}]"
+
+    # iterative post order walk, each subterm is evaluated once per scope, and terms
+    # without loose indices are shared with the scopes nested in it
+    def compile(self, term: DBExpr) -> str:
+        top = Scope(0, 1, {})
+        todo: List[Tuple[DBExpr, Scope, Scope | None]] = [(term, top, None)]
+        while todo:
+            node, scope, inner = todo[-1]
+            if node in scope.names:
+                todo.pop()
+                continue
+            if isinstance(node, BoundVar):
+                scope.names[node] = f"v{scope.depth - 1 - node.index}"
+            elif isinstance(node, FreeVar):
+                scope.names[node] = self.constant(node.name)
+            elif isinstance(node, DBStar):
+                scope.names[node] = "STAR"
+            elif isinstance(node, DBSquare):
+                scope.names[node] = "SQUARE"
+            elif isinstance(node, DBApplication):
+                pending = [child for child in (node.arg, node.func) if child not in scope.names]
+                if pending:
+                    todo += [(child, scope, None) for child in pending]
+                    continue
+                scope.names[node] = self.temporary(scope, f"app({scope.names[node.func]}, {scope.names[node.arg]})")
+            elif isinstance(node, DBBinder):
+                if inner is None:
+                    inner = Scope(scope.depth + 1, scope.indent + 1, {known : name for known, name in scope.names.items() if known.loose_range() == 0})
+                    todo[-1] = (node, scope, inner)
+                    todo += [(node.body, inner, None), (node.param_type, scope, None)]
+                    continue
+                scope.names[node] = self.function(node, scope, inner)
+            else:
+                raise CompilationError(f"Cannot compile {node.to_str()}")
+            todo.pop()
+        top.emit(f"return {top.names[term]}")
+        return "def make(c):\n" + "\n".join(top.lines)
+
+    def temporary(self, scope: Scope, expression: str) -> str:
+        name = f"t{self.temporaries}"
+        self.temporaries += 1
+        scope.emit(f"{name} = {expression}")
+        return name
+
+    def function(self, node: DBBinder, scope: Scope, inner: Scope) -> str:
+        kind, param_type, body = type(node).__name__, scope.names[node.param_type], inner.names[node.body]
+        if not inner.lines:
+            return self.temporary(scope, f"Binder({kind}, {param_type}, lambda v{scope.depth}: {body})")
+        name = f"f{self.functions}"
+        self.functions += 1
+        scope.emit(f"def {name}(v{scope.depth}):")
+        inner.emit(f"return {body}")
+        scope.lines += inner.lines
+        return self.temporary(scope, f"Binder({kind}, {param_type}, {name})")
+
+NAMESPACE = {"app": app, "Binder": Binder, "STAR": STAR, "SQUARE": SQUARE, "DBAbstraction": DBAbstraction, "DBProduct": DBProduct}
+
+# generated code by term with the free names it takes, in order
+compiled = LRUCache(maxsize=1024)
+
+def compile_term(term: DBExpr) -> Tuple[Callable[[List[Any]], Any], List[str]]:
+    entry = compiled.lookup(term)
+    if entry is None:
+        compiler = Compiler()
+        source = compiler.compile(term)
+        namespace = dict(NAMESPACE)
+        try:
+            exec(compile(source, "<compiled term>", "exec"), namespace)
+        except (RecursionError, MemoryError, SyntaxError) as error:
+            # Python's own compiler limits the nesting of functions
+            raise CompilationError(f"Term too deeply nested to compile: {type(error).__name__}")
+        entry = (namespace["make"], compiler.constants)
+        compiled.store(term, entry)
+    return entry
+
+def resolve(name: str, defs: Definitions | None) -> Any:
+    if defs is None or name not in defs: return Neutral(name)
+    # one Global per name, so every use shares its evaluated value
+    if name not in defs.compiled: defs.compiled[name] = Global(defs.lookup(name), defs)
+    return defs.compiled[name]
+
+def evaluate(term: DBExpr, defs: Definitions | None = None) -> Any:
+    make, names = compile_term(term)
+    return make([resolve(name, defs) for name in names])
+
+def read_back(value: Any, depth: int = 0) -> DBExpr:
+    results: List[DBExpr] = []
+    # values to read back, or binders and applications whose parts are on results
+    todo: List[Tuple[Any, int, bool]] = [(value, depth, False)]
+    while todo:
+        value, depth, built = todo.pop()
+        if built and type(value) is Binder:
+            body = results.pop()
+            results.append(value.kind(param_type=results.pop(), body=body))
+        elif built:
+            arg = results.pop()
+            results.append(DBApplication(func=results.pop(), arg=arg))
+        elif type(value) is Binder:
+            todo += [(value, depth, True), (value.body(Neutral(depth)), depth + 1, False), (value.param_type, depth, False)]
+        elif type(value) is NeutralApplication:
+            todo += [(value, depth, True), (value.arg, depth, False), (value.func, depth, False)]
+        elif type(value) is Neutral:
+            results.append(BoundVar(depth - 1 - value.head) if isinstance(value.head, int) else FreeVar(value.head))
+        elif type(value) is Global:
+            results.append(FreeVar(value.definition.name))
+        elif type(value) is Sort:
+            results.append(value.term)
+        else:
+            raise CompilationError(f"No expected value found, instead {value}")
+    return results[0]
+
+# Terms nested deeper than Python compiles them, or whose evaluation nests calls deeper
+# than the recursion limit, are left to the machine, which keeps its state on the heap
+def normalize(term: DBExpr, defs: Definitions | None = None) -> DBExpr:
+    try:
+        return read_back(evaluate(term, defs))
+    except (CompilationError, RecursionError):
+        return reduce(term, defs, Strategy.NEED)
@@ -0,0 +1,69 @@
+from typing import List, Tuple
+from deBruijn import DBExpr, FreeVar, DBBinder, DBApplication
+from environment import Env as Definitions
+
+# Definitional equality on de Bruijn terms. Both sides are only reduced to weak head
+# normal form, heads are compared, and arguments or binder parts are compared the same
+# way afterwards, so checks that fail or succeed early never normalize whole types.
+
+def spine(term: DBExpr) -> Tuple[DBExpr, List[DBExpr]]:
+    args: List[DBExpr] = []
+    while isinstance(term, DBApplication):
+        args.append(term.arg)
+        term = term.func
+    args.reverse()
+    return term, args
+
+# products are beta reduced like abstractions, as in Application.one_beta_normal_reduction.
+# Names in defs are unfolded only when they are applied.
+def whnf(term: DBExpr, defs: Definitions | None = None) -> DBExpr:
+    args: List[DBExpr] = [] # next argument last
+    while True:
+        if isinstance(term, DBApplication):
+            args.append(term.arg)
+            term = term.func
+        elif isinstance(term, DBBinder) and args:
+            term = term.body.instantiate(args.pop())
+        elif isinstance(term, FreeVar) and args and defs is not None and term.name in defs:
+            term = defs.lookup(term.name).term
+        else:
+            break
+    while args: term = DBApplication(func=term, arg=args.pop())
+    return term
+
+def unfold(term: DBExpr, defs: Definitions | None) -> DBExpr | None:
+    head, args = spine(term)
+    if not (isinstance(head, FreeVar) and defs is not None and head.name in defs): return None
+    term = defs.lookup(head.name).term
+    for arg in args: term = DBApplication(func=term, arg=arg)
+    return term
+
+def convertible(left: DBExpr, right: DBExpr, defs: Definitions | None = None) -> bool:
+    todo: List[Tuple[DBExpr, DBExpr]] = [(left, right)]
+    while todo:
+        left, right = todo.pop()
+        # hash consed, identical terms are alpha equal
+        if left is right: continue
+        left, right = whnf(left, defs), whnf(right, defs)
+        if left is right: continue
+        if isinstance(left, DBBinder) and type(left) is type(right):
+            todo += [(left.body, right.body), (left.param_type, right.param_type)]
+            continue
+        left_head, left_args = spine(left)
+        right_head, right_args = spine(right)
+        defined = isinstance(left_head, FreeVar) and defs is not None and left_head.name in defs
+        if left_head is right_head and len(left_args) == len(right_args) and not defined:
+            todo += list(zip(reversed(left_args), reversed(right_args)))
+            continue
+        # differing heads may still agree once a definition is unfolded, and so may
+        # differing arguments of the same definition
+        unfolded = unfold(left, defs)
+        if unfolded is not None:
+            todo.append((unfolded, right))
+            continue
+        unfolded = unfold(right, defs)
+        if unfolded is not None:
+            todo.append((left, unfolded))
+            continue
+        return False
+    return True
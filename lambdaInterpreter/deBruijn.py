@@ -0,0 +1,244 @@
+from abc import ABC, ABCMeta
+from dataclasses import dataclass, field, fields
+from typing import Set, Self, Dict, List, Tuple
+from weakref import WeakValueDictionary
+
+class DeBruijnError(Exception):
+    pass
+
+# Node factory: calling a term class returns the one shared node for these children.
+# Children are shared themselves, so the lookup key only needs their identity and
+# equal terms are always the same object.
+class HashConsed(ABCMeta):
+    _nodes: WeakValueDictionary = WeakValueDictionary()
+    _key_fields: Dict[type, Tuple[List[str], List[str]]] = {}
+    def __call__(cls, *args, **kwargs):
+        if cls not in HashConsed._key_fields:
+            init_fields = [f for f in fields(cls) if f.init]
+            HashConsed._key_fields[cls] = ([f.name for f in init_fields], [f.name for f in init_fields if f.compare])
+        init_names, key_names = HashConsed._key_fields[cls]
+        values = {**dict(zip(init_names, args)), **kwargs}
+        key = (cls,) + tuple(values[name] for name in key_names)
+        node = HashConsed._nodes.get(key)
+        if node is None:
+            node = super().__call__(*args, **kwargs)
+            HashConsed._nodes[key] = node
+        return node
+
+def interned_count() -> int:
+    return len(HashConsed._nodes)
+
+# Locally nameless terms: bound variables are de Bruijn indices (0 = innermost binder),
+# free variables keep their names. Binders carry no names, printers choose them from
+# the binder context (see abstractSyntaxTree.binder_name), so identity is alpha equality
+# and a term prints the same whichever terms were built before it.
+@dataclass(frozen=True, eq=False)
+class DBExpr(ABC, metaclass=HashConsed):
+    # rebuild through the factory so copies and unpickled terms stay shared
+    def __reduce__(self):
+        return (type(self), tuple(getattr(self, f.name) for f in fields(self) if f.init))
+    def to_str(self) -> str:
+        pass
+    def loose_range(self) -> int:
+        # every loose bound index in self is smaller than this
+        pass
+    # direct subterms, each with the number of binders entered to reach it
+    def children(self) -> Tuple[Tuple[Self, int], ...]:
+        return ()
+    # walks below are iterative and visit shared subterms once, so deep terms are fine
+    def get_free_names(self) -> Set[str]:
+        names: Set[str] = set()
+        seen: Set[DBExpr] = set()
+        todo: List[DBExpr] = [self]
+        while todo:
+            term = todo.pop()
+            if term in seen: continue
+            seen.add(term)
+            if isinstance(term, FreeVar): names.add(term.name)
+            todo += [child for child, _ in term.children()]
+        return names
+    def references(self, index: int) -> bool:
+        seen: Set[Tuple[DBExpr, int]] = set()
+        todo: List[Tuple[DBExpr, int]] = [(self, index)]
+        while todo:
+            term, index = todo.pop()
+            if term.loose_range() <= index or (term, index) in seen: continue
+            seen.add((term, index))
+            if isinstance(term, BoundVar) and term.index == index: return True
+            todo += [(child, index + offset) for child, offset in term.children()]
+        return False
+    def shift(self, amount: int, cutoff: int = 0) -> Self:
+        pass
+    def substitute(self, index: int, sub: Self) -> Self:
+        pass
+    def instantiate(self, sub: Self) -> Self:
+        return self.substitute(0, sub)
+    # same node with its children replaced, in the order children() lists them
+    def with_children(self, children: Tuple[Self, ...]) -> Self:
+        return self
+    # replace free names by closed terms, memo keeps shared subterms shared
+    def replace_free(self, defs: Dict[str, Self], memo: Dict[Self, Self] = None) -> Self:
+        if memo is None: memo = {}
+        todo: List[DBExpr] = [self]
+        while todo:
+            term = todo[-1]
+            if term in memo:
+                todo.pop()
+                continue
+            pending = [child for child, _ in term.children() if child not in memo]
+            if pending:
+                todo += pending
+                continue
+            todo.pop()
+            if isinstance(term, FreeVar): memo[term] = defs.get(term.name, term)
+            else: memo[term] = term.with_children(tuple(memo[child] for child, _ in term.children()))
+        return memo[self]
+
+@dataclass(frozen=True, eq=False)
+class BoundVar(DBExpr):
+    index: int
+    def to_str(self) -> str:
+        return f"#{self.index}"
+    def loose_range(self) -> int:
+        return self.index + 1
+    def shift(self, amount: int, cutoff: int = 0) -> DBExpr:
+        if self.index < cutoff: return self
+        if self.index + amount < 0:
+            raise DeBruijnError(f"Shifting #{self.index} by {amount} below zero")
+        return BoundVar(self.index + amount)
+    def substitute(self, index: int, sub: DBExpr) -> DBExpr:
+        if self.index == index: return sub.shift(index)
+        if self.index > index: return BoundVar(self.index - 1)
+        return self
+
+@dataclass(frozen=True, eq=False)
+class FreeVar(DBExpr):
+    name: str
+    def to_str(self) -> str:
+        return self.name
+    def loose_range(self) -> int:
+        return 0
+    def shift(self, amount: int, cutoff: int = 0) -> DBExpr:
+        return self
+    def substitute(self, index: int, sub: DBExpr) -> DBExpr:
+        return self
+
+# placeholder for an erased abstraction parameter type
+@dataclass(frozen=True, eq=False)
+class DBErased(DBExpr):
+    def to_str(self) -> str:
+        return "?"
+    def loose_range(self) -> int:
+        return 0
+    def shift(self, amount: int, cutoff: int = 0) -> DBExpr:
+        return self
+    def substitute(self, index: int, sub: DBExpr) -> DBExpr:
+        return self
+
+@dataclass(frozen=True, eq=False)
+class DBBinder(DBExpr, ABC):
+    param_type: DBExpr
+    body: DBExpr
+    range: int = field(init=False, compare=False, repr=False)
+    def __post_init__(self):
+        object.__setattr__(self, "range", max(self.param_type.loose_range(), self.body.loose_range() - 1))
+    def loose_range(self) -> int:
+        return self.range
+    def children(self) -> Tuple[Tuple[DBExpr, int], ...]:
+        return ((self.param_type, 0), (self.body, 1))
+    def shift(self, amount: int, cutoff: int = 0) -> DBExpr:
+        if self.range <= cutoff: return self
+        return type(self)(param_type=self.param_type.shift(amount, cutoff), body=self.body.shift(amount, cutoff + 1))
+    def substitute(self, index: int, sub: DBExpr) -> DBExpr:
+        if self.range <= index: return self
+        return type(self)(param_type=self.param_type.substitute(index, sub), body=self.body.substitute(index + 1, sub))
+    def with_children(self, children: Tuple[DBExpr, ...]) -> DBExpr:
+        return type(self)(param_type=children[0], body=children[1])
+
+# \x:t.e
+@dataclass(frozen=True, eq=False)
+class DBAbstraction(DBBinder):
+    def to_str(self) -> str:
+        return f"\\ {self.param_type.to_str()}. {self.body.to_str()}"
+
+# &x:A.B
+@dataclass(frozen=True, eq=False)
+class DBProduct(DBBinder):
+    def to_str(self) -> str:
+        return f"& {self.param_type.to_str()}. {self.body.to_str()}"
+
+# f x
+@dataclass(frozen=True, eq=False)
+class DBApplication(DBExpr):
+    func: DBExpr
+    arg: DBExpr
+    range: int = field(init=False, compare=False, repr=False)
+    def __post_init__(self):
+        object.__setattr__(self, "range", max(self.func.loose_range(), self.arg.loose_range()))
+    def to_str(self) -> str:
+        left = f"({self.func.to_str()})" if isinstance(self.func, DBBinder) else self.func.to_str()
+        right = f"({self.arg.to_str()})" if isinstance(self.arg, (DBApplication, DBBinder)) else self.arg.to_str()
+        return f"{left} {right}"
+    def loose_range(self) -> int:
+        return self.range
+    def children(self) -> Tuple[Tuple[DBExpr, int], ...]:
+        return ((self.func, 0), (self.arg, 0))
+    def shift(self, amount: int, cutoff: int = 0) -> DBExpr:
+        if self.range <= cutoff: return self
+        return DBApplication(func=self.func.shift(amount, cutoff), arg=self.arg.shift(amount, cutoff))
+    def substitute(self, index: int, sub: DBExpr) -> DBExpr:
+        if self.range <= index: return self
+        return DBApplication(func=self.func.substitute(index, sub), arg=self.arg.substitute(index, sub))
+    def with_children(self, children: Tuple[DBExpr, ...]) -> DBExpr:
+        return DBApplication(func=children[0], arg=children[1])
+
+@dataclass(frozen=True, eq=False)
+class DBUniverse(DBExpr, ABC):
+    def loose_range(self) -> int:
+        return 0
+    def shift(self, amount: int, cutoff: int = 0) -> DBExpr:
+        return self
+    def substitute(self, index: int, sub: DBExpr) -> DBExpr:
+        return self
+
+@dataclass(frozen=True, eq=False)
+class DBStar(DBUniverse):
+    def to_str(self) -> str:
+        return "*"
+
+@dataclass(frozen=True, eq=False)
+class DBSquare(DBUniverse):
+    def to_str(self) -> str:
+        return "#"
+
+TERM_CLASSES: Dict[str, type] = {cls.__name__ : cls for cls in (BoundVar, FreeVar, DBErased, DBAbstraction, DBProduct, DBApplication, DBStar, DBSquare)}
+
+# Terms as flat rows for pickling, children before their parents, so terms of any depth
+# are stored and rebuilt without recursion and shared subterms are stored once
+class TermTable():
+    def __init__(self):
+        self.positions: Dict[DBExpr, int] = {}
+        self.rows: List[Tuple[str, Tuple[Tuple[bool, object], ...]]] = []
+
+    def add(self, term: DBExpr) -> int:
+        todo = [term]
+        while todo:
+            node = todo[-1]
+            if node in self.positions:
+                todo.pop()
+                continue
+            pending = [child for child, _ in node.children() if child not in self.positions]
+            if pending:
+                todo += pending
+                continue
+            todo.pop()
+            values = tuple((True, self.positions[value]) if isinstance(value, DBExpr) else (False, value) for value in (getattr(node, f.name) for f in fields(node) if f.init))
+            self.positions[node] = len(self.rows)
+            self.rows.append((type(node).__name__, values))
+        return self.positions[term]
+
+def terms_from_rows(rows: List[Tuple[str, Tuple[Tuple[bool, object], ...]]]) -> List[DBExpr]:
+    terms: List[DBExpr] = []
+    for name, values in rows:
+        terms.append(TERM_CLASSES[name](*(terms[value] if is_term else value for is_term, value in values)))
+    return terms
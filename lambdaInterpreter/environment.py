@@ -1,2 +1,63 @@
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Optional, Iterator, Any, Tuple
+from deBruijn import DBExpr
+
+class EnvError(Exception):
+    pass
+
+@dataclass(eq=False)
+class Definition:
+    name: str
+    term: DBExpr # closed, every definition it uses unfolded
+    type: Optional[DBExpr] # None if the definition did not type check
+    folded: DBExpr # as written, names of other definitions left free
+
+# Global definitions by name. Names stay folded in terms and are only unfolded when
+# evaluation applies them, see normalization.apply.
 class Env():
-    pass
\ No newline at end of file
+    def __init__(self, definitions: Dict[str, Definition] = {}):
+        self.definitions: Dict[str, Definition] = dict(definitions)
+        self.values: Dict[str, Any] = {} # evaluated folded definitions, filled by normalization
+        self.compiled: Dict[str, Any] = {} # the same for compilation, filled on first application
+        self.dependencies: Dict[str, FrozenSet[Tuple[str, DBExpr]]] = {} # see key
+
+    def define(self, definition: Definition):
+        self.definitions[definition.name] = definition
+        self.values.clear()
+        self.compiled.clear()
+        self.dependencies.clear()
+
+    def lookup(self, name: str) -> Definition:
+        if name not in self.definitions:
+            raise EnvError(f"`{name}` is not defined")
+        return self.definitions[name]
+
+    # what a normal form of term computed against these definitions depends on: the folded
+    # definitions of the names it uses and of the names those use in turn, equal for Envs
+    # that unfold all of them the same way
+    def key(self, term: DBExpr) -> FrozenSet[Tuple[str, DBExpr]]:
+        return frozenset().union(*(self.depends_on(name) for name in term.get_free_names() if name in self.definitions))
+
+    def depends_on(self, name: str) -> FrozenSet[Tuple[str, DBExpr]]:
+        if name not in self.dependencies:
+            found: Dict[str, DBExpr] = {}
+            todo = [name]
+            while todo:
+                used = todo.pop()
+                if used in found or used not in self.definitions: continue
+                found[used] = self.definitions[used].folded
+                todo += found[used].get_free_names()
+            self.dependencies[name] = frozenset(found.items())
+        return self.dependencies[name]
+
+    def linked(self) -> Dict[str, DBExpr]:
+        return {name : definition.term for name, definition in self.definitions.items()}
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.definitions
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.definitions)
+
+    def __len__(self) -> int:
+        return len(self.definitions)
@@ -0,0 +1,131 @@
+from typing import Dict, List, Tuple
+from deBruijn import DBExpr, BoundVar, FreeVar, DBAbstraction, DBProduct, DBApplication, DBStar, DBSquare, DBErased
+from normalization import Value, Env, Closure, VNeutral, VProduct, VSquare, VErased, lookup, evaluate, apply_closure, read_back, normalize
+
+# Type erasure: a program that type checks up front keeps its type under reduction,
+# so abstraction annotations can be dropped while normalizing and recovered afterwards
+# by checking the normal form against the inferred type.
+
+class ErasureError(Exception):
+    pass
+
+def erase(term: DBExpr, memo: Dict[DBExpr, DBExpr] = None) -> DBExpr:
+    if memo is None: memo = {}
+    # post order walk: a node is erased once its children are in memo
+    todo = [term]
+    while todo:
+        current = todo[-1]
+        if current in memo:
+            todo.pop()
+            continue
+        children = [child for child in children_of(current) if child not in memo]
+        if children:
+            todo += children
+            continue
+        todo.pop()
+        if isinstance(current, DBAbstraction):
+            memo[current] = DBAbstraction(param_type=DBErased(), body=memo[current.body])
+        elif isinstance(current, DBProduct):
+            memo[current] = DBProduct(param_type=memo[current.param_type], body=memo[current.body])
+        elif isinstance(current, DBApplication):
+            memo[current] = DBApplication(func=memo[current.func], arg=memo[current.arg])
+        else:
+            memo[current] = current
+    return memo[term]
+
+# the children erase rebuilds, abstraction annotations are dropped instead
+def children_of(term: DBExpr) -> Tuple[DBExpr, ...]:
+    if isinstance(term, DBAbstraction): return (term.body,)
+    elif isinstance(term, DBProduct): return (term.param_type, term.body)
+    elif isinstance(term, DBApplication): return (term.func, term.arg)
+    return ()
+
+# Checking and inference run over an explicit stack of tasks, each pushing the recovered
+# term and its type (None when checked) on a result stack, so deep terms are handled too.
+# types: types of the bound variables, innermost first like env, env: their neutral values
+CHECK, INFER, APPLICATION_ARG, APPLICATION, PRODUCT_BODY, PRODUCT, ABSTRACTION, LAMBDA = range(8)
+
+def recover(todo: List[Tuple], gamma: Dict[str, Value]) -> Tuple[DBExpr, Value | None]:
+    results: List[Tuple[DBExpr, Value | None]] = []
+    while todo:
+        task = todo.pop()
+        op = task[0]
+        if op == CHECK:
+            _, term, expected, depth, types, env = task
+            if isinstance(term, DBAbstraction) and isinstance(term.param_type, DBErased):
+                if not isinstance(expected, VProduct):
+                    raise ErasureError(f"Abstraction checked against non product {read_back(expected, depth).to_str()}")
+                var = VNeutral(head=depth)
+                todo.append((LAMBDA, expected.param_type, depth))
+                todo.append((CHECK, term.body, apply_closure(expected.closure, var), depth + 1, (expected.param_type, types), (var, env)))
+            else:
+                todo.append((INFER, term, depth, types, env))
+        elif op == INFER:
+            _, term, depth, types, env = task
+            if isinstance(term, BoundVar):
+                results.append((term, lookup(types, term.index)))
+            elif isinstance(term, FreeVar):
+                if term.name not in gamma:
+                    raise ErasureError(f"Free variable {term.name} has no type")
+                results.append((term, gamma[term.name]))
+            elif isinstance(term, DBApplication):
+                todo.append((APPLICATION_ARG, term.arg, depth, types, env))
+                todo.append((INFER, term.func, depth, types, env))
+            elif isinstance(term, DBProduct):
+                todo.append((PRODUCT_BODY, term.body, depth, types, env))
+                todo.append((INFER, term.param_type, depth, types, env))
+            elif isinstance(term, DBAbstraction) and not isinstance(term.param_type, DBErased):
+                param_type = evaluate(term.param_type, env)
+                todo.append((ABSTRACTION, term, param_type, depth, env))
+                todo.append((INFER, term.body, depth + 1, (param_type, types), (VNeutral(head=depth), env)))
+            elif isinstance(term, DBStar):
+                results.append((term, VSquare()))
+            else:
+                raise ErasureError(f"Cannot recover the type of {term.to_str()}")
+        elif op == APPLICATION_ARG:
+            _, arg, depth, types, env = task
+            func_type = results[-1][1]
+            if not isinstance(func_type, VProduct):
+                raise ErasureError("Applied term does not have a product type")
+            todo.append((APPLICATION, env))
+            todo.append((CHECK, arg, func_type.param_type, depth, types, env))
+        elif op == APPLICATION:
+            arg, _ = results.pop()
+            func, func_type = results.pop()
+            # the argument is only evaluated for dependent types, evaluating every argument
+            # of a nested spine again would be quadratic in its depth
+            arg_value = evaluate(arg, task[1]) if func_type.closure.body.references(0) else VErased()
+            results.append((DBApplication(func=func, arg=arg), apply_closure(func_type.closure, arg_value)))
+        elif op == PRODUCT_BODY:
+            _, body, depth, types, env = task
+            param_type = results[-1][0]
+            todo.append((PRODUCT,))
+            todo.append((INFER, body, depth + 1, (evaluate(param_type, env), types), (VNeutral(head=depth), env)))
+        elif op == PRODUCT:
+            body, body_type = results.pop()
+            param_type, _ = results.pop()
+            results.append((DBProduct(param_type=param_type, body=body), body_type))
+        elif op == ABSTRACTION:
+            _, term, param_type, depth, env = task
+            _, body_type = results.pop()
+            results.append((term, VProduct(param_type=param_type, closure=Closure(env, read_back(body_type, depth + 1)))))
+        elif op == LAMBDA:
+            body, _ = results.pop()
+            results.append((DBAbstraction(param_type=read_back(task[1], task[2]), body=body), None))
+    return results.pop()
+
+def check(term: DBExpr, expected: Value, depth: int, types: Env, env: Env, gamma: Dict[str, Value]) -> DBExpr:
+    return recover([(CHECK, term, expected, depth, types, env)], gamma)[0]
+
+def infer(term: DBExpr, depth: int, types: Env, env: Env, gamma: Dict[str, Value]) -> Tuple[DBExpr, Value]:
+    return recover([(INFER, term, depth, types, env)], gamma)
+
+# term_type: the already inferred type of term, gamma: types of its free variables
+def normalize_erased(term: DBExpr, term_type: DBExpr, gamma: Dict[str, DBExpr]) -> DBExpr:
+    normal = normalize(erase(term))
+    gamma_values = {name: evaluate(var_type) for name, var_type in gamma.items()}
+    try:
+        return check(normal, evaluate(term_type), 0, None, None, gamma_values)
+    except ErasureError:
+        # annotations could not be recovered, normalize the annotated term instead
+        return normalize(term)
@@ -0,0 +1,81 @@
+from typing import Callable, Dict, List, Any
+import atexit
+import os
+import sys
+import time
+
+# Counters, timed phases and hooks for the interpreter. Everything is off by default and
+# call sites check TRACE.enabled before recording, so a disabled tracer costs one
+# attribute lookup per event.
+#
+# events: beta_steps, delta_steps, substitutions (pushed one level by do_substitution),
+# renames, type_inferences, type_cache_hits, normal_form_cache_hits, free_vars_cache_hits,
+# alpha_checks, type_mismatches
+# phases: parse, prelude, infer_type, normalize
+# Setting LAMBDA_TRACE=1 enables the tracer and prints its report to stderr at exit.
+
+Hook = Callable[[str, int, Dict[str, Any]], None]
+
+class Phase:
+    def __init__(self, tracer: "Tracer", name: str):
+        self.tracer = tracer
+        self.name = name
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        self.tracer.seconds[self.name] = self.tracer.seconds.get(self.name, 0.0) + seconds
+        self.tracer.calls[self.name] = self.tracer.calls.get(self.name, 0) + 1
+        return False
+
+class NoPhase:
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc_info):
+        return False
+
+NO_PHASE = NoPhase()
+
+class Tracer():
+    def __init__(self):
+        self.enabled = False
+        self.counters: Dict[str, int] = {}
+        self.seconds: Dict[str, float] = {} # total time per phase, nested phases are counted in both
+        self.calls: Dict[str, int] = {}
+        self.hooks: Dict[str, List[Hook]] = {} # by event name, "*" receives every event
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+
+    def event(self, name: str, amount: int = 1, **data):
+        self.counters[name] = self.counters.get(name, 0) + amount
+        for hook in self.hooks.get(name, []) + self.hooks.get("*", []):
+            hook(name, amount, data)
+
+    def phase(self, name: str) -> Phase | NoPhase:
+        return Phase(self, name) if self.enabled else NO_PHASE
+
+    def subscribe(self, name: str, hook: Hook):
+        self.hooks.setdefault(name, []).append(hook)
+
+    def unsubscribe(self, name: str, hook: Hook):
+        self.hooks.get(name, []).remove(hook)
+
+    def reset(self):
+        self.counters.clear()
+        self.seconds.clear()
+        self.calls.clear()
+
+    def report(self) -> str:
+        lines = ["counters:"]
+        lines += [f"  {name:<18} {count:>12}" for name, count in sorted(self.counters.items())]
+        lines.append("phases:")
+        lines += [f"  {name:<18} {self.calls[name]:>12} calls {seconds:>10.4f}s" for name, seconds in sorted(self.seconds.items(), key=lambda item: -item[1])]
+        return "\n".join(lines)
+
+TRACE = Tracer()
+
+if os.environ.get("LAMBDA_TRACE"):
+    TRACE.enable()
+    atexit.register(lambda: print(TRACE.report(), file=sys.stderr))
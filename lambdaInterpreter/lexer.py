@@ -1,7 +1,9 @@
 from dataclasses import dataclass
 from enum import Enum, auto
-from typing import List, Tuple
+from typing import List, Tuple, Dict, Deque, Iterator
+from collections import deque
 import os
+import re
 
 class TokenError(Exception):
     pass
@@ -23,80 +25,108 @@ class TokenType(Enum):
     CLOSE_BRACKET = auto()  # ]
     STAR = auto() # *
     SQUARE = auto() # #
+    INCLUDE = auto() # {file}, resolved by the lexer
     EOF = auto() # End of File
 
+@dataclass
+class Span:
+    file: str
+    line: int
+    column: int
+    end_line: int
+    end_column: int
+    def to(self, end: "Span") -> "Span":
+        return Span(self.file, self.line, self.column, end.end_line, end.end_column)
+
 @dataclass
 class Token:
     value: str
     type: TokenType
+    span: Span | None = None
 
 def read_from_file(path: str) -> str:
-    # print(os.getcwd())
-    try:
-        with open(path, "r") as file:
-            return file.read()
-    except IOError:
-        with open(f"lambdaInterpreter/inputs/{path}.lm", "r") as file:
-            return file.read()
-
+    with open(resolve_include(path), "r") as file:
+        return file.read()
 
-def tokenize(sourceCode: str) -> List[Token]:
+def resolve_include(path: str) -> str:
+    candidates = [path, f"lambdaInterpreter/inputs/{path}.lm", os.path.join(os.path.dirname(__file__), "inputs", f"{path}.lm")]
+    for candidate in candidates:
+        if os.path.isfile(candidate): return os.path.realpath(candidate)
+    raise TokenError(f"Included file `{path}` not found")
 
-    def is_skippable(src: str) -> bool:
-        return src in [" ", "\n", "\t", "\r"]
+TOKEN_REGEX = re.compile(r"""
+    (?P<SKIP>[ \t\r\n]+)
+  | (?P<COMMENT>//[^\n]*|/\*.*?\*/)
+  | (?P<INCLUDE>\{[^}]*\})
+  | (?P<SUB>:=)
+  | (?P<TO>->)
+  | (?P<VAR>\w+)
+  | (?P<OPEN_PAREN>\()
+  | (?P<CLOSE_PAREN>\))
+  | (?P<OPEN_BRACKET>\[)
+  | (?P<CLOSE_BRACKET>\])
+  | (?P<COMMA>,)
+  | (?P<DOT>\.)
+  | (?P<LAMBDA>\\)
+  | (?P<PROD>&)
+  | (?P<OFTYPE>:)
+  | (?P<STAR>\*)
+  | (?P<SQUARE>\#)
+""", re.VERBOSE | re.DOTALL)
 
-    tokens = []
-    src = list(sourceCode)
+# lexed includes by resolved path, with the modification time they were lexed at
+include_cache: Dict[str, Tuple[float, List[Token]]] = {}
 
-    def str_is(search: str) -> bool:
-        return len(search) <= len(src) and "".join(src[:len(search)]) == search
-    
-    def add_token(token_type: TokenType, pop_len: int = 1):
-        tokens.append(Token(''.join(src.pop(0) for _ in range(pop_len)), token_type)) 
+def scan(sourceCode: str, file: str = "<input>") -> Iterator[Token]:
+    line, line_start, pos = 1, 0, 0
+    while pos < len(sourceCode):
+        match = TOKEN_REGEX.match(sourceCode, pos)
+        if match is None:
+            if sourceCode.startswith("/*", pos):
+                raise TokenError(f"Unterminated comment at {file}:{line}:{pos - line_start + 1}")
+            if sourceCode[pos] == "{":
+                raise TokenError(f"Unterminated include at {file}:{line}:{pos - line_start + 1}")
+            raise TokenError(f"Token Error found at >{sourceCode[pos]}< during lexing ({file}:{line}:{pos - line_start + 1})")
+        value, kind = match.group(), match.lastgroup
+        start_line, start_column = line, pos - line_start + 1
+        newlines = value.count("\n")
+        if newlines:
+            line += newlines
+            line_start = pos + value.rindex("\n") + 1
+        pos = match.end()
+        if kind in ("SKIP", "COMMENT"): continue
+        if kind == "INCLUDE": value = value[1:-1].strip()
+        yield Token(value, TokenType[kind], Span(file, start_line, start_column, line, pos - line_start + 1))
+    yield Token("EndOfFile", TokenType.EOF, Span(file, line, pos - line_start + 1, line, pos - line_start + 1))
 
-    # Alle Tokens fürs ganze File erstellen
+def lex_include(path: str) -> List[Token]:
+    modified = os.path.getmtime(path)
+    if path not in include_cache or include_cache[path][0] != modified:
+        with open(path, "r") as file:
+            include_cache[path] = (modified, list(scan(file.read(), path))[:-1])
+    return include_cache[path][1]
 
-    while len(src) > 0:
-        if str_is("/*"):
-            src.pop(0)
-            while (not str_is("*/")):
-                src.pop(0)
-            src.pop(0)
-        elif str_is("//"):
-            while len(src) > 0 and src[0] != "\n":
-                src.pop(0)
-        elif str_is("("): add_token(TokenType.OPEN_PAREN)
-        elif str_is(")"): add_token(TokenType.CLOSE_PAREN)
-        elif str_is("{"): 
-            src.pop(0)
-            path = ""
-            while (char := src.pop(0)) != "}":
-                path += char
-            src += read_from_file(path.strip())
-        elif str_is("["): add_token(TokenType.OPEN_BRACKET)
-        elif str_is("]"): add_token(TokenType.CLOSE_BRACKET)
-        elif str_is(","): add_token(TokenType.COMMA)
-        elif str_is("."): add_token(TokenType.DOT)
-        elif str_is("\\"): add_token(TokenType.LAMBDA)
-        elif str_is("&"): add_token(TokenType.PROD)
-        elif str_is(":="): add_token(TokenType.SUB, pop_len=2)
-        elif str_is(":"): add_token(TokenType.OFTYPE)
-        elif str_is("*"): add_token(TokenType.STAR)
-        elif str_is("#"): add_token(TokenType.SQUARE)
-        elif str_is("->"): add_token(TokenType.TO, pop_len=2)
-        elif src[0].isalpha() or src[0].isdigit() or src[0] == "_":
-            ident = ""
-            while len(src) > 0 and (src[0].isalpha() or src[0].isdigit() or src[0] == "_"):
-                ident += src.pop(0)
-            tokens.append(Token(ident, TokenType.VAR))
-        # skip spaces etc
-        elif is_skippable(src[0]):
-            src.pop(0)
-        else:
-            raise TokenError(f"Token Error found at >{src[0]}< during lexing")
+# Included files are appended after the including source, each include remembers the
+# chain of files that led to it so cycles are reported instead of expanding forever.
+def lex(sourceCode: str, file: str = "<input>") -> Iterator[Token]:
+    pending: Deque[Tuple[str, Tuple[str, ...]]] = deque()
+    eof = None
+    for token in scan(sourceCode, file):
+        if token.type == TokenType.INCLUDE: pending.append((token.value, ()))
+        elif token.type == TokenType.EOF: eof = token
+        else: yield token
+    while pending:
+        include, chain = pending.popleft()
+        path = resolve_include(include)
+        if path in chain:
+            raise TokenError(f"Include cycle: {' -> '.join(chain + (path,))}")
+        for token in lex_include(path):
+            if token.type == TokenType.INCLUDE: pending.append((token.value, chain + (path,)))
+            else: yield token
+    yield eof
 
-    tokens.append(Token("EndOfFile", TokenType.EOF))
-    return tokens
+def tokenize(sourceCode: str) -> List[Token]:
+    return list(lex(sourceCode))
 
 def main():
     src = "\\x.x f x [x:=y] 'n' 123 hihi12 *nonononono* \\x.$$mips\nmips$$ <1,2> 1.22 True False #why"
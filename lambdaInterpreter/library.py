@@ -0,0 +1,171 @@
+from dataclasses import dataclass, field
+from typing import List, Tuple, Dict, Optional
+from deBruijn import DBExpr, TermTable, terms_from_rows
+from environment import Env, Definition
+from abstractSyntaxTree import Program, Variable, Substitution, TypeInferenceError, TYPE_CACHE
+from lexer import Token, TokenType, lex, scan, resolve_include
+from parser import Parser
+from instrumentation import TRACE
+import hashlib
+import os
+import pickle
+
+# Compiled preludes: the definitions appended by a program's {file} includes, resolved
+# against each other and type checked once, then stored under CACHE_DIR together with
+# the content hash and modification times of every file the includes pull in. Terms are
+# stored as flat rows, see deBruijn.TermTable, so definitions of any depth are written
+# and read back.
+
+class LibraryError(Exception):
+    pass
+
+FORMAT_VERSION = 4
+CACHE_DIR = os.environ.get("LAMBDA_CACHE_DIR", os.path.join(os.path.dirname(__file__), "__lmcache__"))
+
+@dataclass
+class Prelude:
+    includes: Tuple[str, ...]
+    # the definitions visible to the program, innermost last
+    definitions: Dict[str, Definition] = field(default_factory=dict)
+
+    # main program substitutions come first, prelude definitions after them
+    def link(self, program: Program) -> Program:
+        return Program.from_de_bruijn(program.to_de_bruijn().replace_free(self.to_env().linked()))
+
+    def to_env(self) -> Env:
+        return Env(self.definitions)
+
+    def seed_type_cache(self):
+        for definition in self.definitions.values():
+            if definition.type is not None: TYPE_CACHE.store((definition.term, ()), definition.type)
+
+    # also how preludes are handed to worker processes
+    def __getstate__(self) -> Dict:
+        table = TermTable()
+        rows = [(definition.name, table.add(definition.term), None if definition.type is None else table.add(definition.type), table.add(definition.folded)) for definition in self.definitions.values()]
+        return {"includes": self.includes, "terms": table.rows, "definitions": rows}
+
+    def __setstate__(self, state: Dict):
+        terms = terms_from_rows(state["terms"])
+        self.includes = state["includes"]
+        self.definitions = {name : Definition(name, terms[term], None if term_type is None else terms[term_type], terms[folded]) for name, term, term_type, folded in state["definitions"]}
+
+def included_files(includes: Tuple[str, ...]) -> List[str]:
+    files: List[str] = []
+    pending = list(includes)
+    while pending:
+        path = resolve_include(pending.pop(0))
+        if path in files: continue
+        files.append(path)
+        with open(path, "r") as file:
+            pending += [token.value for token in scan(file.read(), path) if token.type == TokenType.INCLUDE]
+    return files
+
+def content_key(files: List[str]) -> str:
+    digest = hashlib.sha256()
+    for path in files:
+        with open(path, "rb") as file:
+            digest.update(path.encode() + b"\0" + file.read() + b"\0")
+    return digest.hexdigest()
+
+# modification time and size, None for a file that is gone
+def stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        status = os.stat(path)
+    except OSError:
+        return None
+    return (status.st_mtime_ns, status.st_size)
+
+# one cache file per list of includes, its entry records the files they pulled in
+def prelude_path(includes: Tuple[str, ...], cache_dir: str) -> str:
+    paths = tuple(resolve_include(include) for include in includes)
+    return os.path.join(cache_dir, hashlib.sha256(f"{FORMAT_VERSION}\0{paths}".encode()).hexdigest() + ".lmc")
+
+def read_entry(path: str) -> Optional[Dict]:
+    if not os.path.isfile(path): return None
+    with open(path, "rb") as file:
+        return pickle.load(file)
+
+def write_entry(path: str, entry: Dict):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write to a temporary name first so concurrent loaders never see half a file
+    with open(f"{path}.{os.getpid()}", "wb") as file:
+        pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{path}.{os.getpid()}", path)
+
+def compile_prelude(includes: Tuple[str, ...]) -> Prelude:
+    # a nameless placeholder stands in for the program the definitions are appended to
+    tokens = [Token("", TokenType.VAR)] + list(lex("".join(f"{{{include}}}" for include in includes)))
+    expr = Parser(tokens).produce_ast().program
+    chain: List[Tuple[str, DBExpr]] = []
+    while isinstance(expr, Substitution):
+        chain.append((expr.free_var, expr.sub_expr.to_de_bruijn({}, 0)))
+        expr = expr.org_expr
+    if expr != Variable(""):
+        raise LibraryError(f"Includes {includes} contain more than definitions")
+    # the outermost substitution is the last definition, every definition sees the ones after it
+    prelude = Prelude(includes)
+    meant: Dict[str, Dict[str, Definition]] = {}
+    for name, folded in chain:
+        visible = {free : prelude.definitions[free] for free in folded.get_free_names() if free in prelude.definitions}
+        term = folded.replace_free({free : definition.term for free, definition in visible.items()})
+        prelude.definitions.pop(name, None)
+        prelude.definitions[name] = Definition(name, term, infer_closed_type(term), folded)
+        meant[name] = visible
+    # names stay folded unless an inner definition of the same name shadows the one meant
+    for name, definition in prelude.definitions.items():
+        shadowed = {free : used.term for free, used in meant[name].items() if prelude.definitions[free] is not used}
+        if shadowed: definition.folded = definition.folded.replace_free(shadowed)
+    return prelude
+
+# None if the type is unknown, also where inference gives up on a deeply nested term
+def infer_closed_type(term: DBExpr) -> Optional[DBExpr]:
+    if term.get_free_names(): return None
+    try:
+        return Program.from_de_bruijn(term).infer_type().to_de_bruijn({}, 0)
+    except (TypeInferenceError, RecursionError):
+        return None
+
+# A warm load only compares the stamps of the files recorded in the entry. Once one
+# differs the includes are lexed again, and the prelude is compiled again only if the
+# content of the files they pull in changed.
+def load_prelude(includes: Tuple[str, ...], cache_dir: str = CACHE_DIR) -> Prelude:
+    with TRACE.phase("prelude"):
+        path = prelude_path(includes, cache_dir)
+        entry = read_entry(path)
+        if entry is not None and any(stamp(file) != file_stamp for file, file_stamp in entry["files"]):
+            files = included_files(includes)
+            # stamped before the content is hashed, a file changed meanwhile is found next time
+            stamps = [(file, stamp(file)) for file in files]
+            if content_key(files) != entry["content"]: entry = None
+            else:
+                entry["files"] = stamps
+                write_entry(path, entry)
+        if entry is None:
+            files = included_files(includes)
+            stamps = [(file, stamp(file)) for file in files]
+            entry = {"files": stamps, "content": content_key(files), "prelude": compile_prelude(includes)}
+            write_entry(path, entry)
+        prelude = entry["prelude"]
+        prelude.seed_type_cache()
+        return prelude
+
+def split_includes(source: str) -> Tuple[Program, Tuple[str, ...]]:
+    tokens: List[Token] = []
+    includes: List[str] = []
+    for token in scan(source):
+        if token.type == TokenType.INCLUDE: includes.append(token.value)
+        else: tokens.append(token)
+    return Parser(tokens).produce_ast(), tuple(includes)
+
+# parse source whose {file} includes are served from compiled preludes
+def parse_program(source: str, cache_dir: str = CACHE_DIR) -> Program:
+    program, includes = split_includes(source)
+    if not includes: return program
+    return load_prelude(includes, cache_dir).link(program)
+
+# like parse_program, but definitions stay folded in the program and live in the Env
+def parse_with_env(source: str, cache_dir: str = CACHE_DIR) -> Tuple[Program, Env]:
+    program, includes = split_includes(source)
+    if not includes: return program, Env()
+    return program, load_prelude(includes, cache_dir).to_env()
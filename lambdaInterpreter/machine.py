@@ -0,0 +1,298 @@
+from dataclasses import dataclass, field
+from enum import Enum, auto
+from typing import List, Tuple, Optional, Type, Dict, Any
+from deBruijn import DBExpr, BoundVar, FreeVar, DBBinder, DBAbstraction, DBProduct, DBApplication, DBErased, DBStar, DBSquare, TermTable, terms_from_rows
+from environment import Env as Definitions
+from instrumentation import TRACE
+import pickle
+import time
+
+# Strong normal order reduction as an abstract machine (a Krivine machine that keeps
+# reducing under binders). All state lives in explicit stacks, so deep terms never hit
+# the recursion limit, and every step continues where the last one stopped instead of
+# searching for the next redex from the root. The same state lets a run stop after a
+# budget of transitions or seconds and be dumped, then loaded and resumed elsewhere.
+
+class MachineError(Exception):
+    pass
+
+class Strategy(Enum):
+    NAME = auto() # call by name, an argument is reduced again at every use
+    NEED = auto() # call by need, the weak head normal form of an argument is shared by all uses
+
+# a term together with the environment its loose indices refer to
+@dataclass
+class Thunk:
+    term: DBExpr
+    env: "Env"
+
+# left on the argument stack when a thunk is entered under call by need, the thunk is
+# overwritten with the abstraction it reduces to once that abstraction reaches the marker
+@dataclass
+class Update:
+    thunk: Thunk
+
+# entries are thunks for substituted arguments or the de Bruijn level of a binder
+# that is being normalized under, innermost first
+Env = Optional[Tuple[Thunk | int, "Env"]]
+
+# a neutral head applied to arguments that are normalized one after another
+@dataclass
+class SpineFrame:
+    term: DBExpr
+    args: List[Thunk]
+    depth: int
+
+# a binder whose parameter type and then body are normalized
+@dataclass
+class BinderFrame:
+    binder: Type[DBBinder]
+    body: Thunk
+    depth: int
+    param_type: DBExpr | None = None
+
+@dataclass
+class Machine:
+    focus: Thunk | None
+    defs: Definitions | None = None
+    strategy: Strategy = Strategy.NAME
+    args: List[Thunk | Update] = field(default_factory=list) # pending arguments, next one last
+    shared: Dict[str, Thunk] = field(default_factory=dict) # unfolded definitions under call by need
+    frames: List[SpineFrame | BinderFrame] = field(default_factory=list)
+    depth: int = 0
+    result: DBExpr | None = None
+    beta_steps: int = 0
+    delta_steps: int = 0
+    updates: int = 0
+    transitions: int = 0
+    peak_stack: int = 0 # most pending arguments and frames at once
+
+    @classmethod
+    def start(cls, term: DBExpr, defs: Definitions | None = None, strategy: Strategy = Strategy.NAME) -> "Machine":
+        return cls(focus=Thunk(term, None), defs=defs, strategy=strategy)
+
+    def stats(self) -> Dict[str, int]:
+        return {"beta_steps": self.beta_steps, "delta_steps": self.delta_steps, "updates": self.updates, "transitions": self.transitions, "peak_stack": self.peak_stack}
+
+    def finished(self) -> bool:
+        return self.result is not None
+
+    # runs to the normal form, or pauses after at most steps more transitions or once
+    # seconds have passed and returns None, calling run again continues from there
+    def run(self, steps: int | None = None, seconds: float | None = None) -> DBExpr | None:
+        counted = (self.beta_steps, self.delta_steps)
+        if steps is None and seconds is None and not TRACE.enabled:
+            while self.result is None: self.step()
+        else:
+            limit = None if steps is None else self.transitions + steps
+            deadline = None if seconds is None else time.perf_counter() + seconds
+            while self.result is None:
+                if limit is not None and self.transitions >= limit: break
+                # the clock is read, and steps are traced, every CLOCK_INTERVAL transitions only
+                if self.transitions % CLOCK_INTERVAL == 0:
+                    if deadline is not None and time.perf_counter() >= deadline: break
+                    if TRACE.enabled: counted = self.trace(counted)
+                self.step()
+        if TRACE.enabled: self.trace(counted)
+        return self.result
+
+    # steps are counted in bulk, step stays free of tracing, hooks see long runs progress
+    def trace(self, counted: Tuple[int, int]) -> Tuple[int, int]:
+        TRACE.event("beta_steps", self.beta_steps - counted[0])
+        TRACE.event("delta_steps", self.delta_steps - counted[1])
+        return (self.beta_steps, self.delta_steps)
+
+    # The state is written as flat tables of terms, environment cells and thunks that
+    # refer to each other by position, so long environments and deep terms are fine.
+    # Thunks shared between environments, arguments and updates stay shared. The
+    # definitions are not part of the state, load takes them again.
+    def dump(self) -> bytes:
+        return pickle.dumps(Checkpoint().encode(self), protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, data: bytes, defs: Definitions | None = None) -> "Machine":
+        return Checkpoint().decode(pickle.loads(data), defs)
+
+    def step(self):
+        self.transitions += 1
+        term, env = self.focus.term, self.focus.env
+        if isinstance(term, DBApplication):
+            self.args.append(self.delay(term.arg, env))
+            self.focus = Thunk(term.func, env)
+            if len(self.args) + len(self.frames) > self.peak_stack: self.peak_stack = len(self.args) + len(self.frames)
+        elif isinstance(term, DBBinder) and self.args and isinstance(self.args[-1], Update):
+            self.updates += 1
+            thunk = self.args.pop().thunk
+            thunk.term, thunk.env = term, env
+        # products are beta reduced like abstractions, as in Application.one_beta_normal_reduction
+        elif isinstance(term, DBBinder) and self.args:
+            self.beta_steps += 1
+            self.focus = Thunk(term.body, (self.args.pop(), env))
+        elif isinstance(term, DBBinder):
+            self.frames.append(BinderFrame(type(term), Thunk(term.body, env), self.depth))
+            self.focus = Thunk(term.param_type, env)
+            if len(self.args) + len(self.frames) > self.peak_stack: self.peak_stack = len(self.args) + len(self.frames)
+        elif isinstance(term, BoundVar):
+            entry = lookup(env, term.index)
+            if isinstance(entry, Thunk): self.enter(entry)
+            else: self.neutral(BoundVar(self.depth - 1 - entry))
+        elif isinstance(term, FreeVar) and self.args and self.defs is not None and term.name in self.defs:
+            self.delta_steps += 1
+            if self.strategy == Strategy.NAME: self.focus = Thunk(self.defs.lookup(term.name).folded, None)
+            else: self.enter(self.shared.setdefault(term.name, Thunk(self.defs.lookup(term.name).folded, None)))
+        else:
+            self.neutral(term)
+
+    def enter(self, thunk: Thunk):
+        if self.strategy == Strategy.NEED and not isinstance(thunk.term, DBBinder): self.args.append(Update(thunk))
+        self.focus = thunk
+
+    # a variable argument is passed on as its own entry, so chains of variables
+    # bound to variables never build up
+    def delay(self, term: DBExpr, env: Env) -> Thunk:
+        if not isinstance(term, BoundVar): return Thunk(term, env)
+        entry = lookup(env, term.index)
+        if isinstance(entry, Thunk): return entry
+        return Thunk(BoundVar(0), (entry, None))
+
+    # head cannot reduce further, normalize the pending arguments behind it. Thunks that
+    # were entered reduce to this neutral term and are left as they are.
+    def neutral(self, head: DBExpr):
+        args = [arg for arg in self.args if isinstance(arg, Thunk)]
+        self.args = []
+        if not args: return self.done(head)
+        self.frames.append(SpineFrame(head, args, self.depth))
+        self.focus = args.pop()
+
+    def done(self, term: DBExpr):
+        while self.frames:
+            frame = self.frames[-1]
+            if isinstance(frame, SpineFrame):
+                frame.term = DBApplication(func=frame.term, arg=term)
+                if frame.args:
+                    self.depth = frame.depth
+                    self.focus = frame.args.pop()
+                    return
+                term = frame.term
+            elif frame.param_type is None:
+                frame.param_type = term
+                self.depth = frame.depth + 1
+                self.focus = Thunk(frame.body.term, (frame.depth, frame.body.env))
+                return
+            else:
+                term = frame.binder(param_type=frame.param_type, body=term)
+            self.frames.pop()
+        self.result = term
+        self.focus = None
+
+CLOCK_INTERVAL = 1024
+
+CHECKPOINT_VERSION = 3
+
+# positions of objects in the tables of a dumped machine, see Machine.dump
+class Checkpoint():
+    def __init__(self):
+        self.table = TermTable()
+        self.thunks: Dict[int, int] = {} # by object id
+        self.thunk_rows: List[Tuple[int, int] | None] = []
+        self.envs: Dict[int, int] = {}
+        self.env_rows: List[Tuple[Tuple[bool, int], int] | None] = []
+        self.pending: List[Thunk | Tuple] = []
+
+    def term(self, term: DBExpr) -> int:
+        return self.table.add(term)
+
+    def thunk(self, thunk: Thunk) -> int:
+        if id(thunk) not in self.thunks:
+            self.thunks[id(thunk)] = len(self.thunk_rows)
+            self.thunk_rows.append(None)
+            self.pending.append(thunk)
+        return self.thunks[id(thunk)]
+
+    def env(self, env: Env) -> int:
+        if env is None: return -1
+        if id(env) not in self.envs:
+            self.envs[id(env)] = len(self.env_rows)
+            self.env_rows.append(None)
+            self.pending.append(env)
+        return self.envs[id(env)]
+
+    def encode(self, machine: Machine) -> Dict[str, Any]:
+        state = {
+            "version": CHECKPOINT_VERSION,
+            "strategy": machine.strategy.name,
+            "focus": None if machine.focus is None else self.thunk(machine.focus),
+            "args": [(isinstance(arg, Update), self.thunk(arg.thunk if isinstance(arg, Update) else arg)) for arg in machine.args],
+            "shared": {name : self.thunk(thunk) for name, thunk in machine.shared.items()},
+            "frames": [("spine", self.term(frame.term), [self.thunk(arg) for arg in frame.args], frame.depth) if isinstance(frame, SpineFrame)
+                       else ("binder", frame.binder.__name__, self.thunk(frame.body), frame.depth, None if frame.param_type is None else self.term(frame.param_type))
+                       for frame in machine.frames],
+            "result": None if machine.result is None else self.term(machine.result),
+            "counters": (machine.depth, machine.beta_steps, machine.delta_steps, machine.updates, machine.transitions, machine.peak_stack),
+        }
+        while self.pending:
+            item = self.pending.pop()
+            if isinstance(item, Thunk):
+                self.thunk_rows[self.thunks[id(item)]] = (self.term(item.term), self.env(item.env))
+            else:
+                entry, rest = item
+                encoded = (True, self.thunk(entry)) if isinstance(entry, Thunk) else (False, entry)
+                self.env_rows[self.envs[id(item)]] = (encoded, self.env(rest))
+        state.update(terms=self.table.rows, thunks=self.thunk_rows, envs=self.env_rows)
+        return state
+
+    def decode(self, state: Dict[str, Any], defs: Definitions | None) -> Machine:
+        if state.get("version") != CHECKPOINT_VERSION:
+            raise MachineError(f"Checkpoint version {state.get('version')} is not {CHECKPOINT_VERSION}")
+        terms = terms_from_rows(state["terms"])
+        thunks = [Thunk(None, None) for _ in state["thunks"]]
+        # a cell is built once the rest of its chain is
+        envs: List[Env] = [None] * len(state["envs"])
+        built = [False] * len(state["envs"])
+        for position in range(len(envs)):
+            chain = []
+            while position != -1 and not built[position]:
+                chain.append(position)
+                position = state["envs"][position][1]
+            for position in reversed(chain):
+                (is_thunk, entry), rest = state["envs"][position]
+                envs[position] = (thunks[entry] if is_thunk else entry, None if rest == -1 else envs[rest])
+                built[position] = True
+        for thunk, (term, env) in zip(thunks, state["thunks"]):
+            thunk.term, thunk.env = terms[term], None if env == -1 else envs[env]
+        machine = Machine(focus=None if state["focus"] is None else thunks[state["focus"]], defs=defs, strategy=Strategy[state["strategy"]])
+        machine.args = [Update(thunks[arg]) if is_update else thunks[arg] for is_update, arg in state["args"]]
+        machine.shared = {name : thunks[thunk] for name, thunk in state["shared"].items()}
+        binders = {DBAbstraction.__name__ : DBAbstraction, DBProduct.__name__ : DBProduct}
+        for frame in state["frames"]:
+            if frame[0] == "spine": machine.frames.append(SpineFrame(terms[frame[1]], [thunks[arg] for arg in frame[2]], frame[3]))
+            else: machine.frames.append(BinderFrame(binders[frame[1]], thunks[frame[2]], frame[3], None if frame[4] is None else terms[frame[4]]))
+        machine.result = None if state["result"] is None else terms[state["result"]]
+        machine.depth, machine.beta_steps, machine.delta_steps, machine.updates, machine.transitions, machine.peak_stack = state["counters"]
+        return machine
+
+def lookup(env: Env, index: int) -> Thunk | int:
+    for _ in range(index):
+        if env is None: break
+        env = env[1]
+    if env is None:
+        raise MachineError(f"Unbound index #{index}")
+    return env[0]
+
+def reduce(term: DBExpr, defs: Definitions | None = None, strategy: Strategy = Strategy.NAME) -> DBExpr:
+    return Machine.start(term, defs, strategy).run()
+
+# the normal form if it is reached within the budget, the paused machine otherwise
+def reduce_within(term: DBExpr, defs: Definitions | None = None, strategy: Strategy = Strategy.NAME, steps: int | None = None, seconds: float | None = None) -> DBExpr | Machine:
+    machine = Machine.start(term, defs, strategy)
+    result = machine.run(steps, seconds)
+    return machine if result is None else result
+
+# step counts of every strategy on the same term
+def compare_strategies(term: DBExpr, defs: Definitions | None = None) -> Dict[str, Dict[str, int]]:
+    report = {}
+    for strategy in Strategy:
+        machine = Machine.start(term, defs, strategy)
+        machine.run()
+        report[strategy.name] = machine.stats()
+    return report
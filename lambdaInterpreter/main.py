@@ -0,0 +1,208 @@
+from typing import Dict, Iterator, List, Tuple, Optional
+from concurrent.futures import ProcessPoolExecutor, Future, as_completed
+from dataclasses import dataclass, asdict
+from abstractSyntaxTree import Program, Engine, TERM_CACHES
+from machine import Machine
+from library import Prelude, load_prelude, split_includes
+from printer import to_text
+from instrumentation import TRACE
+import normalForms
+from lexer import TokenType, scan
+import argparse
+import glob
+import json
+import os
+import pickle
+import re
+import sys
+import time
+
+# Batch evaluation: every program is type checked and normalized in a worker process.
+# Preludes are compiled once in the parent and handed to the workers, results are
+# written as JSON lines in the order the jobs finish.
+#
+#   python lambdaInterpreter/main.py a.lm b.lm --jobs 8 --timeout 10
+#   python lambdaInterpreter/main.py --jsonl programs.jsonl   # {"id": ..., "source": ...} per line
+#
+# The other engines stop once --timeout runs out at the next step they trace, never in the
+# middle of updating a cache, so the worker is reused as it is. The MACHINE and LAZY
+# engines pause once --steps or --timeout run out instead. With --checkpoints the paused state is saved, and the .ckpt files can be
+# passed as programs again to resume them on any worker:
+#
+#   python lambdaInterpreter/main.py big.lm --engine LAZY --steps 1000000 --checkpoints ckpt
+#   python lambdaInterpreter/main.py ckpt/*.ckpt --steps 1000000 --checkpoints ckpt
+#
+# With --cache the normal forms and types found by earlier batches are reused, see
+# normalForms.py:
+#
+#   python lambdaInterpreter/main.py a.lm b.lm --cache terms.lmc
+
+@dataclass
+class Job:
+    id: str
+    source: str
+    includes: Tuple[str, ...]
+    state: Optional[bytes] = None # a paused machine to resume instead of the source
+
+@dataclass
+class Result:
+    id: str
+    normal_form: Optional[str] = None
+    type: Optional[str] = None
+    seconds: Optional[float] = None
+    error: Optional[str] = None
+    checkpoint: Optional[str] = None
+
+MACHINE_ENGINES = (Engine.MACHINE, Engine.LAZY)
+
+# a base exception, so nothing between the engine and run_job takes it for a failure
+class JobTimeout(BaseException):
+    pass
+
+# events every engine traces at least once per stretch of work
+STEP_EVENTS = ("beta_steps", "delta_steps", "substitutions", "type_inferences")
+
+# set in every worker by the pool initializer
+preludes: Dict[Tuple[str, ...], Prelude] = {}
+cache_file: Optional[str] = None
+saved_stores = 0
+deadline: Optional[float] = None # of the running job, checked at its traced steps
+
+def start_worker(shared: Dict[Tuple[str, ...], Prelude], cache: Optional[str] = None):
+    global cache_file
+    preludes.update(shared)
+    for prelude in preludes.values(): prelude.seed_type_cache()
+    for name in STEP_EVENTS: TRACE.subscribe(name, check_deadline)
+    if cache is not None:
+        cache_file = cache
+        normalForms.load(cache, TERM_CACHES)
+
+# every worker writes its caches to a file of its own whenever they grew, the batch merges them
+def save_worker_caches():
+    global saved_stores
+    stores = sum(cache.stores for cache in TERM_CACHES.values())
+    if cache_file is None or stores == saved_stores: return
+    normalForms.save(f"{cache_file}.worker{os.getpid()}", TERM_CACHES)
+    saved_stores = stores
+
+def check_deadline(name: str, amount: int, data: Dict):
+    if deadline is not None and time.perf_counter() >= deadline: raise JobTimeout()
+
+def save_checkpoint(job: Job, machine: Machine, directory: str) -> str:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, re.sub(r"[^\w.-]", "_", job.id) + ".ckpt")
+    with open(path, "wb") as file:
+        pickle.dump({"id": job.id, "includes": job.includes, "state": machine.dump()}, file)
+    return path
+
+def run_job(job: Job, engine: Engine, timeout: Optional[float], type_check: bool, native: bool, steps: Optional[int] = None, checkpoints: Optional[str] = None, share: bool = False) -> Result:
+    global deadline
+    start = time.perf_counter()
+    # the engines trace their steps only while the tracer is on
+    traced = TRACE.enabled
+    if timeout is not None:
+        deadline = start + timeout
+        TRACE.enable()
+    result = Result(job.id)
+    try:
+        prelude = preludes.get(job.includes)
+        defs = prelude.to_env() if prelude is not None else None
+        if job.state is None:
+            program, _ = split_includes(job.source)
+            if type_check:
+                linked = prelude.link(program) if prelude is not None else program
+                result.type = linked.infer_type().to_str()
+        # the machine pauses by itself within the rest of the timeout
+        budgeted = job.state is not None or engine in MACHINE_ENGINES
+        seconds = None if timeout is None or not budgeted else max(timeout - (time.perf_counter() - start), 0.0)
+        if budgeted: deadline = None
+        if job.state is not None:
+            paused = Machine.load(job.state, defs)
+            if paused.run(steps, seconds) is not None:
+                program, paused = Program.from_de_bruijn(paused.result), None
+        else:
+            paused = program.to_beta_normal_form(engine=engine, defs=defs, native=native, steps=steps if budgeted else None, seconds=seconds)
+        if paused is None:
+            result.normal_form = to_text(program, share=share)
+        else:
+            result.error = f"paused after {paused.transitions} steps"
+            if checkpoints is not None: result.checkpoint = save_checkpoint(job, paused, checkpoints)
+    except JobTimeout:
+        result.error = f"timed out after {timeout}s"
+    except Exception as error:
+        result.error = f"{type(error).__name__}: {error}"
+    finally:
+        deadline = None
+        TRACE.enable(traced)
+    result.seconds = time.perf_counter() - start
+    save_worker_caches()
+    return result
+
+def includes_of(source: str) -> Tuple[str, ...]:
+    return tuple(token.value for token in scan(source) if token.type == TokenType.INCLUDE)
+
+def read_jobs(files: List[str], jsonl: Optional[str]) -> Iterator[Job]:
+    for path in files:
+        if path.endswith(".ckpt"):
+            with open(path, "rb") as file:
+                saved = pickle.load(file)
+            yield Job(saved["id"], "", tuple(saved["includes"]), saved["state"])
+            continue
+        with open(path, "r") as file:
+            source = file.read()
+        yield Job(path, source, includes_of(source))
+    if jsonl is not None:
+        stream = sys.stdin if jsonl == "-" else open(jsonl, "r")
+        for number, line in enumerate(stream, 1):
+            if not line.strip(): continue
+            entry = json.loads(line)
+            yield Job(str(entry.get("id", number)), entry["source"], includes_of(entry["source"]))
+        if stream is not sys.stdin: stream.close()
+
+def run_batch(jobs: List[Job], engine: Engine, workers: int, timeout: Optional[float], type_check: bool, native: bool, steps: Optional[int] = None, checkpoints: Optional[str] = None, share: bool = False, cache: Optional[str] = None, out=sys.stdout) -> int:
+    shared = {includes : load_prelude(includes) for includes in {job.includes for job in jobs} if includes}
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=start_worker, initargs=(shared, cache)) as pool:
+        futures: Dict[Future, Job] = {pool.submit(run_job, job, engine, timeout, type_check, native, steps, checkpoints, share) : job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as error:
+                # the worker itself died, e.g. on a recursion overflow in C code
+                result = Result(futures[future].id, error=f"{type(error).__name__}: {error}")
+            failed += result.error is not None
+            out.write(json.dumps(asdict(result)) + "\n")
+            out.flush()
+    if cache is not None: merge_caches(cache)
+    return failed
+
+# files left by workers of an earlier batch that died are merged as well
+def merge_caches(cache: str):
+    normalForms.load(cache, TERM_CACHES)
+    for path in glob.glob(glob.escape(cache) + ".worker*"):
+        if not path[len(cache) + len(".worker"):].isdigit(): continue # half written
+        normalForms.load(path, TERM_CACHES)
+        os.remove(path)
+    normalForms.save(cache, TERM_CACHES)
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Type check and normalize lambda programs in parallel")
+    arguments.add_argument("files", nargs="*", help=".lm programs or .ckpt checkpoints to resume, one job each")
+    arguments.add_argument("--jsonl", help="JSON lines with id and source per program, - for stdin")
+    arguments.add_argument("--engine", default=Engine.NBE.name, choices=[engine.name for engine in Engine])
+    arguments.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    arguments.add_argument("--timeout", type=float, help="seconds per program")
+    arguments.add_argument("--no-type-check", action="store_true")
+    arguments.add_argument("--native", action="store_true", help="compute Church arithmetic natively first")
+    arguments.add_argument("--steps", type=int, help="machine transitions per program before it is paused")
+    arguments.add_argument("--share", action="store_true", help="write repeated closed subterms of normal forms once, as [s := ...]")
+    arguments.add_argument("--checkpoints", help="directory for the state of paused programs")
+    arguments.add_argument("--cache", help="file the type and normal form caches are loaded from and saved to")
+    options = arguments.parse_args()
+    if not options.files and options.jsonl is None:
+        arguments.error("no programs given")
+    if options.steps is not None and Engine[options.engine] not in MACHINE_ENGINES and not all(path.endswith(".ckpt") for path in options.files):
+        arguments.error("--steps needs the MACHINE or LAZY engine")
+    jobs = list(read_jobs(options.files, options.jsonl))
+    failed = run_batch(jobs, Engine[options.engine], options.jobs, options.timeout, not options.no_type_check, options.native, options.steps, options.checkpoints, options.share, options.cache)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,145 @@
+from typing import Callable, Dict, List, Tuple, Optional
+from deBruijn import DBExpr, BoundVar, FreeVar, DBAbstraction, DBProduct, DBApplication, DBStar
+from environment import Env
+from instrumentation import TRACE
+import os
+
+# Native arithmetic for the Church encodings of inputs/nats.lm and inputs/bools.lm.
+# Applications of a known definition to closed Nat or Bool normal forms are computed
+# with Python ints and bools and read back as the canonical Church term, which is the
+# normal form the reducers produce for them. A definition is only known if its linked
+# term is alpha-equal to the bundled one, so redefinitions are never accelerated.
+# Everything else, e.g. operations applied to bound variables, is left to the engine.
+
+NAT, BOOL = "Nat", "Bool"
+MAX_NUMERAL = 100_000 # larger results are left to the engine rather than built here
+
+# name: argument types, result type, native function (None if it has no canonical result)
+OPERATIONS: Dict[str, Tuple[Tuple[str, ...], str, Callable[..., int | bool | None]]] = {
+    "succ": ((NAT,), NAT, lambda n: n + 1),
+    "pred": ((NAT,), NAT, lambda n: max(n - 1, 0)),
+    "plus": ((NAT, NAT), NAT, lambda m, n: m + n),
+    "minus": ((NAT, NAT), NAT, lambda m, n: max(m - n, 0)),
+    "mult": ((NAT, NAT), NAT, lambda m, n: m * n),
+    # exp m zero reduces to the identity on A -> A, which is no Church numeral
+    "exp": ((NAT, NAT), NAT, lambda m, n: m ** n if n > 0 and (m < 2 or n <= MAX_NUMERAL.bit_length()) else None),
+    "is_zero": ((NAT,), BOOL, lambda n: n == 0),
+    "leq": ((NAT, NAT), BOOL, lambda m, n: m <= n),
+    "eq": ((NAT, NAT), BOOL, lambda m, n: m == n),
+    "not": ((BOOL,), BOOL, lambda x: not x),
+    "and": ((BOOL, BOOL), BOOL, lambda x, y: x and y),
+    "or": ((BOOL, BOOL), BOOL, lambda x, y: x or y),
+}
+
+LIBRARY = os.path.join(os.path.dirname(__file__), "inputs", "nats.lm")
+
+# linked bundled definitions to their operation name, compiled on first use
+known: Dict[DBExpr, str] = {}
+
+def known_operations() -> Dict[DBExpr, str]:
+    if not known:
+        # library imports the AST, which offers this module as a fast path
+        from library import load_prelude
+        definitions = load_prelude((LIBRARY,)).definitions
+        known.update({definitions[name].term : name for name in OPERATIONS})
+    return known
+
+# \A:*. \f:(& _:A. A). \x:A. f (... (f x))
+def church_nat(n: int) -> DBExpr:
+    body: DBExpr = BoundVar(0)
+    for _ in range(n): body = DBApplication(func=BoundVar(1), arg=body)
+    f_type = DBProduct(param_type=BoundVar(0), body=BoundVar(1))
+    return DBAbstraction(param_type=DBStar(), body=DBAbstraction(param_type=f_type, body=DBAbstraction(param_type=BoundVar(1), body=body)))
+
+# \A:*. \x:A. \y:A. x for true, y for false
+def church_bool(value: bool) -> DBExpr:
+    body = BoundVar(1) if value else BoundVar(0)
+    return DBAbstraction(param_type=DBStar(), body=DBAbstraction(param_type=BoundVar(0), body=DBAbstraction(param_type=BoundVar(1), body=body)))
+
+def read_nat(term: DBExpr) -> Optional[int]:
+    if not (isinstance(term, DBAbstraction) and term.param_type == DBStar()): return None
+    f = term.body
+    if not (isinstance(f, DBAbstraction) and f.param_type == DBProduct(param_type=BoundVar(0), body=BoundVar(1))): return None
+    x = f.body
+    if not (isinstance(x, DBAbstraction) and x.param_type == BoundVar(1)): return None
+    body, n = x.body, 0
+    while isinstance(body, DBApplication) and body.func == BoundVar(1):
+        body, n = body.arg, n + 1
+    return n if body == BoundVar(0) else None
+
+def read_bool(term: DBExpr) -> Optional[bool]:
+    if not (isinstance(term, DBAbstraction) and term.param_type == DBStar()): return None
+    x = term.body
+    if not (isinstance(x, DBAbstraction) and x.param_type == BoundVar(0)): return None
+    y = x.body
+    if not (isinstance(y, DBAbstraction) and y.param_type == BoundVar(1)): return None
+    if y.body == BoundVar(1): return True
+    if y.body == BoundVar(0): return False
+    return None
+
+# folded names stand for their linked definition
+def resolve(term: DBExpr, defs: Env | None) -> DBExpr:
+    if isinstance(term, FreeVar) and defs is not None and term.name in defs: return defs.lookup(term.name).term
+    return term
+
+def native_application(term: DBExpr, defs: Env | None) -> DBExpr:
+    args: List[DBExpr] = []
+    head = term
+    while isinstance(head, DBApplication):
+        args.append(head.arg)
+        head = head.func
+    name = known_operations().get(resolve(head, defs))
+    if name is None: return term
+    args.reverse()
+    arg_types, result_type, function = OPERATIONS[name]
+    if len(args) < len(arg_types): return term
+    values = []
+    for arg, arg_type in zip(args, arg_types):
+        value = (read_nat if arg_type == NAT else read_bool)(resolve(arg, defs))
+        if value is None: return term
+        values.append(value)
+    result = function(*values)
+    if result is None or (result_type == NAT and result > MAX_NUMERAL): return term
+    if TRACE.enabled: TRACE.event("native_steps", operation=name)
+    reduced = church_nat(result) if result_type == NAT else church_bool(result)
+    for arg in args[len(arg_types):]:
+        reduced = DBApplication(func=reduced, arg=arg)
+    return reduced
+
+# rewrites bottom up, so nested operations on literals collapse into one literal
+def accelerate(term: DBExpr, defs: Env | None = None) -> DBExpr:
+    memo: Dict[DBExpr, DBExpr] = {}
+    todo: List[DBExpr] = [term]
+    while todo:
+        node = todo[-1]
+        if node in memo:
+            todo.pop()
+            continue
+        pending = [child for child, _ in node.children() if child not in memo]
+        if pending:
+            todo += pending
+            continue
+        todo.pop()
+        rebuilt = node.with_children(tuple(memo[child] for child, _ in node.children()))
+        memo[node] = native_application(rebuilt, defs) if isinstance(rebuilt, DBApplication) else rebuilt
+    return memo[term]
+
+# checks every operation on small literals against the reference machine
+if __name__ == "__main__":
+    from library import parse_with_env
+    from machine import reduce
+    mismatches = 0
+    for name, (arg_types, _, _) in OPERATIONS.items():
+        samples = [[]]
+        for arg_type in arg_types:
+            values = ["zero", "one", "two", "three", "five"] if arg_type == NAT else ["true", "false"]
+            samples = [sample + [value] for sample in samples for value in values]
+        for sample in samples:
+            program, defs = parse_with_env(f"({name} {' '.join(sample)}) {{nats}}")
+            term = program.to_de_bruijn()
+            # the machine leaves names it does not apply folded, e.g. a resulting true
+            fast, reference = [reduce(reduced, defs).replace_free(defs.linked()) for reduced in (accelerate(term, defs), term)]
+            if fast != reference:
+                mismatches += 1
+                print(f"{name} {' '.join(sample)}: {fast.to_str()} but {reference.to_str()}")
+    print(f"{mismatches} mismatches")
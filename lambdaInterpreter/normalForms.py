@@ -0,0 +1,85 @@
+from typing import Any, Callable, Dict, Tuple
+from deBruijn import DBExpr, TermTable, terms_from_rows
+from environment import Env as Definitions
+from cache import LRUCache
+from instrumentation import TRACE
+import os
+import pickle
+
+# Normal forms computed so far, shared by every program the process normalizes. A term is
+# keyed by itself (hash consing makes it alpha invariant), the engine that normalized it
+# and the definitions its names may unfold to, so library terms and queries against the
+# same prelude are reduced once and looked up after that, also once unrelated names are
+# defined.
+#
+# Caches can be saved to and loaded from a file, terms are stored as flat rows shared by
+# every entry, see deBruijn.TermTable.
+
+NORMAL_FORMS = LRUCache(maxsize=4096)
+# types inferred so far, keyed by the de Bruijn term and the typing of its free variables,
+# see abstractSyntaxTree.infer_de_bruijn
+TYPE_CACHE = LRUCache(maxsize=4096)
+
+FORMAT_VERSION = 3
+
+def normal_form_key(term: DBExpr, engine: str, defs: Definitions | None) -> Tuple:
+    return (term, engine, None if defs is None else defs.key(term))
+
+def normalize_cached(term: DBExpr, engine: str, defs: Definitions | None, normalize: Callable[[DBExpr, Definitions | None], DBExpr]) -> DBExpr:
+    key = normal_form_key(term, engine, defs)
+    normal = NORMAL_FORMS.lookup(key)
+    if normal is not None:
+        if TRACE.enabled: TRACE.event("normal_form_cache_hits")
+        return normal
+    normal = normalize(term, defs)
+    NORMAL_FORMS.store(key, normal)
+    return normal
+
+# Unfolded definitions are cached the same way, keyed by their folded term, see
+# normalization.unfold_into: a definition is normalized once per process and later
+# unfoldings against the same definitions evaluate its normal form. The closed normal form
+# gets the type of the definition, so inference finds it once it shows up in a program.
+def store_unfolded(key: Tuple, normal: DBExpr, defs: Definitions, name: str):
+    NORMAL_FORMS.store(key, normal)
+    definition = defs.lookup(name)
+    if definition.type is not None: TYPE_CACHE.store((normal.replace_free(defs.linked()), ()), definition.type)
+
+# keys and values are terms, names and tuples or frozensets of them
+def encode(value: Any, table: TermTable) -> Tuple:
+    if isinstance(value, DBExpr): return ("term", table.add(value))
+    if isinstance(value, tuple): return ("tuple", tuple(encode(item, table) for item in value))
+    if isinstance(value, frozenset): return ("frozenset", tuple(encode(item, table) for item in value))
+    return ("value", value)
+
+def decode(encoded: Tuple, terms: list) -> Any:
+    kind, value = encoded
+    if kind == "term": return terms[value]
+    if kind == "tuple": return tuple(decode(item, terms) for item in value)
+    if kind == "frozenset": return frozenset(decode(item, terms) for item in value)
+    return value
+
+def save(path: str, caches: Dict[str, LRUCache]):
+    table = TermTable()
+    # least recently used first, so loading them back keeps the order
+    entries = {name : [(encode(key, table), encode(value, table)) for key, value in cache.entries.items()] for name, cache in caches.items()}
+    directory = os.path.dirname(path)
+    if directory: os.makedirs(directory, exist_ok=True)
+    # write to a temporary name first so concurrent loaders never see half a file
+    with open(f"{path}.{os.getpid()}", "wb") as file:
+        pickle.dump({"version": FORMAT_VERSION, "terms": table.rows, "entries": entries}, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{path}.{os.getpid()}", path)
+
+# entries already cached are kept, a missing or outdated file loads nothing
+def load(path: str, caches: Dict[str, LRUCache]) -> int:
+    if not os.path.isfile(path): return 0
+    with open(path, "rb") as file:
+        state = pickle.load(file)
+    if state.get("version") != FORMAT_VERSION: return 0
+    terms = terms_from_rows(state["terms"])
+    loaded = 0
+    for name, cache in caches.items():
+        entries = [(decode(key, terms), decode(value, terms)) for key, value in state["entries"].get(name, [])]
+        before = len(cache)
+        cache.merge(reversed(entries))
+        loaded += len(cache) - before
+    return loaded
@@ -0,0 +1,216 @@
+from abc import ABC
+from dataclasses import dataclass
+from typing import List, Tuple, Optional
+from deBruijn import DBExpr, BoundVar, FreeVar, DBBinder, DBAbstraction, DBProduct, DBApplication, DBStar, DBSquare, DBErased
+from environment import Env as Definitions
+from normalForms import NORMAL_FORMS, store_unfolded
+from instrumentation import TRACE
+
+# Normalization by evaluation: terms are evaluated into values with closures over
+# an environment, then read back into beta normal de Bruijn terms. Free names found in
+# defs are delta unfolded only once they are applied, otherwise they are read back folded.
+
+class NormalizationError(Exception):
+    pass
+
+@dataclass
+class Value(ABC):
+    pass
+
+# environment as a linked list, innermost binding first, so closures share their tail
+Env = Optional[Tuple[Value, "Env"]]
+
+@dataclass
+class Closure:
+    env: Env
+    body: DBExpr
+    defs: Definitions | None = None
+
+# stuck term: a bound variable (de Bruijn level) or a free name applied to arguments
+@dataclass
+class VNeutral(Value):
+    head: int | str
+    spine: Tuple[Value, ...] = ()
+    defs: Definitions | None = None # set if head names a definition in defs
+
+@dataclass
+class VBinder(Value, ABC):
+    param_type: Value
+    closure: Closure
+
+@dataclass
+class VAbstraction(VBinder):
+    pass
+
+@dataclass
+class VProduct(VBinder):
+    pass
+
+@dataclass
+class VStar(Value):
+    pass
+
+@dataclass
+class VSquare(Value):
+    pass
+
+@dataclass
+class VErased(Value):
+    pass
+
+def lookup(env: Env, index: int) -> Value:
+    for _ in range(index):
+        if env is None: break
+        env = env[1]
+    if env is None:
+        raise NormalizationError(f"Unbound index #{index}")
+    return env[0]
+
+# Evaluation, application and read back run as one loop over an explicit stack of tasks:
+# values are passed on a value stack and read back terms on a term stack, so deeply
+# nested terms and long reductions never hit the recursion limit.
+EVAL, ARG, APPLY, PUSH, DEFINE, BINDER, READ, READ_TOP, SPINE, BUILD, CACHE = range(11)
+#   (EVAL, term, env, defs)     push the value of term
+#   (ARG, term, env, defs)      push the value of term, then apply the value below it to it
+#   (APPLY,)                    apply the value below the top of the values to the top
+#   (PUSH, value)               push value
+#   (DEFINE, defs, name, key)   remember the value on top as the unfolded definition, and
+#                               cache its normal form under key unless key is None
+#   (BINDER, cls, closure)      the parameter type is on top, replace it by the binder
+#   (READ, value, depth)        push the term value reads back to
+#   (READ_TOP, depth)           read back the value on top
+#   (SPINE, head, count)        apply head to the count terms on top
+#   (BUILD, binder)             build binder from the parameter type and body on top
+#   (CACHE, defs, name, key)    cache the read back term on top as the definition's normal form
+def run(todo: List[Tuple], values: List[Value] | None = None) -> Tuple[List[Value], List[DBExpr]]:
+    values = [] if values is None else values
+    terms: List[DBExpr] = []
+    while todo:
+        task = todo.pop()
+        op = task[0]
+        if op <= ARG:
+            _, term, env, defs = task
+            if op == ARG: todo.append((APPLY,))
+            # the function of an application is evaluated right away, its argument later
+            while type(term) is DBApplication:
+                todo.append((ARG, term.arg, env, defs))
+                term = term.func
+            if type(term) is BoundVar:
+                values.append(lookup(env, term.index))
+            elif type(term) is FreeVar:
+                values.append(VNeutral(head=term.name, defs=defs) if defs is not None and term.name in defs else VNeutral(head=term.name))
+            elif isinstance(term, DBBinder):
+                todo.append((BINDER, VAbstraction if type(term) is DBAbstraction else VProduct, Closure(env, term.body, defs)))
+                todo.append((EVAL, term.param_type, env, defs))
+            elif type(term) is DBStar:
+                values.append(VStar())
+            elif type(term) is DBSquare:
+                values.append(VSquare())
+            elif type(term) is DBErased:
+                values.append(VErased())
+            else:
+                raise NormalizationError(f"No expected instance found, instead {term}")
+        elif op == APPLY:
+            arg = values.pop()
+            func = values.pop()
+            # products are beta reduced like abstractions, as in Application.one_beta_normal_reduction
+            if isinstance(func, VBinder):
+                if TRACE.enabled: TRACE.event("beta_steps")
+                closure = func.closure
+                todo.append((EVAL, closure.body, (arg, closure.env), closure.defs))
+            elif type(func) is VNeutral and func.defs is not None:
+                todo.append((APPLY,))
+                todo.append((PUSH, arg))
+                unfold_into(func, values, todo)
+            elif type(func) is VNeutral:
+                values.append(VNeutral(head=func.head, spine=func.spine + (arg,)))
+            else:
+                raise NormalizationError(f"Cannot apply {func}")
+        elif op == PUSH:
+            values.append(task[1])
+        elif op == DEFINE:
+            _, defs, name, key = task
+            defs.values[name] = values[-1]
+            if key is not None:
+                todo.append((CACHE, defs, name, key))
+                todo.append((READ, values[-1], 0))
+        elif op == BINDER:
+            values.append(task[1](param_type=values.pop(), closure=task[2]))
+        elif op == READ:
+            _, value, depth = task
+            if type(value) is VNeutral:
+                head = BoundVar(depth - 1 - value.head) if isinstance(value.head, int) else FreeVar(value.head)
+                if not value.spine:
+                    terms.append(head)
+                    continue
+                todo.append((SPINE, head, len(value.spine)))
+                todo.extend((READ, arg, depth) for arg in reversed(value.spine))
+            elif isinstance(value, VBinder):
+                closure = value.closure
+                todo.append((BUILD, DBAbstraction if type(value) is VAbstraction else DBProduct))
+                todo.append((READ_TOP, depth + 1))
+                todo.append((EVAL, closure.body, (VNeutral(head=depth), closure.env), closure.defs))
+                todo.append((READ, value.param_type, depth))
+            elif type(value) is VStar:
+                terms.append(DBStar())
+            elif type(value) is VSquare:
+                terms.append(DBSquare())
+            elif type(value) is VErased:
+                terms.append(DBErased())
+            else:
+                raise NormalizationError(f"No expected value found, instead {value}")
+        elif op == READ_TOP:
+            todo.append((READ, values.pop(), task[1]))
+        elif op == SPINE:
+            _, term, count = task
+            args = terms[-count:]
+            del terms[-count:]
+            for arg in args: term = DBApplication(func=term, arg=arg)
+            terms.append(term)
+        elif op == BUILD:
+            body = terms.pop()
+            terms.append(task[1](param_type=terms.pop(), body=body))
+        elif op == CACHE:
+            store_unfolded(task[3], terms.pop(), task[1], task[2])
+    return values, terms
+
+# names in defs are unfolded once they are applied, and evaluated once per defs from
+# their normal form if one is cached, see normalForms.store_unfolded
+def unfold_into(neutral: VNeutral, values: List[Value], todo: List[Tuple]):
+    defs = neutral.defs
+    if neutral.head in defs.values:
+        values.append(defs.values[neutral.head])
+        return
+    if TRACE.enabled: TRACE.event("delta_steps")
+    folded = defs.lookup(neutral.head).folded
+    # what folded depends on, see Env.key, is kept per name
+    key = (folded, "NBE", defs.depends_on(neutral.head))
+    normal = NORMAL_FORMS.lookup(key)
+    if normal is not None:
+        if TRACE.enabled: TRACE.event("normal_form_cache_hits")
+        todo.append((DEFINE, defs, neutral.head, None))
+        todo.append((EVAL, normal, None, defs))
+        return
+    todo.append((DEFINE, defs, neutral.head, key))
+    todo.append((EVAL, folded, None, defs))
+
+def evaluate(term: DBExpr, env: Env = None, defs: Definitions | None = None) -> Value:
+    return run([(EVAL, term, env, defs)])[0].pop()
+
+def apply_closure(closure: Closure, arg: Value) -> Value:
+    return evaluate(closure.body, (arg, closure.env), closure.defs)
+
+def unfold(neutral: VNeutral) -> Value:
+    values: List[Value] = []
+    todo: List[Tuple] = []
+    unfold_into(neutral, values, todo)
+    return run(todo, values)[0].pop()
+
+def apply(func: Value, arg: Value) -> Value:
+    return run([(APPLY,)], [func, arg])[0].pop()
+
+def read_back(value: Value, depth: int = 0) -> DBExpr:
+    return run([(READ, value, depth)])[1].pop()
+
+def normalize(term: DBExpr, defs: Definitions | None = None) -> DBExpr:
+    return run([(READ_TOP, 0), (EVAL, term, None, defs)])[1].pop()
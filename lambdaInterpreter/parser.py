@@ -1,32 +1,55 @@
 from abstractSyntaxTree import *
-from lexer import tokenize, Token, TokenType, TokenError
+from instrumentation import TRACE
+from lexer import tokenize, Token, TokenType, TokenError, Span
 from typing import List, Tuple
 from abc import ABC
+from dataclasses import dataclass
 from helperFunctions import *
 import os
 
-class Par(ABC): pass
-class OpenPar(Par): pass
-class ClosePar(Par): pass
-class Arrow(Par): pass
+def with_span(expr: Expr, start: Span | None, end: Span | None) -> Expr:
+    if start is not None and end is not None: expr.span = start.to(end)
+    return expr
+
+# one frame per open parenthesis: the application of all but the last item and the last
+# item itself, kept apart so a trailing substitution can bind to the last item only
+@dataclass
+class Frame:
+    func: Expr | None = None
+    last: Expr | None = None
+    def push(self, expr: Expr):
+        if self.last is not None:
+            self.func = self.last if self.func is None else with_span(Application(func=self.func, arg=self.last), self.func.span, self.last.span)
+        self.last = expr
+    def close(self) -> Expr:
+        if self.last is None:
+            raise TokenError("Expression expected")
+        if self.func is None: return self.last
+        return with_span(Application(func=self.func, arg=self.last), self.func.span, self.last.span)
 
 class Parser:
-    tokens: List[Token] = []
+    def __init__(self, tokens: List[Token] = []):
+        self.tokens = tokens
+        self.pos = 0
 
     def eat(self) -> Token:
-        return self.tokens.pop(0)
+        self.pos += 1
+        return self.tokens[self.pos - 1]
     
     def token_of_type(self, token_type: TokenType) -> bool:
-        return self.tokens[0].type == token_type
+        return self.tokens[self.pos].type == token_type
     
     def expect(self, type: TokenType, err: str) -> Token:
-        prev = self.tokens.pop(0)
+        prev = self.eat()
         if prev ==  None or prev.type != type :
             raise TokenError(f"Error at `{prev}` \n{err}\nExpecting: {type}")
         return prev
     
     def produce_ast(self) -> Program:
-        return Program(program=self.parse_expr())
+        self.pos = 0
+        with TRACE.phase("parse"):
+            program = self.parse_expr()
+        return with_span(Program(program=program), program.span, program.span)
     
     # e ::= var
     #     | e1 e2
@@ -38,110 +61,84 @@ class Parser:
     #     | A -> B # TODO
     
     def parse_expr(self) -> Expr:
-        expr_list: List[Expr|Par] = []
-        glob_depth = 0
+        frames: List[Frame] = [Frame()]
         while True:
+            token = self.tokens[self.pos]
             # Vars
             if self.token_of_type(TokenType.VAR): 
-                expr_list.append(Variable(self.parse_varname()))
+                frames[-1].push(with_span(Variable(self.parse_varname()), token.span, token.span))
             elif self.token_of_type(TokenType.STAR): 
                 self.eat()
-                expr_list.append(Star())
+                frames[-1].push(with_span(Star(), token.span, token.span))
             elif self.token_of_type(TokenType.SQUARE): 
                 self.eat()
-                expr_list.append(Square())
+                frames[-1].push(with_span(Square(), token.span, token.span))
             # abstraction
-            elif self.token_of_type(TokenType.LAMBDA): expr_list.append(self.parse_abstraction())
-            elif self.token_of_type(TokenType.PROD): expr_list.append(self.parse_product())
+            elif self.token_of_type(TokenType.LAMBDA): frames[-1].push(self.parse_abstraction())
+            elif self.token_of_type(TokenType.PROD): frames[-1].push(self.parse_product())
             # closing Par
             elif self.token_of_type(TokenType.CLOSE_PAREN):
-                if glob_depth <= 0: break
+                if len(frames) <= 1: break
                 self.eat()
-                expr_list.append(ClosePar())
-                glob_depth -= 1
+                group = frames.pop().close()
+                frames[-1].push(group)
             # open par
             elif self.token_of_type(TokenType.OPEN_PAREN):
-                glob_depth += 1
                 self.eat()
-                expr_list.append(OpenPar())
-            elif self.token_of_type(TokenType.TO): expr_list.append(Arrow())
+                frames.append(Frame())
             elif self.token_of_type(TokenType.OPEN_BRACKET):
                 self.expect(TokenType.OPEN_BRACKET, "No `[` in sub")
                 varname = self.parse_varname()
                 self.expect(TokenType.SUB, "no `:=` in sub")
-                normal, left = self.split_expr(expr_list)
-                expr_list = normal
-                expr_list.append(Substitution(org_expr=self.make_applications(left), free_var=varname, sub_expr=self.parse_expr()))
-                self.expect(TokenType.CLOSE_BRACKET, "No `]` in sub")
+                org_expr = frames[-1].last
+                if org_expr is None:
+                    raise TokenError(f"Nothing to substitute into at `{token}`")
+                sub_expr = self.parse_expr()
+                close = self.expect(TokenType.CLOSE_BRACKET, "No `]` in sub")
+                frames[-1].last = with_span(Substitution(org_expr=org_expr, free_var=varname, sub_expr=sub_expr), org_expr.span, close.span)
             else: break
-        return self.make_applications(expr_list)
-    
-    def split_expr(self, expr_list: List[Expr|Par]) -> Tuple[Expr, Expr]:
-        front = expr_list[:]
-        last = []
-        depth = 0
-        for expr in reversed(front):
-            if isinstance(expr, OpenPar): depth -= 1
-            elif isinstance(expr, ClosePar): depth += 1
-            last.append(front.pop())
-            if depth <= 0: break
-        return (front, list(reversed(last)))
-    
-    def make_applications(self, expr_list: List[Expr|Par]) -> Expr:
-        if len(expr_list) == 1:
-            return expr_list[0]
-        if len(expr_list) == 2:
-            return Application(func=expr_list[0], arg=expr_list[1])
-        if not isinstance(expr_list[-1], ClosePar): 
-            return Application(func=self.make_applications(expr_list[:-1]), arg=expr_list[-1])
-        depth = 1
-        for i, expr in enumerate(reversed(expr_list[:-1])):
-            if isinstance(expr, OpenPar): depth -= 1
-            elif isinstance(expr, ClosePar): depth += 1
-            if depth <= 0:
-                if i >= len(expr_list[:-1]) - 1: return self.make_applications(expr_list[1:-1])
-                return Application(func=self.make_applications(expr_list[:-2-i]), arg=self.make_applications(expr_list[-1-i : -1]))
-        raise TokenError(f"Could not make applications from `{expr_list}`")
-
+        if len(frames) > 1:
+            raise TokenError(f"Unclosed `(` before `{self.tokens[self.pos]}`")
+        return frames[0].close()
     
     def parse_abstraction(self) -> Abstraction:
-        self.expect(TokenType.LAMBDA, "No `\` in abstraction")
+        start = self.expect(TokenType.LAMBDA, "No `\` in abstraction")
         bound_var = self.parse_varname()
         self.expect(TokenType.OFTYPE, "No type in abstraction")
         param_type = self.parse_expr()
         self.expect(TokenType.DOT, "No `.` in abstraction")
-        return Abstraction(param=bound_var, param_type=param_type, body=self.parse_expr())
+        body = self.parse_expr()
+        return with_span(Abstraction(param=bound_var, param_type=param_type, body=body), start.span, body.span)
     
     def parse_product(self) -> Product:
-        self.expect(TokenType.PROD, "No `&` in product")
+        start = self.expect(TokenType.PROD, "No `&` in product")
         bound_var = self.parse_varname()
         self.expect(TokenType.OFTYPE, "No type in product")
         param_type = self.parse_expr()
         self.expect(TokenType.DOT, "No `.` in product")
-        return Product(param=bound_var, param_type=param_type, body=self.parse_expr())
+        body = self.parse_expr()
+        return with_span(Product(param=bound_var, param_type=param_type, body=body), start.span, body.span)
     
     def parse_varname(self) -> str:
         return self.expect(TokenType.VAR, "Var expected").value
     
 #interesting_ast = Program(program=Abstraction(param='A', param_type=Star(), body=Abstraction(param='f', param_type=Product(param='_', param_type=Variable(id='A'), body=Variable(id='A')), body=Abstraction(param='x', param_type=Variable(id='A'), body=Application(func=Abstraction(param='x', param_type=Variable(id='A'), body=Application(func=Variable(id='f'), arg=Application(func=Application(func=Application(func=Abstraction(param='A', param_type=Star(), body=Abstraction(param='f', param_type=Product(param='_', param_type=Variable(id='A'), body=Variable(id='A')), body=Abstraction(param='x', param_type=Variable(id='A'), body=Application(func=Variable(id='f'), arg=Variable(id='x'))))), arg=Variable(id='A')), arg=Variable(id='f')), arg=Variable(id='x')))), arg=Application(func=Application(func=Application(func=Abstraction(param='A', param_type=Star(), body=Abstraction(param='f', param_type=Product(param='_', param_type=Variable(id='A'), body=Variable(id='A')), body=Abstraction(param='x', param_type=Variable(id='A'), body=Application(func=Variable(id='f'), arg=Variable(id='x'))))), arg=Variable(id='A')), arg=Variable(id='f')), arg=Variable(id='x')))))))
 if __name__ == "__main__":
+    import sys
+    from printer import write
     # 
     src1 = "( eq two two) {nats}"
     my_parser1 = Parser()
     my_parser1.tokens = tokenize(src1)
     ast1 = my_parser1.produce_ast()
     #ast1 = interesting_ast
-    print(ast1.to_str())
-    while not ast1.find_unconflicting_subs(): print(ast1.to_str())
-    print(ast1.to_str())
-    while ast1.one_beta_normal_reduction(): 
-        print("red step fin -> subs")
-        while not ast1.find_unconflicting_subs(): print(ast1.to_str())
-        print(ast1.to_str())
-        print("awaiting red")
-    #ast1.to_beta_normal_form()
+    write(ast1, sys.stdout)
+    print()
+    ast1.to_beta_normal_form()
+    #ast1.to_beta_normal_form(engine=Engine.SUBSTITUTION)
     #ast1.one_beta_normal_reduction({})
-    print(ast1.to_str())
+    write(ast1, sys.stdout)
+    print()
     print("fin")
     #print(ast1.infer_type().to_str())
 
@@ -0,0 +1,178 @@
+from typing import Dict, List, Set, TextIO, Tuple
+from deBruijn import DBExpr, BoundVar, FreeVar, DBBinder, DBAbstraction, DBApplication, DBStar, DBSquare, DBErased
+from abstractSyntaxTree import Expr, Kind, ASTError, binder_name, find_fresh_name
+import io
+
+# Streaming printer for Expr trees and de Bruijn terms, in the syntax of to_str.
+# Terms are walked with an explicit stack and written in chunks, so deep terms neither
+# recurse nor build their text by repeated concatenation.
+#   width      lines are broken at spaces so they stay this short where possible, the
+#              lexer skips line breaks so the text still parses the same
+#   max_depth  subterms nested deeper are written as ..., which no longer parses
+#   share      closed subterms that occur more than once are written once as trailing
+#              [s := ...] bindings, which the parser reads back into the same term
+
+FLUSH_AT = 4096 # pieces buffered before they are written out
+
+class Writer():
+    def __init__(self, out: TextIO, width: int | None = None):
+        self.out = out
+        self.width = width
+        self.column = 0
+        self.space = False
+        self.buffer: List[str] = []
+
+    # a single " " piece is a place the line may be broken instead
+    def piece(self, text: str):
+        if text == " ":
+            self.space = True
+            return
+        if self.space:
+            if self.width is not None and self.column + 1 + len(text) > self.width and self.column > 0:
+                self.buffer.append("\n")
+                self.column = 0
+            else:
+                self.buffer.append(" ")
+                self.column += 1
+            self.space = False
+        self.buffer.append(text)
+        self.column += len(text)
+        if len(self.buffer) >= FLUSH_AT: self.flush()
+
+    def flush(self):
+        if self.space:
+            self.buffer.append(" ")
+            self.space = False
+        self.out.write("".join(self.buffer))
+        self.buffer.clear()
+
+# pieces of one node and the subterms between them, in order, read through the kind of
+# the node so arena views are written as well
+def expr_pieces(expr: Expr) -> List[str | Expr]:
+    kind = getattr(expr, "kind", None)
+    if kind == Kind.PROGRAM: return [expr.program]
+    if kind == Kind.VARIABLE: return [expr.id]
+    if kind == Kind.STAR: return ["*"]
+    if kind == Kind.SQUARE: return ["#"]
+    if kind in (Kind.ABSTRACTION, Kind.PRODUCT):
+        return ["\\" if kind == Kind.ABSTRACTION else "&", " ", f"{expr.param}:", " ", expr.param_type, ".", " ", expr.body]
+    if kind == Kind.APPLICATION:
+        left = ["(", expr.func, ")"] if expr.func.kind in (Kind.ABSTRACTION, Kind.PRODUCT) else [expr.func]
+        right = ["(", expr.arg, ")"] if expr.arg.kind in (Kind.APPLICATION, Kind.ABSTRACTION, Kind.PRODUCT) else [expr.arg]
+        return left + [" "] + right
+    if kind == Kind.SUBSTITUTION:
+        return ["(", expr.org_expr, ")[", f"{expr.free_var}", " ", ":=", " ", expr.sub_expr, "]"]
+    raise ASTError(f"No expected instance found, instead {expr}")
+
+def write_expr(expr: Expr, writer: Writer, max_depth: int | None):
+    todo: List[Tuple[str | Expr, int]] = [(expr, 0)]
+    while todo:
+        item, depth = todo.pop()
+        if isinstance(item, str): writer.piece(item)
+        elif max_depth is not None and depth > max_depth and item.kind != Kind.PROGRAM: writer.piece("...")
+        else: todo += [(piece, depth + 1) for piece in reversed(expr_pieces(item))]
+
+# binder names are chosen as by expr_from_de_bruijn, shared terms are written as their binding name
+def write_de_bruijn(term: DBExpr, writer: Writer, max_depth: int | None, free: Set[str], bound_names: Dict[DBExpr, str] = {}):
+    names: List[str] = []
+    todo: List[Tuple] = [("visit", term, 0)]
+    while todo:
+        task = todo.pop()
+        if task[0] == "piece":
+            writer.piece(task[1])
+            continue
+        if task[0] == "bind":
+            names.append(task[1])
+            continue
+        if task[0] == "unbind":
+            names.pop()
+            continue
+        _, node, depth = task
+        if node in bound_names and node is not term:
+            writer.piece(bound_names[node])
+        elif max_depth is not None and depth > max_depth:
+            writer.piece("...")
+        elif isinstance(node, BoundVar):
+            writer.piece(names[-1 - node.index])
+        elif isinstance(node, FreeVar):
+            writer.piece(node.name)
+        elif isinstance(node, DBStar):
+            writer.piece("*")
+        elif isinstance(node, DBSquare):
+            writer.piece("#")
+        elif isinstance(node, DBErased):
+            writer.piece("?")
+        elif isinstance(node, DBBinder):
+            param = binder_name(node, names, free)
+            todo += [("unbind",), ("visit", node.body, depth + 1), ("piece", " "), ("piece", "."), ("bind", param), ("visit", node.param_type, depth + 1),
+                     ("piece", " "), ("piece", f"{param}:"), ("piece", " "), ("piece", "\\" if isinstance(node, DBAbstraction) else "&")]
+        elif isinstance(node, DBApplication):
+            # a shared subterm is written as a name and needs no parentheses
+            func_bound, arg_bound = node.func in bound_names, node.arg in bound_names
+            left = [("piece", "("), ("visit", node.func, depth + 1), ("piece", ")")] if isinstance(node.func, DBBinder) and not func_bound else [("visit", node.func, depth + 1)]
+            right = [("piece", "("), ("visit", node.arg, depth + 1), ("piece", ")")] if isinstance(node.arg, (DBApplication, DBBinder)) and not arg_bound else [("visit", node.arg, depth + 1)]
+            todo += list(reversed(left + [("piece", " ")] + right))
+        else:
+            raise ASTError(f"No expected de Bruijn instance found, instead {node}")
+
+# closed subterms that occur more than once in the written tree, larger ones first
+def shared_subterms(term: DBExpr) -> List[DBExpr]:
+    order: List[DBExpr] = [] # post order, so every parent comes after its children
+    seen: Set[DBExpr] = set()
+    todo = [term]
+    while todo:
+        node = todo[-1]
+        if node in seen:
+            todo.pop()
+            continue
+        pending = [child for child, _ in node.children() if child not in seen]
+        if pending:
+            todo += pending
+            continue
+        seen.add(node)
+        order.append(node)
+        todo.pop()
+    occurrences: Dict[DBExpr, int] = {term: 1}
+    sizes: Dict[DBExpr, int] = {}
+    for node in order:
+        sizes[node] = 1 + sum(sizes[child] for child, _ in node.children())
+    for node in reversed(order):
+        for child, _ in node.children():
+            occurrences[child] = occurrences.get(child, 0) + occurrences[node]
+    shared = [node for node in order if node is not term and occurrences[node] > 1 and node.children() and node.loose_range() == 0]
+    return sorted(shared, key=lambda node: -sizes[node])
+
+def write(term: DBExpr | Expr, out: TextIO, width: int | None = None, max_depth: int | None = None, share: bool = False):
+    writer = Writer(out, width)
+    if not share and not isinstance(term, DBExpr):
+        write_expr(term, writer, max_depth)
+        writer.flush()
+        return
+    if not isinstance(term, DBExpr): term = term.to_de_bruijn()
+    free = term.get_free_names()
+    bound_names: Dict[DBExpr, str] = {}
+    if share:
+        # binding names may not meet a free name, binders are named around both
+        taken = set(free)
+        for node in shared_subterms(term):
+            bound_names[node] = find_fresh_name("s", taken)
+            taken.add(bound_names[node])
+    free = free | set(bound_names.values())
+    if not bound_names:
+        write_de_bruijn(term, writer, max_depth, free)
+        writer.flush()
+        return
+    # every binding may use the ones to its right, see library.compile_prelude
+    writer.piece("(")
+    write_de_bruijn(term, writer, max_depth, free, bound_names)
+    writer.piece(")")
+    for node, name in bound_names.items():
+        for piece in ("[", name, " ", ":=", " "): writer.piece(piece)
+        write_de_bruijn(node, writer, max_depth, free, bound_names)
+        writer.piece("]")
+    writer.flush()
+
+def to_text(term: DBExpr | Expr, width: int | None = None, max_depth: int | None = None, share: bool = False) -> str:
+    out = io.StringIO()
+    write(term, out, width, max_depth, share)
+    return out.getvalue()
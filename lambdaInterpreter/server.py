@@ -0,0 +1,242 @@
+from typing import Dict, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, replace
+from abstractSyntaxTree import Engine
+from library import load_prelude
+from main import Job, Result, STEP_EVENTS, run_job, start_worker, preludes, includes_of
+from instrumentation import TRACE
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import signal
+import time
+
+# Evaluation server: clients send programs as JSON lines over localhost TCP or a Unix
+# socket, workers type check and normalize them like main.py, and every result is written
+# back as a JSON line as soon as it is ready, so answers may arrive out of order.
+#
+#   python lambdaInterpreter/server.py --port 7878 --prelude nats
+#   python lambdaInterpreter/server.py --socket /tmp/lambda.sock
+#
+# requests, one per line:
+#   {"id": "a", "source": "(plus two three) {nats}"}    also "engine", "type_check", "deadline"
+#   {"cancel": "a"}
+#
+# Requests for the same program that are still being computed share one computation.
+# A request past its deadline or cancelled is answered with an error right away, and the
+# reduction is interrupted in its worker once no request waits for it anymore.
+#
+# Workers stop cooperatively: a cancel signal or the --timeout only mark the job, and the
+# engines check the mark at the steps they trace, so a job never stops in the middle of
+# updating a cache or the hash consing tables.
+
+CANCELLED = "cancelled"
+LINE_LIMIT = 1 << 24 # longest request line in bytes
+
+# base exceptions, so nothing between the engine and serve_job takes them for a failure
+class JobCancelled(BaseException):
+    pass
+
+class JobTimedOut(BaseException):
+    pass
+
+# set in every worker by the pool initializer
+running = None # ticket -> pid of the worker running it, or NOT_STARTED once cancelled
+cancellable = False
+cancel_requested = False
+deadline: Optional[float] = None
+NOT_STARTED = -1
+
+def start_server_worker(shared: Dict[Tuple[str, ...], object], registry):
+    global running
+    start_worker(shared)
+    running = registry
+    TRACE.enable()
+    for name in STEP_EVENTS: TRACE.subscribe(name, poll)
+    if hasattr(signal, "SIGUSR1"): signal.signal(signal.SIGUSR1, on_cancel)
+
+# a cancel that arrives between jobs is dropped, one meant for the previous job on this
+# worker is caught by the server, which runs the job again
+def on_cancel(signum, frame):
+    global cancel_requested
+    if cancellable: cancel_requested = True
+
+def poll(name: str, amount: int, data: Dict):
+    if cancel_requested: raise JobCancelled()
+    if deadline is not None and time.perf_counter() >= deadline: raise JobTimedOut()
+
+def serve_job(ticket: int, job: Job, engine: Engine, timeout: Optional[float], type_check: bool) -> Result:
+    global cancellable, cancel_requested, deadline
+    if job.includes and job.includes not in preludes:
+        preludes[job.includes] = load_prelude(job.includes)
+    if running.setdefault(ticket, os.getpid()) != os.getpid():
+        running.pop(ticket, None)
+        return Result(job.id, error=CANCELLED)
+    cancel_requested = False
+    deadline = None if timeout is None else time.perf_counter() + timeout
+    cancellable = True
+    try:
+        # the timeout is checked by poll, run_job would let the machine engines pause instead
+        return run_job(job, engine, None, type_check, native=False)
+    except JobCancelled:
+        return Result(job.id, error=CANCELLED)
+    except JobTimedOut:
+        return Result(job.id, error=f"timed out after {timeout}s")
+    finally:
+        cancellable = False
+        deadline = None
+        running.pop(ticket, None)
+
+class Computation():
+    def __init__(self, key: Tuple):
+        self.key = key
+        self.ticket = -1
+        self.waiters = 0
+        self.cancelled = False
+        self.task: asyncio.Task | None = None
+
+class Server():
+    def __init__(self, pool: ProcessPoolExecutor, registry, engine: Engine, timeout: Optional[float]):
+        self.pool = pool
+        self.running = registry
+        self.engine = engine
+        self.timeout = timeout # for every computation, deadlines only limit the wait for it
+        self.inflight: Dict[Tuple, Computation] = {}
+        self.tickets = itertools.count()
+        self.connections: Dict[asyncio.Task, Tuple[asyncio.StreamReader, asyncio.StreamWriter]] = {} # by handler
+
+    async def compute(self, computation: Computation, job: Job, engine: Engine, type_check: bool) -> Result:
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                computation.ticket = next(self.tickets)
+                result = await loop.run_in_executor(self.pool, serve_job, computation.ticket, job, engine, self.timeout, type_check)
+                if result.error != CANCELLED or computation.cancelled: return result
+        finally:
+            if self.inflight.get(computation.key) is computation: del self.inflight[computation.key]
+
+    def cancel(self, computation: Computation):
+        computation.cancelled = True
+        if self.inflight.get(computation.key) is computation: del self.inflight[computation.key]
+        computation.task.cancel()
+        pid = self.running.setdefault(computation.ticket, NOT_STARTED)
+        if pid != NOT_STARTED and hasattr(signal, "SIGUSR1"):
+            try:
+                os.kill(pid, signal.SIGUSR1)
+            except ProcessLookupError:
+                pass
+
+    async def evaluate(self, job: Job, engine: Engine, type_check: bool) -> Result:
+        key = (job.source, engine, type_check)
+        computation = self.inflight.get(key)
+        if computation is None:
+            computation = self.inflight[key] = Computation(key)
+            computation.task = asyncio.create_task(self.compute(computation, job, engine, type_check))
+        computation.waiters += 1
+        try:
+            return replace(await asyncio.shield(computation.task), id=job.id)
+        finally:
+            computation.waiters -= 1
+            if computation.waiters == 0 and not computation.task.done(): self.cancel(computation)
+
+    async def answer(self, request: Dict, writer: asyncio.StreamWriter):
+        id, deadline = "", None
+        try:
+            id = str(request.get("id", ""))
+            deadline = request.get("deadline")
+            job = Job(id, request["source"], includes_of(request["source"]))
+            engine = Engine[request.get("engine", self.engine.name)]
+            result = await asyncio.wait_for(self.evaluate(job, engine, bool(request.get("type_check", True))), deadline)
+        except asyncio.TimeoutError:
+            result = Result(id, error=f"deadline of {deadline}s exceeded")
+        except asyncio.CancelledError:
+            result = Result(id, error=CANCELLED)
+        except Exception as error:
+            result = Result(id, error=f"{type(error).__name__}: {error}")
+        if not writer.is_closing():
+            writer.write((json.dumps(asdict(result)) + "\n").encode())
+            await writer.drain()
+
+    def reject(self, error: str, writer: asyncio.StreamWriter):
+        writer.write((json.dumps(asdict(Result("", error=error))) + "\n").encode())
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        pending: Dict[str, asyncio.Task] = {}
+        self.connections[asyncio.current_task()] = (reader, writer)
+        try:
+            async for line in reader:
+                if not line.strip(): continue
+                try:
+                    request = json.loads(line)
+                except json.JSONDecodeError as error:
+                    self.reject(f"JSONDecodeError: {error}", writer)
+                    continue
+                if not isinstance(request, dict):
+                    self.reject(f"requests are JSON objects, not {type(request).__name__}", writer)
+                    continue
+                if "cancel" in request:
+                    task = pending.get(str(request["cancel"]))
+                    if task is not None: task.cancel()
+                    continue
+                id = str(request.get("id", ""))
+                task = asyncio.create_task(self.answer(request, writer))
+                pending[id] = task
+                task.add_done_callback(lambda done, id=id: pending.pop(id, None) if pending.get(id) is done else None)
+            # the client stopped sending, its answers are still written
+            if pending: await asyncio.wait(list(pending.values()))
+        except ConnectionError:
+            pass
+        finally:
+            for task in pending.values(): task.cancel()
+            del self.connections[asyncio.current_task()]
+            writer.close()
+
+    # cancels every computation, so the workers are idle when the pool shuts down, and
+    # ends every connection as if its client stopped sending: waiting requests are
+    # answered as cancelled before it closes
+    async def close(self):
+        for computation in list(self.inflight.values()): self.cancel(computation)
+        for reader, writer in self.connections.values():
+            writer.transport.pause_reading()
+            reader.feed_eof()
+        if self.connections: await asyncio.wait(list(self.connections))
+
+async def serve(options: argparse.Namespace):
+    shared = {includes : load_prelude(includes) for includes in (tuple(options.prelude),) if includes}
+    # forked workers are started on demand and would keep the sockets of connected clients open
+    context = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+    with context.Manager() as manager:
+        registry = manager.dict()
+        with ProcessPoolExecutor(max_workers=options.jobs, mp_context=context, initializer=start_server_worker, initargs=(shared, registry)) as pool:
+            server = Server(pool, registry, Engine[options.engine], options.timeout)
+            if options.socket is not None:
+                listener = await asyncio.start_unix_server(server.handle, options.socket, limit=LINE_LIMIT)
+            else:
+                listener = await asyncio.start_server(server.handle, options.host, options.port, limit=LINE_LIMIT)
+            # SIGTERM and SIGINT shut the workers and the manager down instead of orphaning them
+            stopping = asyncio.Event()
+            if os.name == "posix":
+                for signum in (signal.SIGTERM, signal.SIGINT): asyncio.get_running_loop().add_signal_handler(signum, stopping.set)
+            async with listener:
+                await stopping.wait()
+            await server.close()
+            pool.shutdown(cancel_futures=True)
+    if options.socket is not None and os.path.exists(options.socket): os.remove(options.socket)
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Type check and normalize lambda programs sent over a socket")
+    arguments.add_argument("--host", default="127.0.0.1")
+    arguments.add_argument("--port", type=int, default=7878)
+    arguments.add_argument("--socket", help="listen on this Unix socket instead of TCP")
+    arguments.add_argument("--engine", default=Engine.NBE.name, choices=[engine.name for engine in Engine])
+    arguments.add_argument("--jobs", type=int, default=os.cpu_count(), help="worker processes")
+    arguments.add_argument("--timeout", type=float, help="seconds any program may run at most")
+    arguments.add_argument("--prelude", nargs="*", default=[], help="includes every worker loads before the first request")
+    options = arguments.parse_args()
+    try:
+        asyncio.run(serve(options))
+    except KeyboardInterrupt:
+        pass
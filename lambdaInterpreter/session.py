@@ -0,0 +1,181 @@
+from typing import Dict, FrozenSet, List, Tuple, Iterable, Optional
+from graphlib import TopologicalSorter
+from deBruijn import DBExpr
+from environment import Env, Definition
+from abstractSyntaxTree import Program, Engine, TYPE_CACHE, TERM_CACHES
+from normalization import normalize
+from normalForms import normalize_cached, save, load
+from library import load_prelude, split_includes
+from lexer import TokenType, scan
+import argparse
+import re
+import sys
+
+# Interactive and scripted sessions: definitions are declared once, type checked and
+# normalized when they are declared and kept in one Env, queries are checked and
+# normalized against it. Redefining a name rechecks the definitions that use it,
+# directly or through others, and nothing else.
+#
+#   python lambdaInterpreter/session.py                  # interactive
+#   python lambdaInterpreter/session.py script.lm        # one statement per line
+#   python lambdaInterpreter/session.py --cache terms.lmc # keep checked terms across runs
+#
+# statements:
+#   name := expr      define or redefine, [name := expr] works as well
+#   {file}            define everything in an included file
+#   expr              type check and normalize, includes in it are defined first
+#   :type expr        type check only
+#   :show name        type and normal form of a definition
+#   :defs             all definitions
+#   :cache            sizes and hit counts of the type and normal form caches
+#   :quit
+
+class SessionError(Exception):
+    pass
+
+DEFINITION = re.compile(r"\s*(\w+)\s*:=(.*)", re.DOTALL)
+
+class Session():
+    def __init__(self, engine: Engine = Engine.NBE):
+        self.engine = engine
+        self.env = Env()
+        self.uses: Dict[str, FrozenSet[str]] = {} # definitions each definition names
+        self.normal_forms: Dict[str, DBExpr] = {}
+
+    def parse(self, source: str) -> Program:
+        program, includes = split_includes(source)
+        for include in includes: self.include(include)
+        return program
+
+    # every definition that uses name, ordered so each comes after the ones it uses
+    def dependents(self, name: str) -> List[str]:
+        affected = {name}
+        changed = True
+        while changed:
+            users = {user for user, used in self.uses.items() if used & affected}
+            changed = not users <= affected
+            affected |= users
+        affected.discard(name)
+        return list(TopologicalSorter({user : self.uses[user] & affected for user in affected}).static_order())
+
+    def check(self, name: str, folded: DBExpr, staged: Dict[str, Definition]) -> Tuple[Definition, DBExpr]:
+        used = {free : (staged[free] if free in staged else self.env.lookup(free)).term for free in folded.get_free_names()}
+        term = folded.replace_free(used)
+        term_type = Program.from_de_bruijn(term).infer_type().to_de_bruijn({}, 0)
+        return Definition(name, term, term_type, folded), normalize_cached(term, Engine.NBE.name, None, normalize)
+
+    def define(self, name: str, source: str) -> List[str]:
+        folded = self.parse(source).to_de_bruijn()
+        uses = frozenset(folded.get_free_names())
+        undefined = sorted(free for free in uses if free not in self.env)
+        if undefined:
+            raise SessionError(f"`{undefined[0]}` is not defined")
+        return self.update(name, folded, uses)
+
+    # checks name and its dependents, except the fixed ones, and only then installs them,
+    # so on any error the session stays as it was. Returns the rechecked dependents.
+    def update(self, name: str, folded: DBExpr, uses: FrozenSet[str], checked: Definition | None = None, fixed: Iterable[str] = ()) -> List[str]:
+        dependents = [dependent for dependent in self.dependents(name) if dependent not in fixed] if name in self.env else []
+        if name in uses or uses & set(dependents):
+            raise SessionError(f"`{name}` would depend on itself")
+        staged: Dict[str, Definition] = {}
+        normal_forms: Dict[str, DBExpr] = {}
+        if checked is not None:
+            staged[name], normal_forms[name] = checked, normalize_cached(checked.term, Engine.NBE.name, None, normalize)
+        for current in dependents if checked is not None else [name] + dependents:
+            try:
+                staged[current], normal_forms[current] = self.check(current, folded if current == name else self.env.lookup(current).folded, staged)
+            except Exception as error:
+                if current == name: raise
+                raise SessionError(f"redefining `{name}` breaks `{current}`: {type(error).__name__}: {error}")
+        self.uses[name] = uses
+        for current, definition in staged.items(): self.install(definition, normal_forms[current])
+        return dependents
+
+    def install(self, definition: Definition, normal_form: DBExpr):
+        self.env.define(definition)
+        self.normal_forms[definition.name] = normal_form
+        # queries that use the definition find its type without inferring it again
+        if definition.type is not None: TYPE_CACHE.store((definition.term, ()), definition.type)
+
+    # included definitions were checked when their prelude was compiled
+    def include(self, include: str) -> List[str]:
+        prelude = load_prelude((include,))
+        rechecked: List[str] = []
+        for name, definition in prelude.definitions.items():
+            if name in self.env and self.env.lookup(name).term is definition.term: continue
+            uses = frozenset(free for free in definition.folded.get_free_names() if free in prelude.definitions)
+            rechecked += self.update(name, definition.folded, uses, definition, prelude.definitions)
+        return rechecked
+
+    def infer_type(self, source: str) -> Program:
+        program = self.parse(source)
+        linked = Program.from_de_bruijn(program.to_de_bruijn().replace_free(self.env.linked()))
+        return linked.infer_type()
+
+    def evaluate(self, source: str, type_check: bool = True) -> Tuple[Program, Optional[Program]]:
+        program_type = self.infer_type(source) if type_check else None
+        program = self.parse(source)
+        program.to_beta_normal_form(engine=self.engine, defs=self.env)
+        return program, program_type
+
+    def show(self, name: str) -> str:
+        definition = self.env.lookup(name)
+        shown_type = "?" if definition.type is None else Program.from_de_bruijn(definition.type).to_str()
+        return f"{name} : {shown_type} = {Program.from_de_bruijn(self.normal_forms[name]).to_str()}"
+
+    # runs one statement and returns what to print
+    def execute(self, statement: str) -> str:
+        statement = statement.strip()
+        if statement.startswith("[") and statement.endswith("]"): statement = statement[1:-1]
+        if statement == ":defs":
+            return "\n".join(self.show(name) for name in self.env)
+        if statement == ":cache":
+            return "\n".join(f"{name}: " + ", ".join(f"{key} {value}" for key, value in cache.stats().items()) for name, cache in TERM_CACHES.items())
+        if statement.startswith(":show "):
+            return self.show(statement[len(":show "):].strip())
+        if statement.startswith(":type "):
+            return self.infer_type(statement[len(":type "):]).to_str()
+        tokens = [token for token in scan(statement) if token.type != TokenType.EOF]
+        if all(token.type == TokenType.INCLUDE for token in tokens):
+            rechecked = [name for token in tokens for name in self.include(token.value)]
+            return f"{len(self.env)} definitions" + (f", rechecked {', '.join(rechecked)}" if rechecked else "")
+        definition = DEFINITION.fullmatch(statement)
+        if definition is not None:
+            name = definition.group(1)
+            rechecked = self.define(name, definition.group(2))
+            return f"{name} defined" + (f", rechecked {', '.join(rechecked)}" if rechecked else "")
+        program, program_type = self.evaluate(statement)
+        return f"{program.to_str()} : {program_type.to_str()}"
+
+    # statements one per line, blank lines and // comments skipped
+    def run(self, lines: Iterable[str], out=sys.stdout, prompt: str = "") -> int:
+        failed = 0
+        lines = iter(lines)
+        while True:
+            if prompt: out.write(prompt); out.flush()
+            line = next(lines, None)
+            if line is None or line.strip() == ":quit": return failed
+            if not line.strip() or line.strip().startswith("//"): continue
+            try:
+                out.write(self.execute(line) + "\n")
+            except Exception as error:
+                failed += 1
+                out.write(f"error: {type(error).__name__}: {error}\n")
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Define lambda terms once and evaluate queries against them")
+    arguments.add_argument("files", nargs="*", help="scripts, one statement per line, stdin if not given")
+    arguments.add_argument("--engine", default=Engine.NBE.name, choices=[engine.name for engine in Engine])
+    arguments.add_argument("--cache", help="file the type and normal form caches are loaded from and saved to")
+    options = arguments.parse_args()
+    if options.cache: load(options.cache, TERM_CACHES)
+    session = Session(Engine[options.engine])
+    failed = 0
+    for path in options.files:
+        with open(path, "r") as file:
+            failed += session.run(file)
+    if not options.files:
+        failed += session.run(sys.stdin, prompt="> " if sys.stdin.isatty() else "")
+    if options.cache: save(options.cache, TERM_CACHES)
+    sys.exit(1 if failed else 0)
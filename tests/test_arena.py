@@ -0,0 +1,34 @@
+import pytest
+from library import parse_program
+from abstractSyntaxTree import Program, Expr, Engine
+from arena import Arena, from_expr, from_de_bruijn
+
+SOURCE = "(plus two (mult two three)) {nats}"
+
+def test_expr_and_de_bruijn_round_trips():
+    program = parse_program(SOURCE)
+    term = program.to_de_bruijn()
+    view = from_expr(program)
+    assert view.to_de_bruijn() is term
+    assert view.to_expr().to_de_bruijn() is term
+    shared = from_de_bruijn(term)
+    assert shared.to_de_bruijn() is term
+    assert shared.to_str() == Program.from_de_bruijn(term).to_str()
+
+def test_deep_terms_round_trip():
+    depth = 5000
+    program = parse_program(r"\ A: *. \ f: & _: A. A. \ x: A. " + "f (" * depth + "x" + ")" * depth)
+    arena = Arena()
+    view = from_expr(program, arena)
+    assert len(arena) == 2 * depth + 9
+    assert view.to_expr().to_de_bruijn() is program.to_de_bruijn()
+    assert from_de_bruijn(program.to_de_bruijn(), arena).to_de_bruijn() is program.to_de_bruijn()
+
+def test_views_are_read_only():
+    view = from_expr(parse_program(SOURCE))
+    assert not isinstance(view, Expr)
+    with pytest.raises(TypeError):
+        Program(program=view)
+    program = Program(program=view.to_expr())
+    program.to_beta_normal_form(engine=Engine.SUBSTITUTION)
+    assert program.to_de_bruijn() is parse_program("eight {nats}").to_de_bruijn()
@@ -0,0 +1,13 @@
+import pytest
+from benchmark import ENGINES, measure
+
+@pytest.mark.parametrize("engine", list(ENGINES))
+def test_every_engine_counts_its_beta_steps(engine):
+    result = measure(engine, "mult", 2, 2, 1, False)
+    assert result.error is None and result.normal_form_size == 17
+    # native computes the product in Python and only reads the numeral back
+    assert result.beta_steps == 0 if engine == "native" else result.beta_steps > 0
+    assert (result.peak_stack is not None) == (engine in ("machine", "lazy", "native"))
+
+def test_the_peak_stack_grows_with_the_numerals():
+    assert measure("machine", "plus", 5, 5, 1, False).peak_stack < measure("machine", "plus", 20, 20, 1, False).peak_stack
@@ -0,0 +1,53 @@
+import pickle
+import pytest
+from library import parse_with_env
+from abstractSyntaxTree import Engine, BetaReductionError
+from machine import Machine, MachineError, Strategy
+from normalForms import NORMAL_FORMS
+
+SOURCE = "(eq (exp two three) (mult two four)) {nats} {bools}"
+
+def expected(defs):
+    program, _ = parse_with_env(SOURCE)
+    program.to_beta_normal_form(engine=Engine.NBE, defs=defs)
+    return program.to_de_bruijn().replace_free(defs.linked())
+
+# paused after a few steps, dumped, loaded into a fresh process's worth of state and resumed
+@pytest.mark.parametrize("engine", [Engine.MACHINE, Engine.LAZY])
+def test_budgeted_runs_resume_from_a_dump(engine):
+    NORMAL_FORMS.clear()
+    program, defs = parse_with_env(SOURCE)
+    paused = program.to_beta_normal_form(engine=engine, defs=defs, steps=50)
+    assert isinstance(paused, Machine) and not paused.finished()
+    assert paused.transitions == 50
+    # the program is left as it was
+    assert program.to_de_bruijn() is parse_with_env(SOURCE)[0].to_de_bruijn()
+    resumed, pauses = Machine.load(paused.dump(), defs), 0
+    while resumed.run(steps=50) is None:
+        resumed = Machine.load(resumed.dump(), defs)
+        pauses += 1
+    assert pauses > 0
+    assert resumed.strategy == (Strategy.NAME if engine == Engine.MACHINE else Strategy.NEED)
+    assert resumed.result.replace_free(defs.linked()) is expected(defs)
+    # as many transitions as one run without pauses
+    whole = Machine.start(program.to_de_bruijn(), defs, resumed.strategy)
+    whole.run()
+    assert (resumed.transitions, resumed.beta_steps) == (whole.transitions, whole.beta_steps)
+
+def test_time_budgets_pause_too():
+    program, defs = parse_with_env("(eq (exp two (exp two four)) (exp two (exp two four))) {nats}")
+    paused = program.to_beta_normal_form(engine=Engine.LAZY, defs=defs, seconds=0.05)
+    assert isinstance(paused, Machine) and not paused.finished()
+
+def test_budgets_need_a_machine():
+    program, defs = parse_with_env(SOURCE)
+    with pytest.raises(BetaReductionError):
+        program.to_beta_normal_form(engine=Engine.NBE, defs=defs, steps=10)
+
+def test_checkpoints_of_other_versions_are_refused():
+    program, defs = parse_with_env(SOURCE)
+    paused = program.to_beta_normal_form(engine=Engine.MACHINE, defs=defs, steps=10)
+    state = pickle.loads(paused.dump())
+    state["version"] -= 1
+    with pytest.raises(MachineError):
+        Machine.load(pickle.dumps(state), defs)
@@ -0,0 +1,98 @@
+from library import parse_with_env, parse_program
+from abstractSyntaxTree import Program, Engine, Expr, Variable, BetaReduceable, Application, Substitution, TYPE_CACHE
+from normalForms import NORMAL_FORMS, normal_form_key
+from instrumentation import TRACE
+from session import Session
+from copy import deepcopy
+
+# free variables computed from scratch, never read from the caches
+def free_vars(expr):
+    if isinstance(expr, Program): return free_vars(expr.program)
+    if isinstance(expr, Variable): return {expr.id}
+    if isinstance(expr, BetaReduceable): return free_vars(expr.param_type) | (free_vars(expr.body) - {expr.param})
+    if isinstance(expr, Application): return free_vars(expr.func) | free_vars(expr.arg)
+    if isinstance(expr, Substitution): return (free_vars(expr.org_expr) - {expr.free_var}) | free_vars(expr.sub_expr)
+    return set()
+
+def nodes(expr):
+    todo = [expr]
+    while todo:
+        node = todo.pop()
+        yield node
+        todo += [value for value in vars(node).values() if isinstance(value, Expr)]
+
+# the de Bruijn form of a copy without any caches
+def de_bruijn(expr):
+    expr = deepcopy(expr)
+    for node in nodes(expr): node.invalidate()
+    return expr.to_de_bruijn()
+
+class CheckedProgram(Program):
+    # every node still caching something after a step must cache the right value
+    def one_beta_normal_reduction(self, Gamma={}):
+        for node in nodes(self):
+            if node.cached("free_vars_cache") is not None: assert node.cached("free_vars_cache") == free_vars(node)
+            if node.cached("de_bruijn_cache") is not None: assert node.cached("de_bruijn_cache") is de_bruijn(node)
+        return super().one_beta_normal_reduction(Gamma)
+
+def test_free_vars_caches_survive_substitution_steps():
+    program, defs = parse_with_env("(plus two three) {nats}")
+    reference = Program.from_de_bruijn(program.to_de_bruijn())
+    reference.to_beta_normal_form(engine=Engine.NBE, defs=defs)
+    checked = CheckedProgram(program=program.program)
+    TRACE.reset()
+    TRACE.enable()
+    try:
+        checked.to_beta_normal_form(engine=Engine.SUBSTITUTION, defs=defs)
+    finally:
+        TRACE.enable(False)
+    assert checked.to_de_bruijn() is reference.to_de_bruijn()
+    assert TRACE.counters["beta_steps"] > 0
+    # the parts a step leaves alone keep their caches
+    assert TRACE.counters["free_vars_cache_hits"] > TRACE.counters["beta_steps"]
+
+def normal_form_lookups(session, source):
+    TRACE.reset()
+    TRACE.enable()
+    try:
+        session.evaluate(source, type_check=False)
+    finally:
+        TRACE.enable(False)
+    return TRACE.counters.get("normal_form_cache_hits", 0)
+
+def test_normal_forms_depend_only_on_the_definitions_used():
+    session = Session()
+    session.execute("id := \\ A: *. \\ x: A. x")
+    session.execute("twice := \\ A: *. \\ f: & _: A. A. \\ x: A. f (f x)")
+    source = "\\ B: *. twice B (id B)"
+    normal_form_lookups(session, source)
+    session.execute("unrelated := \\ B: *. B")
+    assert normal_form_lookups(session, source) > 0
+    session.execute("id := \\ A: *. \\ y: A. y")
+    assert normal_form_lookups(session, source) > 0 # alpha equal, so unfolds the same
+    session.execute("id := \\ A: *. \\ x: A. twice A (\\ y: A. y) x")
+    # only the unfolded twice, which does not use id
+    assert normal_form_lookups(session, source) == 1
+
+def test_unfolded_definitions_are_normalized_once():
+    NORMAL_FORMS.clear()
+    TYPE_CACHE.clear()
+    counters = []
+    for _ in range(2):
+        # a new Env each time, nothing is left in its evaluated definitions
+        program, defs = parse_with_env("(pred (mult three three)) {nats}")
+        key = normal_form_key(program.to_de_bruijn(), Engine.NBE.name, defs)
+        TRACE.reset()
+        TRACE.enable()
+        try:
+            program.to_beta_normal_form(engine=Engine.NBE, defs=defs)
+        finally:
+            TRACE.enable(False)
+        # the program itself is normalized again, its definitions are not
+        NORMAL_FORMS.entries.pop(key)
+        counters.append(dict(TRACE.counters))
+    assert counters[1]["normal_form_cache_hits"] >= 3
+    assert counters[1]["beta_steps"] < counters[0]["beta_steps"]
+    # the normal form of three came with its type
+    three = parse_program(r"\ A: *. \ f: & _: A. A. \ x: A. f (f (f x))").to_de_bruijn()
+    assert (three, ()) in TYPE_CACHE
@@ -0,0 +1,50 @@
+import pytest
+import compilation
+from compilation import CompilationError
+from library import parse_with_env
+from normalization import normalize
+
+# each binder is a nested function, Python indents at most 100 deep
+def first_of(n):
+    return "\\ A: *. " + "".join(f"\\ x{i}: A. " for i in range(n)) + "x0"
+
+def fallbacks(monkeypatch):
+    reduced, reduce = [], compilation.reduce
+    monkeypatch.setattr(compilation, "reduce", lambda *args: reduced.append(args) or reduce(*args))
+    return reduced
+
+def raising(error):
+    def fail(*args): raise error
+    return fail
+
+# hash consing makes alpha-equal de Bruijn terms the same object
+def test_compiled_terms_are_not_left_to_the_machine(monkeypatch):
+    reduced = fallbacks(monkeypatch)
+    program, defs = parse_with_env("(mult two three) {nats}")
+    term = program.to_de_bruijn()
+    assert compilation.normalize(term, defs).replace_free(defs.linked()) is normalize(term, defs).replace_free(defs.linked())
+    assert not reduced
+
+@pytest.mark.parametrize("target, error", [("compile_term", CompilationError("cannot compile")), ("read_back", RecursionError())])
+def test_failures_fall_back_to_the_machine(monkeypatch, target, error):
+    reduced = fallbacks(monkeypatch)
+    monkeypatch.setattr(compilation, target, raising(error))
+    program, defs = parse_with_env("(mult two three) {nats}")
+    term = program.to_de_bruijn()
+    assert compilation.normalize(term, defs).replace_free(defs.linked()) is normalize(term, defs).replace_free(defs.linked())
+    assert len(reduced) == 1
+
+def test_terms_too_deep_to_compile_fall_back_to_the_machine(monkeypatch):
+    reduced = fallbacks(monkeypatch)
+    program, defs = parse_with_env(first_of(200))
+    term = program.to_de_bruijn()
+    with pytest.raises(CompilationError, match="too deeply nested"):
+        compilation.compile_term(term)
+    assert compilation.normalize(term, defs).replace_free(defs.linked()) is normalize(term, defs).replace_free(defs.linked())
+    assert reduced
+
+def test_other_errors_are_not_swallowed(monkeypatch):
+    monkeypatch.setattr(compilation, "compile_term", raising(ValueError("broken")))
+    program, defs = parse_with_env("(mult two three) {nats}")
+    with pytest.raises(ValueError, match="broken"):
+        compilation.normalize(program.to_de_bruijn(), defs)
@@ -0,0 +1,37 @@
+import pickle
+from parser import Parser
+from lexer import tokenize
+from abstractSyntaxTree import Program
+from deBruijn import BoundVar, FreeVar, DBAbstraction, DBApplication, DBStar, TermTable, terms_from_rows
+
+def term(source):
+    return Parser(tokenize(source)).produce_ast().to_de_bruijn()
+
+def test_alpha_equal_programs_are_one_term():
+    assert term(r"\ T: *. \ a: T. a") is term(r"\ S: *. \ b: S. b")
+    assert term(r"\ T: *. \ a: T. \ b: T. a") is not term(r"\ T: *. \ a: T. \ b: T. b")
+    assert Parser(tokenize(r"\ T: *. \ a: T. a")).produce_ast().alpha_equals(Parser(tokenize(r"\ S: *. \ b: S. b")).produce_ast())
+
+def test_bound_variables_are_indices_and_free_names_stay():
+    assert term(r"\ T: *. \ a: T. y a") is DBAbstraction(param_type=DBStar(), body=DBAbstraction(param_type=BoundVar(0), body=DBApplication(func=FreeVar("y"), arg=BoundVar(0))))
+    assert term(r"\ T: *. \ a: T. y a").get_free_names() == {"y"}
+
+def test_named_programs_convert_back_to_the_same_term():
+    source = r"\ A: *. \ f: & _: A. A. \ x: A. f (f x)"
+    assert Program.from_de_bruijn(term(source)).to_de_bruijn() is term(source)
+    assert Program.from_de_bruijn(term(source)).to_str() == source
+
+# substituting under a binder shifts the free indices of the argument, nothing is captured
+def test_instantiation_avoids_capture():
+    body = DBAbstraction(param_type=DBStar(), body=DBApplication(func=BoundVar(1), arg=BoundVar(0)))
+    assert body.instantiate(BoundVar(0)) is DBAbstraction(param_type=DBStar(), body=DBApplication(func=BoundVar(1), arg=BoundVar(0)))
+    assert body.instantiate(FreeVar("x")) is DBAbstraction(param_type=DBStar(), body=DBApplication(func=FreeVar("x"), arg=BoundVar(0)))
+    assert body.shift(5) is DBAbstraction(param_type=DBStar(), body=DBApplication(func=BoundVar(6), arg=BoundVar(0)))
+
+def test_terms_pickle_as_shared_rows():
+    two = term(r"\ A: *. \ f: & _: A. A. \ x: A. f (f x)")
+    assert pickle.loads(pickle.dumps(two)) is two
+    table = TermTable()
+    position = table.add(DBApplication(func=two, arg=two))
+    assert len(table.rows) == len(set(table.rows))
+    assert terms_from_rows(table.rows)[position] is DBApplication(func=two, arg=two)
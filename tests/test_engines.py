@@ -0,0 +1,28 @@
+import pytest
+from library import parse_with_env
+from abstractSyntaxTree import Engine
+
+# every engine against every other one, on the library arithmetic and logic
+CASES = [
+    "plus three two", "mult two three", "exp two three", "succ (pred zero)", "pred four",
+    "minus four one", "minus one two", "leq two three", "leq three two", "eq two two", "eq two three",
+    "and true false", "or false true", "not (eq one zero)",
+]
+
+# the engines leave names they never apply folded, e.g. a resulting true
+def normal_form(application, engine):
+    program, defs = parse_with_env(f"({application}) {{nats}} {{bools}}")
+    program.to_beta_normal_form(engine=engine, defs=defs)
+    return program.to_de_bruijn().replace_free(defs.linked())
+
+# hash consing makes alpha-equal de Bruijn terms the same object
+@pytest.mark.parametrize("application", CASES)
+def test_engines_agree(application):
+    expected = normal_form(application, Engine.SUBSTITUTION)
+    for engine in Engine:
+        assert normal_form(application, engine) is expected, engine.name
+
+def test_results_are_the_expected_literals():
+    assert normal_form("plus three two", Engine.NBE) is normal_form("five", Engine.NBE)
+    assert normal_form("eq two two", Engine.NBE) is normal_form("true", Engine.NBE)
+    assert normal_form("leq three two", Engine.NBE) is normal_form("false", Engine.NBE)
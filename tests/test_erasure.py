@@ -0,0 +1,48 @@
+import pytest
+from parser import Parser
+from lexer import tokenize
+from library import parse_with_env
+from abstractSyntaxTree import Program, Engine
+from deBruijn import DBErased, DBAbstraction
+from erasure import ErasureError, erase, check, normalize_erased
+from normalization import normalize, evaluate
+
+def term(source):
+    return Parser(tokenize(source)).produce_ast().to_de_bruijn()
+
+def nodes(term):
+    todo, seen = [term], set()
+    while todo:
+        node = todo.pop()
+        if node in seen: continue
+        seen.add(node)
+        yield node
+        todo += [child for child, _ in node.children()]
+
+def test_erase_drops_abstraction_annotations_only():
+    erased = erase(term(r"\ A: *. \ f: & _: A. A. \ x: A. f x"))
+    assert [node.param_type for node in nodes(erased) if isinstance(node, DBAbstraction)] == [DBErased()] * 3
+    assert erase(term(r"& A: *. & _: A. A")) is term(r"& A: *. & _: A. A")
+
+# the normal form is computed without annotations and checked against the type to get them back
+def test_annotations_are_recovered_from_the_type():
+    program, defs = parse_with_env("(mult two three) {nats}")
+    linked = program.to_de_bruijn().replace_free(defs.linked())
+    linked_type = Program.from_de_bruijn(linked).infer_type().to_de_bruijn()
+    normal = normalize_erased(linked, linked_type, {})
+    assert normal is normalize(linked)
+    assert not any(isinstance(node, DBErased) for node in nodes(normal))
+
+def test_checking_against_a_non_product_fails():
+    with pytest.raises(ErasureError):
+        check(erase(term(r"\ A: *. A")), evaluate(term("*")), 0, None, None, {})
+
+# a free variable without a type cannot be checked, the annotated term is normalized instead
+def test_unrecoverable_annotations_fall_back_to_the_annotated_term():
+    source = term(r"(\ A: *. \ x: A. x) B y")
+    assert normalize_erased(source, term("B"), {}) is normalize(source) is term("y")
+
+def test_erasure_engine_keeps_free_variable_types():
+    program = Parser(tokenize(r"(\ A: *. \ x: A. x) B y")).produce_ast()
+    program.to_beta_normal_form({"B": Parser(tokenize("*")).produce_ast(), "y": Parser(tokenize("B")).produce_ast()}, engine=Engine.ERASURE)
+    assert program.to_de_bruijn() is term("y")
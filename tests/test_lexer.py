@@ -0,0 +1,54 @@
+import os
+import pytest
+import lexer
+from lexer import TokenError, TokenType, Span, scan, lex, tokenize
+from parser import Parser
+
+def test_tokens_carry_line_and_column_spans():
+    tokens = list(scan("\\ x: *.\n  /* two\nlines */ x_1 := {nats}", "a.lm"))
+    assert [(token.value, token.type) for token in tokens[:5]] == [("\\", TokenType.LAMBDA), ("x", TokenType.VAR), (":", TokenType.OFTYPE), ("*", TokenType.STAR), (".", TokenType.DOT)]
+    assert tokens[1].span == Span("a.lm", 1, 3, 1, 4)
+    assert tokens[5].value == "x_1" and tokens[5].span == Span("a.lm", 3, 10, 3, 13)
+    assert tokens[7].type == TokenType.INCLUDE and tokens[7].value == "nats"
+    assert tokens[-1].type == TokenType.EOF and tokens[-1].span == Span("a.lm", 3, 23, 3, 23)
+
+def test_parsed_nodes_span_their_source():
+    program = Parser(tokenize("(\\ x: *. x)\n  y")).produce_ast()
+    assert (program.span.line, program.span.column, program.span.end_line, program.span.end_column) == (1, 2, 2, 4)
+    assert (program.program.arg.span.line, program.program.arg.span.column) == (2, 3)
+
+@pytest.mark.parametrize("source, message", [
+    ("x /* open", "Unterminated comment at <input>:1:3"),
+    ("x\n {nats", "Unterminated include at <input>:2:2"),
+    ("x ?", "Token Error found at >?< during lexing (<input>:1:3)"),
+])
+def test_errors_name_their_position(source, message):
+    with pytest.raises(TokenError, match=message.replace("(", r"\(").replace(")", r"\)").replace("?", r"\?")):
+        list(scan(source))
+
+def test_included_files_are_lexed_once(tmp_path, monkeypatch):
+    (tmp_path / "base.lm").write_text("[b := *]")
+    top = tmp_path / "top.lm"
+    top.write_text("[t := *] {" + str(tmp_path / "base.lm") + "}")
+    scanned, scan_file = [], lexer.scan
+    monkeypatch.setattr(lexer, "scan", lambda *args: scanned.append(args[1:]) or scan_file(*args))
+    source = "x {" + str(top) + "} {" + str(tmp_path / "base.lm") + "}"
+    first = [token.value for token in lex(source)]
+    assert first == ["x", "[", "t", ":=", "*", "]", "[", "b", ":=", "*", "]", "[", "b", ":=", "*", "]", "EndOfFile"]
+    assert sorted(file for file, in scanned if file != "<input>") == sorted([os.path.realpath(top), os.path.realpath(tmp_path / "base.lm")])
+    scanned.clear()
+    assert [token.value for token in lex(source)] == first
+    assert scanned == [("<input>",)]
+
+def test_include_cycles_are_reported(tmp_path):
+    first, second = tmp_path / "first.lm", tmp_path / "second.lm"
+    first.write_text("[a := *] {" + str(second) + "}")
+    second.write_text("[b := *] {" + str(first) + "}")
+    with pytest.raises(TokenError) as error:
+        tokenize("x {" + str(first) + "}")
+    cycle = " -> ".join(os.path.realpath(path) for path in (first, second, first))
+    assert str(error.value) == f"Include cycle: {cycle}"
+
+def test_missing_includes_are_reported():
+    with pytest.raises(TokenError, match="Included file `no_such_library` not found"):
+        tokenize("x {no_such_library}")
@@ -0,0 +1,41 @@
+import os
+import pickle
+import library
+from library import load_prelude
+
+def numeral(n):
+    body = "x"
+    for _ in range(n): body = f"f ({body})"
+    return f"\\ A: *. \\ f: & _: A. A. \\ x: A. {body}"
+
+def test_deep_definitions_are_stored_and_loaded(tmp_path):
+    library = tmp_path / "deep.lm"
+    library.write_text(f"[deep := {numeral(3000)}]\n[two := {numeral(2)}]\n")
+    cache = str(tmp_path / "cache")
+    compiled = load_prelude((str(library),), cache)
+    loaded = load_prelude((str(library),), cache)
+    assert loaded is not compiled
+    assert loaded.definitions["deep"].term is compiled.definitions["deep"].term
+    assert loaded.definitions["two"].type is not None
+    assert pickle.loads(pickle.dumps(loaded)).definitions["deep"].folded is compiled.definitions["deep"].folded
+
+def test_warm_loads_only_compare_modification_times(tmp_path, monkeypatch):
+    (tmp_path / "base.lm").write_text(f"[two := {numeral(2)}]\n")
+    top = tmp_path / "top.lm"
+    top.write_text("[id := \\ A: *. \\ x: A. x]\n{" + str(tmp_path / "base.lm") + "}\n")
+    cache = str(tmp_path / "cache")
+    load_prelude((str(top),), cache)
+    lexed, scan = [], library.scan
+    monkeypatch.setattr(library, "scan", lambda *args: lexed.append(args) or scan(*args))
+    assert set(load_prelude((str(top),), cache).definitions) == {"id", "two"}
+    assert not lexed
+    (tmp_path / "base.lm").write_text(f"[two := {numeral(2)}]\n[three := {numeral(3)}]\n")
+    assert set(load_prelude((str(top),), cache).definitions) == {"id", "two", "three"}
+    # touched only: lexed again, the prelude is kept
+    os.utime(tmp_path / "base.lm", ns=(0, 0))
+    monkeypatch.setattr(library, "compile_prelude", None)
+    assert set(load_prelude((str(top),), cache).definitions) == {"id", "two", "three"}
+    assert lexed
+    lexed.clear()
+    load_prelude((str(top),), cache)
+    assert not lexed
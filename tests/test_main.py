@@ -0,0 +1,17 @@
+import io
+import json
+from abstractSyntaxTree import Engine
+from main import Job, run_batch, includes_of
+
+SLOW = "(eq (exp two (exp two four)) (exp two (exp two four))) {nats}"
+QUICK = "(plus two three) {nats}"
+FIVE = r"\ A: *. \ f: & _: A. A. \ x: A. f (f (f (f (f x))))"
+
+# one worker, so the quick job runs on the worker the slow one timed out on
+def test_timed_out_jobs_leave_the_worker_usable():
+    out = io.StringIO()
+    jobs = [Job("slow", SLOW, includes_of(SLOW)), Job("quick", QUICK, includes_of(QUICK))]
+    assert run_batch(jobs, Engine.NBE, 1, 0.5, True, False, out=out) == 1
+    results = {result["id"] : result for result in map(json.loads, out.getvalue().splitlines())}
+    assert results["slow"]["error"] == "timed out after 0.5s"
+    assert results["quick"]["normal_form"] == FIVE
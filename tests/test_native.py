@@ -0,0 +1,42 @@
+import pytest
+from library import parse_with_env
+from abstractSyntaxTree import Program, Engine
+from normalization import normalize
+from native import OPERATIONS, NAT, accelerate, read_nat
+
+NUMERALS = ["zero", "one", "two", "three"]
+
+def samples(name):
+    arg_types = OPERATIONS[name][0]
+    rows = [[]]
+    for arg_type in arg_types:
+        values = NUMERALS if arg_type == NAT else ["true", "false"]
+        rows = [row + [value] for row in rows for value in values]
+    return [f"{name} {' '.join(row)}" for row in rows]
+
+# the engines leave names they never apply folded, e.g. a resulting true
+def nbe(term, defs):
+    return normalize(term, defs).replace_free(defs.linked())
+
+def substitution(term, defs):
+    program = Program.from_de_bruijn(term)
+    program.to_beta_normal_form(engine=Engine.SUBSTITUTION, defs=defs)
+    return program.to_de_bruijn().replace_free(defs.linked())
+
+# hash consing makes alpha-equal de Bruijn terms the same object
+@pytest.mark.parametrize("application", [application for name in OPERATIONS for application in samples(name)])
+def test_accelerate_agrees_with_nbe(application):
+    program, defs = parse_with_env(f"({application}) {{nats}}")
+    term = program.to_de_bruijn()
+    # exp m zero has no numeral result and is left to the engine
+    assert (accelerate(term, defs) is term) == (application.startswith("exp") and application.endswith(" zero"))
+    assert nbe(accelerate(term, defs), defs) is nbe(term, defs)
+
+# the truncating cases, checked against plain substitution as well
+@pytest.mark.parametrize("application, value", [("pred zero", 0), ("pred one", 0), ("minus zero one", 0), ("minus one two", 0), ("minus one one", 0), ("minus two one", 1)])
+def test_truncating_operations_agree_with_substitution(application, value):
+    program, defs = parse_with_env(f"({application}) {{nats}}")
+    term = program.to_de_bruijn()
+    fast = accelerate(term, defs)
+    assert read_nat(fast) == value
+    assert fast is substitution(term, defs)
@@ -0,0 +1,36 @@
+from parser import Parser
+from lexer import tokenize
+from abstractSyntaxTree import Program
+from library import parse_program
+from printer import to_text
+
+def parse(source: str) -> Program:
+    return Parser(tokenize(source)).produce_ast()
+
+def shown(source: str) -> str:
+    return Program.from_de_bruijn(parse(source).to_de_bruijn()).to_str()
+
+def test_names_do_not_depend_on_what_was_built_first():
+    first = shown(r"\ T: *. \ a: T. \ b: T. a")
+    second = shown(r"\ X: *. \ p: X. \ q: X. p")
+    assert parse(r"\ T: *. \ a: T. \ b: T. a").to_de_bruijn() is parse(r"\ X: *. \ p: X. \ q: X. p").to_de_bruijn()
+    assert first == second == r"\ A: *. \ x: A. \ y: A. x"
+
+def test_names_follow_what_a_binder_binds():
+    assert shown(r"\ T: *. \ s: & _: T. T. \ z: T. s (s z)") == r"\ A: *. \ f: & _: A. A. \ x: A. f (f x)"
+    assert shown(r"& T: *. & a: T. & b: T. T") == r"& A: *. & _: A. & _: A. A"
+
+def test_names_avoid_free_names():
+    assert shown(r"\ a: *. \ b: a. x b") == r"\ A: *. \ y: A. x y"
+
+def test_shared_subterms_parse_back_to_the_same_term():
+    term = parse_program("(plus (mult three three) (mult three three)) {nats}").to_de_bruijn()
+    shared = to_text(term, share=True)
+    assert "[s1 := " in shared and len(shared) < len(to_text(term))
+    assert parse(shared).to_de_bruijn() is term
+
+def test_deep_terms_print_without_recursion():
+    depth = 5000
+    source = r"\ A: *. \ f: & _: A. A. \ x: A. " + "f (" * (depth - 1) + "f x" + ")" * (depth - 1)
+    assert parse(source).to_str() == source
+    assert Program.from_de_bruijn(parse(source).to_de_bruijn()).to_str() == source
@@ -0,0 +1,147 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pytest
+from abstractSyntaxTree import Engine
+from server import Server, start_server_worker, LINE_LIMIT
+
+QUICK = "(plus two three) {nats}"
+FIVE = r"\ A: *. \ f: & _: A. A. \ x: A. f (f (f (f (f x))))"
+# runs for many seconds on every engine
+SLOW = "(eq (exp two (exp two four)) (exp two (exp two four))) {nats}"
+
+@pytest.fixture(scope="module")
+def pool():
+    context = multiprocessing.get_context("forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+    with context.Manager() as manager:
+        registry = manager.dict()
+        # one worker, so a job only finishes quickly if the one before it was stopped
+        with ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=start_server_worker, initargs=({}, registry)) as executor:
+            yield executor, registry
+
+def send(writer, request):
+    writer.write(((request if isinstance(request, str) else json.dumps(request)) + "\n").encode())
+
+async def receive(reader, count):
+    answers = {}
+    for _ in range(count):
+        answer = json.loads(await asyncio.wait_for(reader.readline(), 60))
+        answers[answer["id"]] = answer
+    return answers
+
+def run(pool, scenario, timeout=None):
+    async def serve():
+        server = Server(pool[0], pool[1], Engine.NBE, timeout)
+        listener = await asyncio.start_server(server.handle, "127.0.0.1", 0, limit=LINE_LIMIT)
+        async with listener:
+            reader, writer = await asyncio.open_connection(*listener.sockets[0].getsockname()[:2])
+            try:
+                return server, await scenario(reader, writer)
+            finally:
+                writer.close()
+                await server.close()
+    return asyncio.run(serve())
+
+def test_equal_requests_share_one_computation(pool):
+    async def scenario(reader, writer):
+        for id in ("a", "b", "c"): send(writer, {"id": id, "source": QUICK})
+        return await receive(reader, 3)
+    server, answers = run(pool, scenario)
+    assert {answer["normal_form"] for answer in answers.values()} == {FIVE}
+    assert next(server.tickets) == 1
+
+def test_cancelled_job_frees_the_worker(pool):
+    async def scenario(reader, writer):
+        send(writer, {"id": "slow", "source": SLOW, "engine": "SUBSTITUTION"})
+        await asyncio.sleep(1)
+        send(writer, {"cancel": "slow"})
+        send(writer, {"id": "quick", "source": QUICK})
+        start = time.perf_counter()
+        answers = await receive(reader, 2)
+        return answers, time.perf_counter() - start
+    _, (answers, seconds) = run(pool, scenario)
+    assert answers["slow"]["error"] == "cancelled"
+    assert answers["quick"]["normal_form"] == FIVE
+    assert seconds < 5
+
+def test_deadline_and_timeout(pool):
+    async def scenario(reader, writer):
+        send(writer, {"id": "waited", "source": SLOW, "engine": "SUBSTITUTION", "deadline": 0.5})
+        first = await receive(reader, 1)
+        send(writer, {"id": "quick", "source": QUICK})
+        send(writer, {"id": "limited", "source": SLOW, "engine": "LAZY"})
+        return {**first, **await receive(reader, 2)}
+    server, answers = run(pool, scenario, timeout=1.0)
+    assert answers["waited"]["error"] == "deadline of 0.5s exceeded"
+    assert answers["quick"]["normal_form"] == FIVE
+    assert answers["limited"]["error"] == "timed out after 1.0s"
+    assert not server.inflight
+
+def test_requests_that_are_not_objects_are_answered(pool):
+    async def scenario(reader, writer):
+        for line in ("42", '["x"]', "{", json.dumps({"id": "a", "source": QUICK})): send(writer, line)
+        return [json.loads(await asyncio.wait_for(reader.readline(), 60)) for _ in range(4)]
+    _, answers = run(pool, scenario)
+    assert [answer["error"].split(":")[0] for answer in answers[:3]] == ["requests are JSON objects, not int", "requests are JSON objects, not list", "JSONDecodeError"]
+    assert answers[3]["normal_form"] == FIVE
+
+def stat(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            return file.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+
+# state and parent follow the command name, which may contain anything but a ")"
+def descendants(pid):
+    children = {}
+    for entry in os.listdir("/proc"):
+        fields = stat(entry) if entry.isdigit() else None
+        if fields is not None: children.setdefault(int(fields[1]), []).append(int(entry))
+    found, todo = set(), [pid]
+    while todo:
+        for child in children.get(todo.pop(), []):
+            found.add(child)
+            todo.append(child)
+    return found
+
+def alive(pid):
+    fields = stat(pid)
+    return fields is not None and fields[0] != "Z"
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="finds the worker processes through /proc")
+def test_sigterm_shuts_everything_down(tmp_path):
+    socket = str(tmp_path / "server.sock")
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "lambdaInterpreter", "server.py")
+    process = subprocess.Popen([sys.executable, script, "--socket", socket, "--jobs", "2"])
+    try:
+        async def scenario():
+            for _ in range(300):
+                if os.path.exists(socket): break
+                await asyncio.sleep(0.1)
+            reader, writer = await asyncio.open_unix_connection(socket)
+            send(writer, {"id": "slow", "source": SLOW, "engine": "SUBSTITUTION"})
+            await asyncio.sleep(2)
+            workers = descendants(process.pid)
+            process.send_signal(signal.SIGTERM)
+            answer = json.loads(await asyncio.wait_for(reader.readline(), 30))
+            writer.close()
+            return workers, answer
+        workers, answer = asyncio.run(scenario())
+        assert answer["error"] == "cancelled"
+        assert process.wait(30) == 0
+        assert workers
+        # the forkserver notices its parent is gone a little later
+        for _ in range(100):
+            if not any(alive(pid) for pid in workers): break
+            time.sleep(0.1)
+        assert not [pid for pid in workers if alive(pid)]
+        assert not os.path.exists(socket)
+    finally:
+        if process.poll() is None: process.kill()
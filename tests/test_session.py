@@ -0,0 +1,49 @@
+import pytest
+from abstractSyntaxTree import TypeInferenceError
+from session import Session, SessionError
+
+ID = r"\ A: *. \ x: A. x"
+BOOL = r"\ A: *. \ x: A. \ y: A. x"
+
+def state(session):
+    return {name: (session.env.lookup(name).term, session.normal_forms[name]) for name in session.env}, dict(session.uses)
+
+def test_redefinitions_recheck_their_dependents():
+    session = Session()
+    session.execute(f"id := {ID}")
+    session.execute("twice := \\ A: *. \\ x: A. id A (id A x)")
+    assert session.execute("user := twice") == "user defined"
+    assert session.execute("id := \\ B: *. \\ y: B. y") == "id defined, rechecked twice, user"
+
+def test_failed_redefinitions_leave_the_session_as_it_was():
+    session = Session()
+    session.execute(f"id := {ID}")
+    session.execute("twice := \\ A: *. \\ x: A. id A (id A x)")
+    session.execute("user := twice")
+    before = state(session)
+    # id stays well typed, twice applies it to one argument too many
+    with pytest.raises(SessionError, match="redefining `id` breaks `twice`"):
+        session.execute(f"id := {BOOL}")
+    assert state(session) == before
+    # id itself does not type check
+    with pytest.raises(TypeInferenceError):
+        session.execute("id := \\ A: *. \\ x: A. x x")
+    assert state(session) == before
+    with pytest.raises(SessionError, match="`missing` is not defined"):
+        session.execute("id := missing")
+    assert state(session) == before
+
+def test_definitions_cannot_depend_on_themselves():
+    session = Session()
+    session.execute(f"id := {ID}")
+    session.execute("alias := id")
+    before = state(session)
+    with pytest.raises(SessionError, match="`id` would depend on itself"):
+        session.execute("id := \\ A: *. \\ x: A. id A x")
+    with pytest.raises(SessionError, match="`id` would depend on itself"):
+        session.execute("id := alias")
+    assert state(session) == before
+    # a new name cannot use itself either, it is not defined yet
+    with pytest.raises(SessionError, match="`loop` is not defined"):
+        session.execute("loop := loop")
+    assert "loop" not in session.env
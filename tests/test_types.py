@@ -0,0 +1,39 @@
+import pytest
+from library import parse_program, parse_with_env
+from abstractSyntaxTree import TYPE_CACHE, Engine
+from instrumentation import TRACE
+
+NAT = r"& A: *. & _: & _: A. A. & _: A. A"
+
+def numeral(n):
+    body = "x"
+    for _ in range(n): body = f"f ({body})"
+    return f"\\ A: *. \\ f: & _: A. A. \\ x: A. {body}"
+
+def test_closed_subterms_are_inferred_once():
+    depth = 50
+    program = parse_program("succ (" * depth + "zero" + ")" * depth + " {nats}")
+    TYPE_CACHE.clear()
+    TRACE.reset()
+    TRACE.enable()
+    try:
+        assert program.infer_type().to_str() == NAT
+    finally:
+        TRACE.enable(False)
+    # every succ application is one closed subterm, succ and zero are found again when repeated
+    assert TRACE.counters["type_inferences"] <= 2 * depth + 20
+    assert TRACE.counters["type_cache_hits"] >= depth
+
+# deeper than the recursion limit, SUBSTITUTION is left out as the reference engine
+DEEP = f"(succ ({numeral(5000)})) {{nats}}"
+
+def test_deep_terms_are_typed():
+    TYPE_CACHE.clear()
+    assert parse_program(DEEP).infer_type().to_str() == NAT
+
+@pytest.mark.parametrize("engine", [engine for engine in Engine if engine != Engine.SUBSTITUTION])
+def test_deep_terms_are_normalized(engine):
+    program, defs = parse_with_env(DEEP)
+    program.to_beta_normal_form(engine=engine, defs=defs)
+    assert program.to_de_bruijn() is parse_program(numeral(5001)).to_de_bruijn()
+    assert program.to_str().endswith("f x" + ")" * 5000)